@@ -0,0 +1,1450 @@
+"""爆速議事録の性能計測スクリプト
+
+使い方:
+    python benchmark.py split --duration 7200 --parts 10
+    python benchmark.py template --count 200
+    python benchmark.py excel --topics 500 --summary-chars 2000
+    python benchmark.py stitch --pairs 100
+    python benchmark.py e2e --durations 10,60 --keys 1,5,10
+    python benchmark.py startup --exe dist/minutes_app
+    python benchmark.py keys --keys 10 --chunks 40
+    python benchmark.py models --settings pro/pro,flash/pro,flash/flash
+    python benchmark.py live --duration 30 --keys 5 --speed 30
+"""
+import os
+import sys
+import time
+import json
+import random
+import resource
+import datetime
+import itertools
+import statistics
+import argparse
+import re
+import subprocess
+import tempfile
+import io
+import contextlib
+import base64
+import threading
+import collections
+import concurrent.futures
+import http.server
+
+import openpyxl
+from openpyxl.styles import Alignment
+
+from docx import Document
+
+import minutes_app
+
+
+def generate_synthetic_audio(output_path, duration, bitrate='128k'):
+    """ffmpegで指定秒数の合成音声（ノイズ＋正弦波、7秒ごとに1.5秒の無音）を生成する関数"""
+    command = [
+        minutes_app.get_ffmpeg_path(),
+        '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=44100:duration={duration}',
+        '-f', 'lavfi', '-i', f'anoisesrc=color=pink:amplitude=0.1:sample_rate=44100:duration={duration}',
+        '-filter_complex', "amix=inputs=2:duration=shortest,volume='if(lt(mod(t,7),5.5),1,0)':eval=frame",
+        '-ac', '2', '-b:a', bitrate,
+        output_path
+    ]
+    subprocess.run(command, check=True)
+    return output_path
+
+
+def legacy_split_audio_file(audio_file_path, num_parts, output_dir):
+    """比較用: パートごとにffmpegを起動し、出力側で-ssを指定する従来の分割処理"""
+    duration = minutes_app.get_audio_duration(audio_file_path)
+    part_duration = duration / num_parts
+    overlap_duration = part_duration * 0.1
+
+    parts = []
+    for i in range(num_parts):
+        start_time = max(0, i * part_duration - (overlap_duration if i > 0 else 0))
+        part_file = os.path.join(output_dir, f"legacy_part{i+1}.mp3")
+        command = [
+            minutes_app.get_ffmpeg_path(),
+            '-y',
+            '-i', audio_file_path,
+            '-ss', str(start_time),
+            '-t', str(part_duration + (overlap_duration if i < num_parts - 1 else 0)),
+            '-c', 'copy',
+            part_file
+        ]
+        subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        parts.append(part_file)
+    return parts
+
+
+def single_pass_split_audio_file(audio_file_path, segments, output_dir):
+    """比較用: ffmpegを1回だけ起動し、すべてのパートを入力側シークで切り出す分割処理（パイプライン化する前の方式）"""
+    extension, encode_options = minutes_app.get_upload_encoding(audio_file_path)
+    inputs = []
+    outputs = []
+    parts = []
+    for i, segment in enumerate(segments):
+        part_file = minutes_app.get_part_file_path(audio_file_path, output_dir, i, extension)
+        inputs += ['-ss', str(segment.start), '-t', str(segment.end - segment.start), '-i', audio_file_path]
+        outputs += ['-map', f'{i}:a'] + encode_options + [part_file]
+        parts.append(part_file)
+    command = [str(minutes_app.get_ffmpeg_path()), '-y', '-v', 'error'] + inputs + outputs
+    subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return parts
+
+
+def bench_split(args):
+    """従来の分割処理・1パス分割処理・実際に使うパイプライン分割（iter_audio_parts）の所要時間を比較する
+
+    パイプライン分割はパートごとにffmpegを起動するため全体では1パスより遅くなりうるが、最初のパートが
+    できた時点で送信を始められる。全体の時間と最初のパートができるまでの時間を並べて表示する。
+    """
+    with tempfile.TemporaryDirectory(prefix='minutes_bench_') as bench_dir:
+        source = args.input
+        if not source:
+            source = os.path.join(bench_dir, 'synthetic.mp3')
+            print(f"合成音声を生成しています（{args.duration}秒）...")
+            generate_synthetic_audio(source, args.duration)
+        print(f"入力: {source} ({os.path.getsize(source) / (1024 * 1024):.1f}MB)")
+
+        duration = minutes_app.get_audio_duration(source)
+        fixed_segments = minutes_app.plan_audio_segments(duration, args.parts)
+
+        def single_pass(path, num_parts, output_dir):
+            return single_pass_split_audio_file(path, fixed_segments, output_dir)
+
+        def pipelined(segments):
+            def split(path, num_parts, output_dir):
+                return [part for _, part in minutes_app.iter_audio_parts(path, segments, output_dir)]
+            return split
+
+        def silence_aware(path, num_parts, output_dir):
+            return pipelined(minutes_app.plan_audio_split(path, num_parts))(path, num_parts, output_dir)
+
+        results = {}
+        splitters = (
+            ('legacy', legacy_split_audio_file), ('single_pass', single_pass),
+            ('pipelined', pipelined(fixed_segments)), ('silence_aware', silence_aware),
+        )
+        for name, splitter in splitters:
+            timings = []
+            for _ in range(args.repeat):
+                with minutes_app.temporary_work_dir() as work_dir:
+                    start = time.perf_counter()
+                    parts = splitter(source, args.parts, work_dir)
+                    timings.append(time.perf_counter() - start)
+                    total_bytes = sum(os.path.getsize(part) for part in parts)
+            results[name] = min(timings)
+            print(f"{name:>14}: {results[name]:.2f}秒 (最良値 / {args.repeat}回)  出力合計 {total_bytes / (1024 * 1024):.1f}MB")
+
+        first_part = []
+        for _ in range(args.repeat):
+            with minutes_app.temporary_work_dir() as work_dir:
+                start = time.perf_counter()
+                parts = minutes_app.iter_audio_parts(source, fixed_segments, work_dir)
+                next(parts)
+                first_part.append(time.perf_counter() - start)
+                parts.close()
+        print(f"最初のパートができるまで（pipelined）: {min(first_part):.2f}秒（1パス分割では全体の{results['single_pass']:.2f}秒）")
+        print(f"速度向上（pipelined、全体）: {results['legacy'] / results['pipelined']:.2f}倍")
+
+
+def legacy_create_minutes_from_template(data, template_path):
+    """比較用: 段落ごとに全キーを走査してparagraph.textを書き換える従来のテンプレート置換"""
+    doc = Document(template_path)
+    for paragraph in doc.paragraphs:
+        for key, value in data.items():
+            placeholder = f'「{key}」'
+            if placeholder in paragraph.text:
+                old_text = paragraph.text
+                new_text = paragraph.text.replace(placeholder, str(value) if value is not None else '')
+                paragraph.text = new_text
+                print(f"置換: '{old_text}' -> '{new_text}'")
+        for i in range(1, 11):
+            topic_key = f'議題{chr(0x2460 + i - 1)}'
+            summary_key = f'議題{chr(0x2460 + i - 1)}の要約'
+            for placeholder_key in (topic_key, summary_key):
+                placeholder = f'「{placeholder_key}」'
+                if placeholder in paragraph.text:
+                    old_text = paragraph.text
+                    new_text = paragraph.text.replace(placeholder, data.get(placeholder_key, ''))
+                    paragraph.text = new_text
+                    print(f"置換: '{old_text}' -> '{new_text}'")
+    return doc
+
+
+def sample_minutes(index):
+    """計測用の議事録データを作る"""
+    topics = [
+        minutes_app.MeetingTopic(minutes_app.get_topic_key(i), f"議題{i}の内容（会議{index}）", f"議題{i}について議論した。" * 8)
+        for i in range(1, minutes_app.MAX_TEMPLATE_TOPICS + 1)
+    ]
+    details = {'会議名': f"定例会議{index}", '日時': '2026-10-01', '場所': '会議室A', '参加者': '山田、佐藤、鈴木', '欠席者': 'なし'}
+    return minutes_app.MeetingMinutes(details, topics)
+
+
+def bench_template(args):
+    """従来のテンプレート置換と解析済みテンプレートの1秒あたりの作成数を比較する"""
+    template_path = args.template or minutes_app.get_default_template_path()
+    datasets = [sample_minutes(i).to_template_data() for i in range(args.count)]
+
+    start = time.perf_counter()
+    minutes_app.get_compiled_template(template_path)
+    print(f"テンプレートの解析: {(time.perf_counter() - start) * 1000:.1f}ms（初回のみ）")
+
+    def legacy(data):
+        doc = legacy_create_minutes_from_template(data, template_path)
+        doc.save(io.BytesIO())
+
+    def compiled(data):
+        minutes_app.get_compiled_template(template_path).render(data)
+
+    results = {}
+    for name, render in (('legacy', legacy), ('compiled', compiled)):
+        # 従来方式の置換ログは計測に含めるが、画面には出さない
+        with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            for data in datasets:
+                render(data)
+            elapsed = time.perf_counter() - start
+        results[name] = args.count / elapsed
+        print(f"{name:>9}: {results[name]:.1f}件/秒（{args.count}件 {elapsed:.2f}秒）")
+
+    print(f"速度向上: {results['compiled'] / results['legacy']:.2f}倍")
+
+
+def legacy_create_excel(extracted_info, output_file):
+    """比較用: セルごとに書式オブジェクトを作り、保存前に全列を走査する従来のExcel出力"""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "議事録"
+    ws.column_dimensions['A'].width = 20
+    ws.column_dimensions['B'].width = 80
+    for i, detail in enumerate(["会議名", "日時", "場所", "参加者", "欠席者"], start=1):
+        ws.cell(row=i, column=1, value=detail)
+        ws.cell(row=i, column=1).font = openpyxl.styles.Font(bold=True)
+        ws.cell(row=i, column=1).fill = openpyxl.styles.PatternFill(start_color="E0E0E0", end_color="E0E0E0", fill_type="solid")
+
+    row = 6
+    current_topic = ""
+    current_summary = ""
+    for line in extracted_info.split('\n'):
+        line = line.strip()
+        if line.startswith("議題"):
+            if current_topic and current_summary:
+                ws.cell(row=row, column=1, value=current_topic)
+                cell = ws.cell(row=row, column=2, value=current_summary)
+                cell.alignment = Alignment(wrap_text=True)
+                row += 1
+            parts = line.split(':', 1)
+            if len(parts) == 2:
+                current_topic = parts[0].strip()
+                current_summary = parts[1].strip()
+            else:
+                current_topic = line
+                current_summary = ""
+        elif "の要約" in line:
+            if current_topic and "の要約:" in line:
+                current_summary = line.split("の要約:", 1)[1].strip()
+        elif current_summary:
+            current_summary += " " + line.strip()
+    if current_topic and current_summary:
+        ws.cell(row=row, column=1, value=current_topic)
+        cell = ws.cell(row=row, column=2, value=current_summary)
+        cell.alignment = Alignment(wrap_text=True)
+
+    for row in ws['A1:B'+str(ws.max_row)]:
+        for cell in row:
+            cell.border = openpyxl.styles.Border(left=openpyxl.styles.Side(style='thin'),
+                                                 right=openpyxl.styles.Side(style='thin'),
+                                                 top=openpyxl.styles.Side(style='thin'),
+                                                 bottom=openpyxl.styles.Side(style='thin'))
+            if cell.column == 1:
+                cell.font = openpyxl.styles.Font(bold=True)
+                cell.fill = openpyxl.styles.PatternFill(start_color="E0E0E0", end_color="E0E0E0", fill_type="solid")
+            elif cell.column == 2:
+                cell.alignment = Alignment(wrap_text=True)
+
+    for column_cells in ws.columns:
+        length = max(len(str(cell.value)) for cell in column_cells)
+        if column_cells[0].column_letter == 'B':
+            ws.column_dimensions[column_cells[0].column_letter].width = min(100, max(80, length))
+    wb.save(output_file)
+
+
+def bench_excel(args):
+    """議題数・要約の長さを大きくしたときのExcel出力の所要時間を比較する"""
+    lines = []
+    for i in range(1, args.topics + 1):
+        lines.append(f"議題{i}: 議題{i}の内容")
+        lines.append(f"議題{i}の要約: " + ("議論の要約。" * (args.summary_chars // 6 + 1))[:args.summary_chars])
+        lines.append("")
+    extracted_info = '\n'.join(lines)
+    minutes = minutes_app.parse_extracted_info(extracted_info)
+    print(f"議題{len(minutes.topics)}件、要約{args.summary_chars}文字")
+
+    with tempfile.TemporaryDirectory(prefix='minutes_bench_') as bench_dir:
+        output_file = os.path.join(bench_dir, 'out.xlsx')
+
+        def consolidated():
+            workbook = minutes_app.ConsolidatedWorkbook(output_file)
+            for i in range(args.meetings):
+                workbook.add(f"会議{i + 1}", minutes)
+            workbook.close()
+
+        cases = (
+            ('legacy', lambda: legacy_create_excel(extracted_info, output_file)),
+            ('named_style', lambda: minutes_app.create_excel(minutes, output_file)),
+            (f'consolidated x{args.meetings}', consolidated),
+        )
+        results = {}
+        for name, run in cases:
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - start)
+            results[name] = min(timings)
+            print(f"{name:>18}: {results[name] * 1000:.1f}ms (最良値 / {args.repeat}回)  {os.path.getsize(output_file) / 1024:.0f}KB")
+
+        print(f"速度向上（named_style）: {results['legacy'] / results['named_style']:.2f}倍")
+
+
+class FakeApiError(Exception):
+    """偽のバックエンドが送出するAPIエラー（classify_errorはcodeで分類する）"""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class FakeBackend:
+    """ネットワークを使わずにGeminiの応答を模擬するバックエンド（minutes_app.GenaiBackendと同じメソッドを持つ）
+
+    1回のリクエストは latency + latency_per_mb × 送信MB 秒（±jitterの割合でゆらぐ）かかり、
+    指定した確率で429・503・400を返す。straggler_rateの確率で応答時間がstraggler_factor倍になる。
+    profilesにモデル名 -> {latency, latency_per_mb, rate_429, ...}を渡すと、そのモデルへのリクエストだけ値を置き換える。
+    streamを渡されると、応答時間のttft_ratioの割合が過ぎた時点から残りの時間をかけて応答を分けて返す。
+    stall_rateの確率で途中から応答が止まり、truncate_rateの確率で終了理由のないまま途中で終わる。
+    """
+
+    STREAM_PIECES = 10
+
+    def __init__(self, latency=0.2, latency_per_mb=0.5, jitter=0.3, rate_429=0.0, rate_5xx=0.0, rate_400=0.0,
+                 topics=10, chars_per_mb=3000, seed=None, straggler_rate=0.0, straggler_factor=5.0, profiles=None,
+                 ttft_ratio=0.3, stall_rate=0.0, truncate_rate=0.0, stall_seconds=3600.0):
+        self.latency = latency
+        self.latency_per_mb = latency_per_mb
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.rate_400 = rate_400
+        self.topics = topics
+        self.chars_per_mb = chars_per_mb
+        self.straggler_rate = straggler_rate
+        self.straggler_factor = straggler_factor
+        self.profiles = profiles or {}
+        self.ttft_ratio = ttft_ratio
+        self.stall_rate = stall_rate
+        self.truncate_rate = truncate_rate
+        self.stall_seconds = stall_seconds
+        self._random = random.Random(seed)
+        self._counter = itertools.count(1)
+
+    def _plan(self, size_bytes, model_name=None):
+        """(応答時間, 送出する例外またはNone)を決める"""
+        profile = self.profiles.get(model_name, {})
+        latency = profile.get('latency', self.latency)
+        latency_per_mb = profile.get('latency_per_mb', self.latency_per_mb)
+        rate_429 = profile.get('rate_429', self.rate_429)
+        rate_5xx = profile.get('rate_5xx', self.rate_5xx)
+        delay = (latency + latency_per_mb * size_bytes / (1024 * 1024)) * (1 + self._random.uniform(-self.jitter, self.jitter))
+        if self.straggler_rate and self._random.random() < self.straggler_rate:
+            delay *= self.straggler_factor
+        roll = self._random.random()
+        error = None
+        if roll < rate_429:
+            error = FakeApiError(429, "Resource has been exhausted (e.g. check quota).")
+        elif roll < rate_429 + rate_5xx:
+            error = FakeApiError(503, "The service is currently unavailable.")
+        elif roll < rate_429 + rate_5xx + self.rate_400:
+            error = FakeApiError(400, "Request contains an invalid argument.")
+        return max(0.0, delay), error
+
+    def _stream_chunks(self, text, delay):
+        """応答をSTREAM_PIECES個のStreamChunkに分けて、時間をかけて返す"""
+        roll = self._random.random()
+        step = max(1, -(-len(text) // self.STREAM_PIECES))
+        pieces = [text[i:i + step] for i in range(0, len(text), step)]
+        time.sleep(delay * self.ttft_ratio)
+        for i, piece in enumerate(pieces):
+            if i == len(pieces) // 2:
+                if roll < self.stall_rate:
+                    time.sleep(self.stall_seconds)
+                elif roll < self.stall_rate + self.truncate_rate:
+                    return
+            yield minutes_app.StreamChunk(piece, 'STOP' if i == len(pieces) - 1 else None)
+            time.sleep(delay * (1 - self.ttft_ratio) / len(pieces))
+
+    def _reply(self, text, total_tokens, delay, error, stream):
+        if stream is None or error is not None:
+            time.sleep(delay)
+            if error is not None:
+                raise error
+            return minutes_app.GenerationResult(text, total_tokens, len(text) // 2)
+        return minutes_app.GenerationResult(stream.consume(self._stream_chunks(text, delay)), total_tokens, len(text) // 2)
+
+    def generate_text(self, api_key, model_name, prompt, stream=None):
+        delay, error = self._plan(len(prompt.encode('utf-8')), model_name)
+        lines = []
+        for i in range(1, self.topics + 1):
+            lines.append(f"{minutes_app.get_topic_key(min(i, 20))}: 議題{i}の内容")
+            lines.append(f"{minutes_app.get_topic_key(min(i, 20))}の要約: 議題{i}について議論し、次回までに対応を決めた。")
+            lines.append("")
+        text = '\n'.join(lines)
+        return self._reply(text, len(prompt) // 2 + len(text) // 2, delay, error, stream)
+
+    def transcribe_audio(self, api_key, model_name, prompt, audio_file, mime_type, inline, stream=None):
+        size = os.path.getsize(audio_file)
+        delay, error = self._plan(size, model_name)
+        sentences = max(1, int(size / (1024 * 1024) * self.chars_per_mb / 20))
+        number = next(self._counter)
+        text = ''.join(f"これはパート{number}の{i}番目の発言です。" for i in range(sentences))
+        return self._reply(text, int(size / 1000) + len(text), delay, error, stream)
+
+
+# 会議でよく出る定型の言い回し（無関係な発言どうしでも同じ文字列が多数現れる）
+STOCK_PHRASES = (
+    "はい、ありがとうございます。", "承知しました。", "それでは次の議題に移ります。", "よろしくお願いします。",
+    "確認いたします。", "資料の三ページをご覧ください。", "何か質問はありますか。", "特にありません。",
+    "では、そのように進めます。", "ちょっと補足させてください。",
+)
+
+
+def stock_phrase_talk(rng, count):
+    return ''.join(rng.choice(STOCK_PHRASES) for _ in range(count))
+
+
+def paraphrase(rng, text, rate):
+    """モデルの言い換えを模して、rateの割合の文字を削除・置換・挿入する"""
+    pieces = []
+    for char in text:
+        roll = rng.random()
+        if roll < rate / 3:
+            continue
+        if roll < rate * 2 / 3:
+            pieces.append(rng.choice('あいうえおかきくけこ'))
+        elif roll < rate:
+            pieces.append(char + rng.choice('さしすせそ'))
+        else:
+            pieces.append(char)
+    return ''.join(pieces)
+
+
+def bench_stitch(args):
+    """つなぎ目の重複削除を確認する（無関係な文章を削除したら失敗として1を返す）
+
+    定型の言い回しだけでできた無関係な2つの文字起こし（削除してはいけない）と、前の文字起こしの
+    末尾を言い換えて先頭に付けた文字起こし（削除すべき）で、削除した文字数を調べる。
+    """
+    rng = random.Random(args.seed)
+    false_deletions = []
+    found = 0
+    errors = []
+    start = time.perf_counter()
+    for _ in range(args.pairs):
+        previous_text = stock_phrase_talk(rng, args.phrases)
+        unrelated = stock_phrase_talk(rng, args.phrases)
+        _, removed = minutes_app.stitch_transcripts([previous_text, unrelated], [False, True])
+        if removed[0]:
+            false_deletions.append(removed[0])
+
+        overlap = previous_text[-args.overlap_chars:]
+        _, removed = minutes_app.stitch_transcripts(
+            [previous_text, paraphrase(rng, overlap, args.paraphrase_rate) + unrelated], [False, True]
+        )
+        if removed[0]:
+            found += 1
+            errors.append(removed[0] - len(overlap))
+    elapsed = time.perf_counter() - start
+
+    print(f"無関係な文章で削除した件数: {len(false_deletions)}/{args.pairs}" + (f"（{max(false_deletions)}文字まで）" if false_deletions else ''))
+    print(f"重複を見つけた件数: {found}/{args.pairs}（言い換え{args.paraphrase_rate:.0%}、重複{args.overlap_chars}文字）"
+          + (f"  削除した文字数の誤差 {min(errors):+d}〜{max(errors):+d}" if errors else ''))
+    print(f"1つなぎ目あたり {elapsed / (args.pairs * 2) * 1000:.1f}ms")
+    return 1 if false_deletions else 0
+
+
+def get_git_revision():
+    """計測したコミット（未コミットの変更があれば-dirtyを付ける）"""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        return revision + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def get_results_path(name):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_results', f"{name}.jsonl")
+
+
+def load_results(path):
+    """保存済みの計測結果を読み込む"""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_results(path, records):
+    """計測結果をコミットごとに比較できるよう、JSONLに追記する"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    print(f"結果を保存しました: {path}")
+
+
+def setup_fake_run(args, work_dir):
+    """子プロセスの計測用に、一時ディレクトリへの出力・トレースと偽のバックエンドを設定する（出力先を返す）"""
+    output_dir = os.path.join(work_dir, 'out')
+    os.makedirs(output_dir)
+    os.environ.update({
+        'MINUTES_CACHE': '0',
+        'MINUTES_JOB_STORE': os.path.join(work_dir, 'jobs.db'),
+        'MINUTES_TRACE': '1',
+        'MINUTES_TRACE_FILE': os.path.join(work_dir, 'trace.jsonl'),
+        'MINUTES_METRICS_FILE': os.path.join(work_dir, 'metrics.prom'),
+        'MINUTES_OUTPUT_DIR': output_dir,
+        'MINUTES_OUTPUT_FORMATS': 'xlsx',
+        'GEMINI_RPM_LIMIT': str(args.rpm),
+        'GEMINI_TPM_LIMIT': '0',
+        'MINUTES_RETRY_QUOTA_DELAY': str(args.quota_delay),
+        'MINUTES_RETRY_BASE_DELAY': str(args.retry_delay),
+        'MINUTES_HEDGE': '1' if args.hedge else '0',
+        'MINUTES_STREAM': '0' if args.no_stream else '1',
+        'MINUTES_STREAM_STALL_TIMEOUT': str(args.stall_timeout),
+    })
+    minutes_app.API_KEYS = [f"fake-key-{i + 1}" for i in range(args.keys)]
+    minutes_app.set_backend(FakeBackend(
+        latency=args.latency, latency_per_mb=args.latency_per_mb, rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx, rate_400=args.rate_400, seed=args.seed,
+        straggler_rate=args.straggler_rate, straggler_factor=args.straggler_factor,
+        profiles=json.loads(args.profiles) if getattr(args, 'profiles', None) else None,
+        stall_rate=args.stall_rate, truncate_rate=args.truncate_rate
+    ))
+    return output_dir
+
+
+def summarize_stages():
+    """トレースからステージごとの件数・エラー数・p50・p95・合計を集計する"""
+    summary, _ = minutes_app.summarize_trace(os.environ['MINUTES_TRACE_FILE'])
+    return {row['stage']: {key: row[key] for key in ('count', 'errors', 'p50', 'p95', 'total')} for row in summary}
+
+
+def run_e2e_case(args):
+    """1ケース分の計測（e2eから子プロセスとして呼ばれ、結果をJSONで標準出力に書く）"""
+    with tempfile.TemporaryDirectory(prefix='minutes_e2e_') as work_dir:
+        output_dir = setup_fake_run(args, work_dir)
+        if args.transcription_model:
+            os.environ['GEMINI_TRANSCRIPTION_MODEL'] = args.transcription_model
+        if args.extraction_model:
+            os.environ['GEMINI_EXTRACTION_MODEL'] = args.extraction_model
+        if args.fallback_models is not None:
+            os.environ['GEMINI_TRANSCRIPTION_FALLBACK_MODELS'] = args.fallback_models
+            os.environ['GEMINI_EXTRACTION_FALLBACK_MODELS'] = args.fallback_models
+
+        start = time.perf_counter()
+        success = minutes_app.process_audio_file(args.audio, force=True)
+        audio_seconds = time.perf_counter() - start
+
+        stem = os.path.splitext(os.path.basename(args.audio))[0]
+        start = time.perf_counter()
+        minutes_app.create_minutes(os.path.join(output_dir, f"{stem}_抽出結果.xlsx"), None, os.path.join(output_dir, f"{stem}_議事録.docx"))
+        docx_seconds = time.perf_counter() - start
+
+        with open(os.environ['MINUTES_TRACE_FILE'], encoding='utf-8') as f:
+            job = next((record for record in map(json.loads, f) if record['name'] == 'job'), {})
+        # Linuxのru_maxrssはKB単位
+        result = {
+            'success': success,
+            'wall_seconds': audio_seconds + docx_seconds,
+            'audio_seconds': audio_seconds,
+            'docx_seconds': docx_seconds,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'peak_child_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+            'stages': summarize_stages(),
+        }
+        if 'hedges' in job:
+            result['hedge'] = {key: job[key] for key in ('hedges', 'hedge_wins', 'hedge_rate', 'chunk_p99', 'chunk_p99_unhedged')}
+    print(json.dumps(result, ensure_ascii=False))
+
+
+def run_e2e_subprocess(args, audio, keys, extra_arguments=(), case='e2e-run'):
+    """e2e-run（またはcaseで指定した計測）を子プロセスで実行し、結果を返す（失敗した場合はNone）"""
+    command = [
+        sys.executable, os.path.abspath(__file__), case, '--audio', audio, '--keys', str(keys),
+        '--latency', str(args.latency), '--latency-per-mb', str(args.latency_per_mb),
+        '--rate-429', str(args.rate_429), '--rate-5xx', str(args.rate_5xx), '--rate-400', str(args.rate_400),
+        '--rpm', str(args.rpm), '--quota-delay', str(args.quota_delay), '--retry-delay', str(args.retry_delay),
+        '--straggler-rate', str(args.straggler_rate), '--straggler-factor', str(args.straggler_factor),
+        '--stall-rate', str(args.stall_rate), '--truncate-rate', str(args.truncate_rate), '--stall-timeout', str(args.stall_timeout),
+    ]
+    if args.hedge:
+        command.append('--hedge')
+    if args.no_stream:
+        command.append('--no-stream')
+    if args.seed is not None:
+        command += ['--seed', str(args.seed)]
+    command += list(extra_arguments)
+    completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=None if args.verbose else subprocess.DEVNULL,
+                               text=True, encoding='utf-8')
+    if completed.returncode != 0 or not completed.stdout.strip():
+        return None
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def stage_total(stages, *names):
+    return sum(stages.get(name, {}).get('total', 0.0) for name in names)
+
+
+def bench_e2e(args):
+    """合成音声と偽のバックエンドで、音声処理からWord作成までを通しで計測する"""
+    durations = [float(value) for value in args.durations.split(',')]
+    key_counts = [int(value) for value in args.keys.split(',')]
+    params = {
+        'latency': args.latency, 'latency_per_mb': args.latency_per_mb, 'rate_429': args.rate_429,
+        'rate_5xx': args.rate_5xx, 'rate_400': args.rate_400, 'rpm': args.rpm,
+    }
+    # 遅延するリクエストとヘッジは指定した場合だけ条件に含める（以前の結果と比較できるようにする）
+    if args.straggler_rate:
+        params.update(straggler_rate=args.straggler_rate, straggler_factor=args.straggler_factor)
+    if args.hedge:
+        params['hedge'] = True
+    if args.stall_rate or args.truncate_rate:
+        params.update(stall_rate=args.stall_rate, truncate_rate=args.truncate_rate, stall_timeout=args.stall_timeout)
+    if args.no_stream:
+        params['stream'] = False
+    revision = get_git_revision()
+    results_path = args.results or get_results_path('e2e')
+    previous = load_results(results_path)
+
+    print(f"コミット: {revision}  条件: {params}")
+    print(f"{'minutes':>8}{'keys':>6}{'wall':>9}{'split':>8}{'tr.p50':>8}{'tr.p95':>8}{'wait':>8}{'extract':>9}{'docx':>7}{'rss':>8}{'ffmpeg':>8}  比較")
+    records = []
+    with tempfile.TemporaryDirectory(prefix='minutes_bench_') as bench_dir:
+        for duration in durations:
+            audio = os.path.join(bench_dir, f"synthetic_{int(duration)}min.mp3")
+            generate_synthetic_audio(audio, int(duration * 60))
+            for keys in key_counts:
+                for _ in range(args.repeat):
+                    result = run_e2e_subprocess(args, audio, keys)
+                    if result is None:
+                        print(f"{duration:>8.0f}{keys:>6}  計測に失敗しました")
+                        continue
+                    record = dict(result, commit=revision, timestamp=datetime.datetime.now().isoformat(timespec='seconds'),
+                                  duration_minutes=duration, keys=keys, params=params)
+                    records.append(record)
+
+                    stages = result['stages']
+                    baseline = next((r for r in reversed(previous) if r.get('commit') != revision and r.get('params') == params
+                                     and r.get('duration_minutes') == duration and r.get('keys') == keys), None)
+                    comparison = ''
+                    if baseline:
+                        change = (result['wall_seconds'] / baseline['wall_seconds'] - 1) * 100
+                        comparison = f"{baseline['commit']}比 {change:+.1f}%"
+                    print(
+                        f"{duration:>8.0f}{keys:>6}{result['wall_seconds']:>9.2f}"
+                        f"{stage_total(stages, 'detect_silences', 'split_audio_part'):>8.2f}"
+                        f"{stages.get('transcribe', {}).get('p50', 0):>8.2f}{stages.get('transcribe', {}).get('p95', 0):>8.2f}"
+                        f"{stage_total(stages, 'transcribe_attempt.wait', 'extract_attempt.wait', 'extract_map_attempt.wait', 'extract_merge_attempt.wait'):>8.2f}"
+                        f"{stage_total(stages, 'extract', 'extract_merge'):>9.2f}{result['docx_seconds']:>7.2f}"
+                        f"{result['peak_rss_mb']:>7.0f}M{result['peak_child_rss_mb']:>7.0f}M  {comparison}"
+                        + ('' if result['success'] else '  （失敗）')
+                    )
+                    if 'hedge' in result:
+                        hedge = result['hedge']
+                        print(f"{'':>14}重複リクエスト {hedge['hedges']}件（{hedge['hedge_rate']:.0%}、採用{hedge['hedge_wins']}件）  "
+                              f"パートのp99 {hedge['chunk_p99']:.2f}秒（重複なし {hedge['chunk_p99_unhedged']:.2f}秒以上）")
+                    if args.stall_rate or args.truncate_rate:
+                        attempts = stages.get('transcribe_attempt', {})
+                        ttft = stages.get('transcribe_attempt.ttft', {})
+                        print(f"{'':>14}文字起こしの試行 {attempts.get('count', 0)}件（途切れなどで失敗{attempts.get('errors', 0)}件）  "
+                              f"最初の応答までp50 {ttft.get('p50', 0):.2f}秒")
+
+    append_results(results_path, records)
+
+
+def write_progressively(source, destination, speed, tick=0.1):
+    """録音中のファイルを模して、sourceの内容を実時間のspeed倍の速さでdestinationに少しずつ書き込む"""
+    duration = minutes_app.get_audio_duration(source)
+    with open(source, 'rb') as f:
+        data = f.read()
+    step = max(1, int(len(data) / duration * speed * tick))
+    with open(destination, 'wb') as f:
+        for position in range(0, len(data), step):
+            f.write(data[position:position + step])
+            f.flush()
+            time.sleep(tick)
+
+
+def run_live_case(args):
+    """ライブモードの1ケース分の計測（liveから子プロセスとして呼ばれ、結果をJSONで標準出力に書く）
+
+    合成音声を録音中のファイルのように書き込みながらLiveTranscriberで追いかけ、
+    書き込みが終わってから（録音の終了から）議事録の情報が出力されるまでの時間を測る。
+    """
+    with tempfile.TemporaryDirectory(prefix='minutes_live_') as work_dir:
+        setup_fake_run(args, work_dir)
+        recording = os.path.join(work_dir, os.path.basename(args.audio))
+        transcriber = minutes_app.LiveTranscriber(
+            recording, segment_seconds=args.segment_minutes * 60, poll_interval=args.interval, idle_seconds=float('inf')
+        )
+        writer = threading.Thread(target=write_progressively, args=(args.audio, recording, args.speed))
+        start = time.perf_counter()
+        writer.start()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(transcriber.run)
+            writer.join()
+            stopped_at = time.perf_counter()
+            parts_before_stop = transcriber.finished_count
+            transcriber.stop()
+            success = future.result()
+        finalize_seconds = time.perf_counter() - stopped_at
+        result = {
+            'success': success,
+            'recording_seconds': stopped_at - start,
+            'finalize_seconds': finalize_seconds,
+            'parts': len(transcriber.segments),
+            'parts_before_stop': parts_before_stop,
+            'stages': summarize_stages(),
+        }
+    print(json.dumps(result, ensure_ascii=False))
+
+
+def bench_live(args):
+    """ライブモード（録音中に文字起こしを進める）と、録音の終了後に一括で処理する場合を比較する
+
+    どちらも録音の終了から議事録の情報（Excel）が出力されるまでの時間を測る。
+    """
+    params = {
+        'latency': args.latency, 'latency_per_mb': args.latency_per_mb, 'rate_429': args.rate_429,
+        'rate_5xx': args.rate_5xx, 'rate_400': args.rate_400, 'rpm': args.rpm,
+        'speed': args.speed, 'segment_minutes': args.segment_minutes,
+    }
+    revision = get_git_revision()
+    results_path = args.results or get_results_path('live')
+    previous = load_results(results_path)
+
+    print(f"コミット: {revision}  条件: {params}")
+    print(f"{'minutes':>8}{'keys':>6}{'record':>8}{'parts':>7}{'done':>6}{'live':>8}{'batch':>8}{'短縮':>8}  比較")
+    records = []
+    with tempfile.TemporaryDirectory(prefix='minutes_bench_') as bench_dir:
+        audio = os.path.join(bench_dir, f"synthetic_{int(args.duration)}min.mp3")
+        generate_synthetic_audio(audio, int(args.duration * 60))
+        live_arguments = ['--segment-minutes', str(args.segment_minutes), '--speed', str(args.speed), '--interval', str(args.interval)]
+        for _ in range(args.repeat):
+            live = run_e2e_subprocess(args, audio, args.keys, live_arguments, case='live-run')
+            batch = run_e2e_subprocess(args, audio, args.keys)
+            if live is None or batch is None:
+                print(f"{args.duration:>8.0f}{args.keys:>6}  計測に失敗しました")
+                continue
+            record = {
+                'commit': revision, 'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+                'duration_minutes': args.duration, 'keys': args.keys, 'params': params,
+                'success': live['success'] and batch['success'],
+                'recording_seconds': live['recording_seconds'], 'parts': live['parts'], 'parts_before_stop': live['parts_before_stop'],
+                'live_seconds': live['finalize_seconds'], 'batch_seconds': batch['audio_seconds'],
+                'live_stages': live['stages'],
+            }
+            records.append(record)
+
+            baseline = next((r for r in reversed(previous) if r.get('commit') != revision and r.get('params') == params
+                             and r.get('duration_minutes') == args.duration and r.get('keys') == args.keys), None)
+            comparison = ''
+            if baseline:
+                change = (record['live_seconds'] / baseline['live_seconds'] - 1) * 100
+                comparison = f"{baseline['commit']}比 {change:+.1f}%"
+            print(
+                f"{args.duration:>8.0f}{args.keys:>6}{record['recording_seconds']:>8.1f}{record['parts']:>7}{record['parts_before_stop']:>6}"
+                f"{record['live_seconds']:>8.2f}{record['batch_seconds']:>8.2f}"
+                f"{1 - record['live_seconds'] / max(record['batch_seconds'], 1e-9):>9.0%}  {comparison}"
+                + ('' if record['success'] else '  （失敗）')
+            )
+
+    append_results(results_path, records)
+
+
+# modelsの設定で使える短い名前
+MODEL_ALIASES = {
+    'pro': 'gemini-1.5-pro',
+    'flash': 'gemini-1.5-flash',
+    'flash-8b': 'gemini-1.5-flash-8b',
+}
+
+# 記録がないモデルに使う応答の傾向（実測値ではない仮の値。--recorded・--profilesで置き換える）
+DEFAULT_MODEL_PROFILES = {
+    'gemini-1.5-pro': {'latency': 1.0, 'latency_per_mb': 1.2, 'rate_429': 0.05},
+    'gemini-1.5-flash': {'latency': 0.4, 'latency_per_mb': 0.4, 'rate_429': 0.0},
+    'gemini-1.5-flash-8b': {'latency': 0.3, 'latency_per_mb': 0.25, 'rate_429': 0.0},
+}
+
+# プロンプトの文字数から送信バイト数を見積もる（日本語はUTF-8で1文字約3バイト）
+BYTES_PER_PROMPT_CHAR = 3
+
+
+def load_model_profiles(trace_path):
+    """実際の処理で記録したトレース（MINUTES_TRACE）から、モデルごとの応答の傾向を求める
+
+    成功したAPIの試行を 応答時間 = latency + latency_per_mb × 送信MB として最小二乗法で当てはめ、
+    試行のうち429だった割合をrate_429とする。
+    """
+    points = collections.defaultdict(list)
+    attempts = collections.Counter()
+    quota_errors = collections.Counter()
+    for line in minutes_app.read_trace_lines(trace_path):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        model = record.get('model')
+        if not model or not record.get('name', '').endswith(('_attempt', '_hedge')):
+            continue
+        attempts[model] += 1
+        quota_errors[model] += record.get('outcome') == minutes_app.ERROR_QUOTA
+        if record.get('status') == 'ok':
+            size = record.get('bytes_sent') or record.get('prompt_chars', 0) * BYTES_PER_PROMPT_CHAR
+            points[model].append((size / (1024 * 1024), float(record.get('duration', 0))))
+
+    profiles = {}
+    for model, samples in points.items():
+        mean_mb = statistics.fmean(mb for mb, _ in samples)
+        mean_seconds = statistics.fmean(seconds for _, seconds in samples)
+        variance = sum((mb - mean_mb) ** 2 for mb, _ in samples)
+        slope = sum((mb - mean_mb) * (seconds - mean_seconds) for mb, seconds in samples) / variance if variance else 0.0
+        slope = max(0.0, slope)
+        profiles[model] = {
+            'latency': max(0.0, mean_seconds - slope * mean_mb),
+            'latency_per_mb': slope,
+            'rate_429': quota_errors[model] / attempts[model],
+            'samples': len(samples),
+        }
+    return profiles
+
+
+def parse_model_setting(setting):
+    """「文字起こしのモデル/情報抽出のモデル」を(文字起こしのモデル, 情報抽出のモデル)に変換する"""
+    transcription, _, extraction = (part.strip() for part in setting.partition('/'))
+    transcription = MODEL_ALIASES.get(transcription, transcription)
+    extraction = MODEL_ALIASES.get(extraction, extraction) or transcription
+    return transcription, extraction
+
+
+def count_fallback_attempts(stages, transcription_model, extraction_model):
+    """指定したモデル以外（クォータ超過時の代替モデル）に送ったAPIの試行の数"""
+    count = 0
+    for name, row in stages.items():
+        stage, _, model = name.partition('@')
+        if not model or not stage.endswith('_attempt'):
+            continue
+        if model != (transcription_model if stage.startswith('transcribe') else extraction_model):
+            count += row['count']
+    return count
+
+
+def bench_models(args):
+    """文字起こし・情報抽出のモデルの組み合わせごとに、偽のバックエンドで処理時間とスループットを比較する
+
+    モデルごとの応答時間・429の割合は、--recordedのトレースか--profilesのJSONから与える（なければ仮の値）。
+    出力の品質は計測しないため、候補を絞った後で実際の音声の結果を確認すること。
+    """
+    profiles = dict(DEFAULT_MODEL_PROFILES)
+    origins = dict.fromkeys(profiles, "仮の値")
+    if args.profiles:
+        with open(args.profiles, encoding='utf-8') as f:
+            loaded = json.load(f)
+        profiles.update(loaded)
+        origins.update(dict.fromkeys(loaded, args.profiles))
+    if args.recorded:
+        loaded = load_model_profiles(args.recorded)
+        profiles.update(loaded)
+        origins.update(dict.fromkeys(loaded, args.recorded))
+
+    settings = [(label.strip(), parse_model_setting(label)) for label in args.settings.split(',') if label.strip()]
+    used_models = {model for _, pair in settings for model in pair}
+    for model in sorted(used_models):
+        profile = profiles.get(model)
+        if profile is None:
+            print(f"{model}: 応答の傾向が不明なため、--latencyなどの既定値を使います")
+            continue
+        print(f"{model}: 基本{profile['latency']:.2f}秒 + {profile['latency_per_mb']:.2f}秒/MB  "
+              f"429 {profile.get('rate_429', 0.0):.0%}（{origins[model]}）")
+
+    params = {
+        'latency': args.latency, 'latency_per_mb': args.latency_per_mb, 'rate_429': args.rate_429,
+        'rate_5xx': args.rate_5xx, 'rpm': args.rpm, 'keys': args.keys, 'duration_minutes': args.duration,
+        'fallback_models': args.fallback_models,
+    }
+    revision = get_git_revision()
+    results_path = args.results or get_results_path('models')
+    print(f"コミット: {revision}  音声: {args.duration:g}分  キー: {args.keys}  計測回数: {args.repeat}")
+    print(f"{'setting':<22}{'wall':>9}{'x-rt':>8}{'tr.p50':>8}{'tr.p95':>8}{'extract':>9}{'errors':>8}{'fallback':>10}  比較")
+    records = []
+    first_wall = None
+    with tempfile.TemporaryDirectory(prefix='minutes_bench_') as bench_dir:
+        audio = os.path.join(bench_dir, f"synthetic_{int(args.duration)}min.mp3")
+        generate_synthetic_audio(audio, int(args.duration * 60))
+        for label, (transcription_model, extraction_model) in settings:
+            extra_arguments = [
+                '--transcription-model', transcription_model, '--extraction-model', extraction_model,
+                '--profiles', json.dumps(profiles),
+            ]
+            if args.fallback_models is not None:
+                extra_arguments += ['--fallback-models', args.fallback_models]
+            results = [result for result in (run_e2e_subprocess(args, audio, args.keys, extra_arguments)
+                                             for _ in range(args.repeat)) if result is not None]
+            if not results:
+                print(f"{label:<22}  計測に失敗しました")
+                continue
+
+            median = statistics.median
+            stages = [result['stages'] for result in results]
+            row = {
+                'wall_seconds': median(result['wall_seconds'] for result in results),
+                'realtime_factor': median(args.duration * 60 / result['audio_seconds'] for result in results),
+                'transcribe_p50': median(stage.get('transcribe', {}).get('p50', 0) for stage in stages),
+                'transcribe_p95': median(stage.get('transcribe', {}).get('p95', 0) for stage in stages),
+                'extract_seconds': median(stage_total(stage, 'extract', 'extract_merge') for stage in stages),
+                'attempt_errors': median(sum(row['errors'] for name, row in stage.items() if name.endswith('_attempt'))
+                                         for stage in stages),
+                'fallback_attempts': median(count_fallback_attempts(stage, transcription_model, extraction_model)
+                                            for stage in stages),
+                'success': all(result['success'] for result in results),
+            }
+            first_wall = first_wall or row['wall_seconds']
+            comparison = f"{(row['wall_seconds'] / first_wall - 1) * 100:+.1f}%" if row['wall_seconds'] != first_wall else ''
+            print(
+                f"{label:<22}{row['wall_seconds']:>9.2f}{row['realtime_factor']:>7.1f}x{row['transcribe_p50']:>8.2f}"
+                f"{row['transcribe_p95']:>8.2f}{row['extract_seconds']:>9.2f}{row['attempt_errors']:>8.0f}"
+                f"{row['fallback_attempts']:>10.0f}  {comparison}" + ('' if row['success'] else '  （失敗）')
+            )
+            records.append(dict(row, commit=revision, timestamp=datetime.datetime.now().isoformat(timespec='seconds'),
+                                setting=label, transcription_model=transcription_model, extraction_model=extraction_model,
+                                profiles={model: profiles.get(model) for model in used_models}, params=params))
+
+    append_results(results_path, records)
+
+
+def profile_imports(top):
+    """python -X importtimeでminutes_appの読み込み時間と、時間のかかる直接の依存モジュールを調べる"""
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import minutes_app'],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    total = 0.0
+    children = []
+    pending = []  # 直前のトップレベルのimport以降に読み込まれた直接の依存モジュール
+    for line in completed.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)', line)
+        if not match:
+            continue
+        cumulative = int(match.group(2)) / 1e6
+        depth = len(match.group(3)) // 2
+        if depth == 0:
+            if match.group(4) == 'minutes_app':
+                total = cumulative
+                children = pending
+            pending = []
+        elif depth == 1:
+            pending.append((cumulative, match.group(4)))
+    return total, sorted(children, reverse=True)[:top]
+
+
+def measure_command(command, repeat, env=None):
+    """コマンドの実行時間（中央値、秒）"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env,
+                       cwd=os.path.dirname(os.path.abspath(__file__)))
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+# 最初の画面を描画したら時刻を出力して終了するよう、show_main_menuを包んでGUIを起動する
+# （計測用のコードをアプリ本体に置かず、benchmark.pyのopenpyxlなどの読み込みも計測に含めない）
+FIRST_WINDOW_PROBE = """
+import sys, time
+import minutes_app
+
+show_main_menu = minutes_app.show_main_menu
+
+def show_main_menu_and_report():
+    show_main_menu()
+    minutes_app.show_main_menu = show_main_menu
+
+    def report_ready():
+        minutes_app.root.update_idletasks()
+        print(f"startup-ready {time.time():.6f}", flush=True)
+        minutes_app.root.destroy()
+    minutes_app.root.after(0, report_ready)
+
+minutes_app.show_main_menu = show_main_menu_and_report
+sys.exit(minutes_app.main([]))
+"""
+
+APP_WINDOW_TITLE = "爆速議事録"
+
+
+def is_window_shown(title):
+    """タイトルがtitleのウィンドウが表示されているか（判定できない環境ではNone）"""
+    if sys.platform == 'win32':
+        import ctypes
+        return bool(ctypes.windll.user32.FindWindowW(None, title))
+    try:
+        return subprocess.run(['xwininfo', '-name', title], capture_output=True).returncode == 0
+    except OSError:
+        return None
+
+
+def measure_first_window(repeat):
+    """スクリプトの起動から最初の画面が描画されるまでの時間（中央値、秒）。画面を表示できない環境ではNone"""
+    timings = []
+    for _ in range(repeat):
+        started_at = time.time()
+        completed = subprocess.run([sys.executable, '-c', FIRST_WINDOW_PROBE], capture_output=True, text=True, timeout=120,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+        match = re.search(r'startup-ready ([\d.]+)', completed.stdout)
+        if not match:
+            reason = (completed.stderr.strip().splitlines() or ['不明'])[-1]
+            print(f"  最初の画面を計測できませんでした: {reason}")
+            return None
+        timings.append(float(match.group(1)) - started_at)
+    return statistics.median(timings)
+
+
+def measure_exe_first_window(exe, repeat, timeout=120.0):
+    """実行ファイルの起動からアプリのウィンドウが表示されるまでの時間（中央値、秒）。判定できない環境ではNone
+
+    実行ファイルには計測用のコードを入れられないため、外からウィンドウのタイトルで表示を確認する。
+    """
+    if is_window_shown(APP_WINDOW_TITLE) is None:
+        print("  最初の画面を計測できませんでした: ウィンドウを確認する方法がありません（WindowsまたはX11のxwininfoが必要）")
+        return None
+    timings = []
+    for _ in range(repeat):
+        started_at = time.time()
+        process = subprocess.Popen([exe], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                   cwd=os.path.dirname(exe) or None)
+        try:
+            while not is_window_shown(APP_WINDOW_TITLE):
+                if process.poll() is not None or time.time() - started_at > timeout:
+                    print("  最初の画面を計測できませんでした: ウィンドウが表示される前に終了しました")
+                    return None
+                time.sleep(0.02)
+            timings.append(time.time() - started_at)
+        finally:
+            process.terminate()
+            process.wait()
+    return statistics.median(timings)
+
+
+def bench_startup(args):
+    """起動時間（モジュールの読み込み・GUIなしのコマンド・最初の画面が出るまで）を計測する"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'minutes_app.py')
+    total, children = profile_imports(args.top)
+    print(f"minutes_appの読み込み（-X importtime）: {total * 1000:.0f}ms")
+    for cumulative, name in children:
+        print(f"  {name:<40}{cumulative * 1000:>8.1f}ms")
+
+    interpreter = measure_command([sys.executable, '-c', 'pass'], args.repeat)
+    import_seconds = measure_command([sys.executable, '-c', 'import minutes_app'], args.repeat) - interpreter
+    help_seconds = measure_command([sys.executable, script, '--help'], args.repeat)
+    print(f"import minutes_app: {import_seconds * 1000:.0f}ms（Python自体の起動{interpreter * 1000:.0f}msを除く）")
+    print(f"minutes_app.py --help: {help_seconds * 1000:.0f}ms")
+
+    record = {
+        'commit': get_git_revision(),
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'import_profile_seconds': total,
+        'import_seconds': import_seconds,
+        'help_seconds': help_seconds,
+        'slowest_imports': {name: cumulative for cumulative, name in children},
+    }
+    targets = [(f"import minutes_app（目標{args.target_import:.2f}秒以内）", import_seconds, args.target_import)]
+
+    window_seconds = measure_first_window(args.repeat)
+    if window_seconds is not None:
+        print(f"最初の画面まで（スクリプト）: {window_seconds:.2f}秒")
+        record['window_seconds'] = window_seconds
+    if args.exe:
+        exe_seconds = measure_exe_first_window(os.path.abspath(args.exe), args.repeat)
+        if exe_seconds is not None:
+            print(f"最初の画面まで（{args.exe}）: {exe_seconds:.2f}秒")
+            record['exe_window_seconds'] = exe_seconds
+            targets.append((f"実行ファイルの最初の画面（目標{args.target_window:.1f}秒以内）", exe_seconds, args.target_window))
+
+    for label, value, target in targets:
+        print(f"{label}: {'達成' if value <= target else '未達'}（{value:.2f}秒）")
+
+    results_path = args.results or get_results_path('startup')
+    baseline = next((r for r in reversed(load_results(results_path)) if r.get('commit') != record['commit']), None)
+    if baseline:
+        print(f"{baseline['commit']}との比較: import {baseline['import_seconds'] * 1000:.0f}ms → {import_seconds * 1000:.0f}ms")
+    append_results(results_path, [record])
+
+
+CHUNK_MARKER_PATTERN = re.compile(rb'chunk-(\d+)')
+
+
+def find_chunk_marker(request_body):
+    """generateContentのリクエスト本文（JSON）から、テキストまたは埋め込み音声に含まれるチャンクの目印を探す"""
+    for content in request_body.get('contents', []):
+        for part in content.get('parts', []):
+            if 'text' in part:
+                data = part['text'].encode('utf-8')
+            elif 'inlineData' in part:
+                data = base64.b64decode(part['inlineData'].get('data', ''))
+            else:
+                continue
+            match = CHUNK_MARKER_PATTERN.search(data)
+            if match:
+                return int(match.group(1))
+    return None
+
+
+class StubGeminiHandler(http.server.BaseHTTPRequestHandler):
+    """GeminiのREST API（generateContent・streamGenerateContent）を模擬するローカルのスタブ
+
+    リクエストに付いていたAPIキー（x-goog-api-keyヘッダーまたはkeyパラメータ）とチャンクの目印を記録し、
+    少し待ってから短い応答を返す。streamGenerateContentには応答のJSON配列を2回に分けて返す。
+    """
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        query_key = re.search(r'[?&]key=([^&]+)', self.path)
+        api_key = self.headers.get('x-goog-api-key') or (query_key.group(1) if query_key else None)
+        marker = find_chunk_marker(body)
+        with self.server.lock:
+            self.server.received.append((marker, api_key))
+        time.sleep(self.server.latency * random.uniform(0.5, 1.5))
+
+        usage = {'promptTokenCount': 10, 'candidatesTokenCount': 10, 'totalTokenCount': 20}
+        if 'streamGenerateContent' in self.path:
+            events = [
+                {'candidates': [{'content': {'role': 'model', 'parts': [{'text': f"chunk-{marker}の"}]}, 'index': 0}]},
+                {'candidates': [{'content': {'role': 'model', 'parts': [{'text': "応答です。"}]}, 'finishReason': 'STOP', 'index': 0}],
+                 'usageMetadata': usage},
+            ]
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json; charset=UTF-8')
+            self.end_headers()
+            for i, event in enumerate(events):
+                self.wfile.write((('[' if i == 0 else ',') + json.dumps(event)).encode('utf-8'))
+                self.wfile.flush()
+            self.wfile.write(b']')
+            return
+
+        payload = json.dumps({
+            'candidates': [{'content': {'role': 'model', 'parts': [{'text': f"chunk-{marker}の応答です。"}]}, 'finishReason': 'STOP', 'index': 0}],
+            'usageMetadata': usage,
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LegacyGlobalBackend:
+    """変更前の呼び出し方（リクエストごとにgenai.configureでプロセス全体のキーを切り替える）を再現するバックエンド"""
+
+    def generate_text(self, api_key, model_name, prompt, stream=None):
+        minutes_app.load_genai()
+        minutes_app.genai.configure(api_key=api_key, **minutes_app.get_genai_client_options())
+        response = minutes_app.genai.GenerativeModel(model_name).generate_content(prompt)
+        return minutes_app.GenerationResult(response.text, minutes_app.get_total_tokens(response))
+
+    def transcribe_audio(self, api_key, model_name, prompt, audio_file, mime_type, inline, stream=None):
+        minutes_app.load_genai()
+        model = minutes_app.genai.GenerativeModel(model_name)
+        minutes_app.genai.configure(api_key=api_key, **minutes_app.get_genai_client_options())
+        with open(audio_file, 'rb') as audio:
+            response = model.generate_content([prompt, {"mime_type": mime_type, "data": audio.read()}])
+        return minutes_app.GenerationResult(response.text, minutes_app.get_total_tokens(response))
+
+
+class KeyRecordingBackend:
+    """キープールがチャンクに割り当てたキーを記録してから、実際のバックエンドに渡すラッパー"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.assigned = {}
+        self._lock = threading.Lock()
+
+    def _record(self, data, api_key):
+        match = CHUNK_MARKER_PATTERN.search(data)
+        if match:
+            with self._lock:
+                self.assigned[int(match.group(1))] = api_key
+
+    def generate_text(self, api_key, model_name, prompt, stream=None):
+        self._record(prompt.encode('utf-8'), api_key)
+        return self.backend.generate_text(api_key, model_name, prompt, stream=stream)
+
+    def transcribe_audio(self, api_key, model_name, prompt, audio_file, mime_type, inline, stream=None):
+        with open(audio_file, 'rb') as audio:
+            self._record(audio.read(), api_key)
+        return self.backend.transcribe_audio(api_key, model_name, prompt, audio_file, mime_type, inline, stream=stream)
+
+
+def start_stub_server(latency):
+    """ローカルのスタブを別のスレッドで起動し、(サーバー, スタブに向ける環境変数)を返す"""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubGeminiHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.received = []
+    server.latency = latency
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    environment = {
+        'GEMINI_TRANSPORT': 'rest',
+        'GEMINI_API_ENDPOINT': f"http://127.0.0.1:{server.server_address[1]}",
+        'MINUTES_CACHE': '0',
+        'MINUTES_INLINE_UPLOAD_MAX_MB': '15',
+    }
+    return server, environment
+
+
+@contextlib.contextmanager
+def hold_requests_before_send(parties, timeout=30.0):
+    """GenerativeModel.generate_contentの入口（キーの設定の後、クライアントを決めて送信する前）で、
+    parties件のリクエストが揃うまで送信を止める
+
+    genai.configureでプロセス全体のキーを切り替える方式では、揃うまでの間に他のスレッドがキーを書き換えるため、
+    キーの取り違えが必ず起きる（偶然に頼らずに競合を再現する）。このプロセス内で送信する方式だけに効く。
+    """
+    minutes_app.load_genai()
+    model_class = minutes_app.genai.GenerativeModel
+    original = model_class.generate_content
+    barrier = threading.Barrier(parties, timeout=timeout)
+
+    def generate_content(self, *args, **kwargs):
+        barrier.wait()
+        return original(self, *args, **kwargs)
+
+    model_class.generate_content = generate_content
+    try:
+        yield barrier
+    finally:
+        model_class.generate_content = original
+
+
+def send_key_chunks(backend, key_pool, chunks, work_dir, part_kb=64):
+    """各チャンクを割り当てたキーで並列に送り、(キーを記録したバックエンド, 結果のリスト)を返す
+
+    偶数番は音声（埋め込み）の文字起こし、奇数番はテキストの情報抽出として送る。
+    """
+    recorder = KeyRecordingBackend(backend)
+    minutes_app.set_backend(recorder)
+    retry_policy = minutes_app.RetryPolicy(max_attempts=1)
+
+    def send(index):
+        if index % 2 == 0:
+            part = os.path.join(work_dir, f"part{index}.mp3")
+            with open(part, 'wb') as f:
+                f.write(b'ID3' + f"chunk-{index}|".encode('ascii') + os.urandom(part_kb * 1024))
+            return minutes_app.transcribe_audio_part(part, key_pool, retry_policy=retry_policy)
+        return minutes_app.generate_text(f"chunk-{index} の議題を抽出してください。", 'keys', f"チャンク{index}", key_pool, retry_policy)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=key_pool.capacity) as executor:
+            results = list(executor.map(send, range(chunks)))
+    finally:
+        minutes_app.set_backend(None)
+    return recorder, results
+
+
+def find_key_mismatches(received, assigned):
+    """スタブが受け取った(目印, キー)のうち、割り当てたキーと違うキーで届いたものを(目印, 割り当て, 実際)で返す"""
+    return [(marker, assigned.get(marker), api_key) for marker, api_key in received if assigned.get(marker) != api_key]
+
+
+def bench_keys(args):
+    """ローカルのスタブに対して文字起こしと情報抽出を並列に送り、各チャンクが割り当てられたキーで送信されたかを確認する
+
+    --holdを付けると、同時に送る件数が揃うまで各リクエストを送信の直前で止め、genai.configureの競合を確実に起こす。
+    """
+    server, environment = start_stub_server(args.latency)
+    os.environ.update(environment)
+    if args.mode in ('thread', 'process'):
+        os.environ['GEMINI_CLIENT_MODE'] = args.mode
+    keys = [f"stub-key-{i + 1}" for i in range(args.keys)]
+    key_pool = minutes_app.ApiKeyPool(keys, max_concurrency_per_key=args.concurrency_per_key)
+    backend = LegacyGlobalBackend() if args.mode == 'legacy' else minutes_app.create_default_backend()
+    hold = args.hold and not isinstance(backend, minutes_app.ProcessGenaiBackend)
+    if args.hold and not hold:
+        print("ワーカープロセスで送信する方式では--holdを使えないため、止めずに送ります。")
+
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix='minutes_keys_') as work_dir, \
+            hold_requests_before_send(key_pool.capacity) if hold else contextlib.nullcontext():
+        recorder, results = send_key_chunks(backend, key_pool, args.chunks, work_dir, args.part_kb)
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    if hasattr(backend, 'shutdown'):
+        backend.shutdown()
+
+    received = collections.Counter(api_key for _, api_key in server.received)
+    mismatches = find_key_mismatches(server.received, recorder.assigned)
+    failed = sum(1 for result in results if not result)
+
+    print(f"方式: {args.mode}{'（送信前に停止）' if hold else ''}  キー: {args.keys}  チャンク: {args.chunks}  所要時間: {elapsed:.2f}秒")
+    print(f"スタブが受け取ったリクエスト: {len(server.received)}件  失敗: {failed}件  キーの不一致: {len(mismatches)}件")
+    for marker, assigned, actual in mismatches[:10]:
+        print(f"  chunk-{marker}: 割り当て {assigned} → 実際 {actual}")
+    counts = [received.get(key, 0) for key in keys]
+    print(f"キーごとの受信数: 最小{min(counts)} 最大{max(counts)}  " + ' '.join(f"{key.rsplit('-', 1)[1]}:{count}" for key, count in zip(keys, counts)))
+    if hasattr(backend, '_clients'):
+        print(f"作成したクライアント: {len(backend._clients)}個")
+    return 1 if mismatches or failed else 0
+
+
+def add_fake_backend_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0.2, help="1リクエストの基本の応答時間（秒）")
+    parser.add_argument('--latency-per-mb', type=float, default=0.5, help="送信1MBあたりに加わる応答時間（秒）")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="429（クォータ超過）を返す確率")
+    parser.add_argument('--rate-5xx', type=float, default=0.0, help="503（一時的な障害）を返す確率")
+    parser.add_argument('--rate-400', type=float, default=0.0, help="400（不正なリクエスト）を返す確率")
+    parser.add_argument('--rpm', type=int, default=0, help="キーごとの1分あたりのリクエスト数上限（0で無制限）")
+    parser.add_argument('--quota-delay', type=float, default=1.0, help="429を受けたキーを休ませる初回の時間（秒）")
+    parser.add_argument('--retry-delay', type=float, default=0.2, help="一時的な障害の初回待ち時間（秒）")
+    parser.add_argument('--seed', type=int, help="乱数の種（応答時間・エラーの発生を再現する場合）")
+    parser.add_argument('--straggler-rate', type=float, default=0.0, help="応答が極端に遅れるリクエストの割合")
+    parser.add_argument('--straggler-factor', type=float, default=5.0, help="遅れるリクエストの応答時間の倍率")
+    parser.add_argument('--hedge', action='store_true', help="遅れたパートに重複リクエストを送る（MINUTES_HEDGE=1）")
+    parser.add_argument('--stall-rate', type=float, default=0.0, help="ストリーミングの応答が途中で止まるリクエストの割合")
+    parser.add_argument('--truncate-rate', type=float, default=0.0, help="ストリーミングの応答が途中で終わるリクエストの割合")
+    parser.add_argument('--stall-timeout', type=float, default=2.0, help="応答が止まったとみなすまでの時間（MINUTES_STREAM_STALL_TIMEOUT、秒）")
+    parser.add_argument('--no-stream', action='store_true', help="ストリーミングを使わない（MINUTES_STREAM=0）")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="爆速議事録の性能計測")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    split_parser = subparsers.add_parser('split', help="音声分割処理の比較")
+    split_parser.add_argument('--input', help="計測に使う音声ファイル（省略時は合成音声を生成）")
+    split_parser.add_argument('--duration', type=int, default=7200, help="合成音声の長さ（秒）")
+    split_parser.add_argument('--parts', type=int, default=10, help="分割数")
+    split_parser.add_argument('--repeat', type=int, default=3, help="計測回数")
+    split_parser.set_defaults(func=bench_split)
+
+    template_parser = subparsers.add_parser('template', help="議事録テンプレート置換の比較")
+    template_parser.add_argument('--template', help="計測に使うテンプレート（省略時はテンプレート.docx）")
+    template_parser.add_argument('--count', type=int, default=200, help="作成する議事録の数")
+    template_parser.set_defaults(func=bench_template)
+
+    excel_parser = subparsers.add_parser('excel', help="Excel出力の比較")
+    excel_parser.add_argument('--topics', type=int, default=500, help="議題の数")
+    excel_parser.add_argument('--summary-chars', type=int, default=2000, help="要約1件の文字数")
+    excel_parser.add_argument('--meetings', type=int, default=10, help="まとめる会議の数（consolidated）")
+    excel_parser.add_argument('--repeat', type=int, default=3, help="計測回数")
+    excel_parser.set_defaults(func=bench_excel)
+
+    stitch_parser = subparsers.add_parser('stitch', help="つなぎ目の重複削除の確認（無関係な文章を削除しないか）")
+    stitch_parser.add_argument('--pairs', type=int, default=100, help="試す文字起こしの組の数")
+    stitch_parser.add_argument('--phrases', type=int, default=120, help="1つの文字起こしの定型文の数")
+    stitch_parser.add_argument('--overlap-chars', type=int, default=300, help="重複させる文字数")
+    stitch_parser.add_argument('--paraphrase-rate', type=float, default=0.1, help="重複部分を言い換える文字の割合")
+    stitch_parser.add_argument('--seed', type=int, default=0, help="乱数の種")
+    stitch_parser.set_defaults(func=bench_stitch)
+
+    e2e_parser = subparsers.add_parser('e2e', help="偽のバックエンドを使った通しの計測（ネットワーク不要）")
+    e2e_parser.add_argument('--durations', default='10,60', help="合成音声の長さ（分、カンマ区切り）")
+    e2e_parser.add_argument('--keys', default='1,5,10', help="APIキーの数（カンマ区切り）")
+    e2e_parser.add_argument('--repeat', type=int, default=1, help="計測回数")
+    e2e_parser.add_argument('--results', help="結果の保存先（既定はbenchmark_results/e2e.jsonl）")
+    e2e_parser.add_argument('--verbose', action='store_true', help="計測中のログを表示する")
+    add_fake_backend_arguments(e2e_parser)
+    e2e_parser.set_defaults(func=bench_e2e)
+
+    startup_parser = subparsers.add_parser('startup', help="起動時間の計測")
+    startup_parser.add_argument('--exe', help="PyInstallerで作成した実行ファイル（指定すると最初の画面までの時間を計測）")
+    startup_parser.add_argument('--repeat', type=int, default=5, help="計測回数（中央値を使う）")
+    startup_parser.add_argument('--top', type=int, default=8, help="表示する読み込みの遅いモジュールの数")
+    startup_parser.add_argument('--target-import', type=float, default=0.3, help="import minutes_appの目標時間（秒）")
+    startup_parser.add_argument('--target-window', type=float, default=3.0, help="実行ファイルで最初の画面が出るまでの目標時間（秒）")
+    startup_parser.add_argument('--results', help="結果の保存先（既定はbenchmark_results/startup.jsonl）")
+    startup_parser.set_defaults(func=bench_startup)
+
+    keys_parser = subparsers.add_parser('keys', help="ローカルのスタブで、各リクエストが割り当てたキーで送信されるかを確認する")
+    keys_parser.add_argument('--mode', choices=('auto', 'thread', 'process', 'legacy'), default='auto',
+                             help="クライアントの方式（legacyは変更前のgenai.configureを使う方式）")
+    keys_parser.add_argument('--keys', type=int, default=10, help="APIキーの数")
+    keys_parser.add_argument('--chunks', type=int, default=40, help="送信するチャンクの数")
+    keys_parser.add_argument('--concurrency-per-key', type=int, default=1, help="キーごとの同時実行数")
+    keys_parser.add_argument('--latency', type=float, default=0.05, help="スタブの応答時間（秒）")
+    keys_parser.add_argument('--part-kb', type=int, default=64, help="文字起こしで送る音声の大きさ（KB）")
+    keys_parser.add_argument('--hold', action='store_true',
+                             help="同時に送る件数が揃うまで各リクエストを送信の直前で止める（legacyの競合を確実に再現する）")
+    keys_parser.set_defaults(func=bench_keys)
+
+    models_parser = subparsers.add_parser('models', help="文字起こし・情報抽出のモデルの組み合わせごとの処理時間の比較（ネットワーク不要）")
+    models_parser.add_argument('--settings', default='pro/pro,flash/pro,flash/flash',
+                               help="比較する「文字起こし/情報抽出」のモデル（カンマ区切り、pro・flash・flash-8bの短縮名も可）")
+    models_parser.add_argument('--recorded', help="モデルごとの応答時間を求めるトレースファイル（MINUTES_TRACE_FILE）")
+    models_parser.add_argument('--profiles', help="モデル名 -> {latency, latency_per_mb, rate_429}のJSONファイル")
+    models_parser.add_argument('--fallback-models', help="クォータ超過時の代替モデル（カンマ区切り、空文字で無効、省略時はアプリの既定）")
+    models_parser.add_argument('--duration', type=float, default=30, help="合成音声の長さ（分）")
+    models_parser.add_argument('--keys', type=int, default=5, help="APIキーの数")
+    models_parser.add_argument('--repeat', type=int, default=3, help="設定ごとの計測回数（中央値を使う）")
+    models_parser.add_argument('--results', help="結果の保存先（既定はbenchmark_results/models.jsonl）")
+    models_parser.add_argument('--verbose', action='store_true', help="計測中のログを表示する")
+    add_fake_backend_arguments(models_parser)
+    models_parser.set_defaults(func=bench_models)
+
+    live_parser = subparsers.add_parser('live', help="録音中に文字起こしを進める場合と録音後に処理する場合の、議事録ができるまでの時間の比較（ネットワーク不要）")
+    live_parser.add_argument('--duration', type=float, default=30, help="合成音声（録音）の長さ（分）")
+    live_parser.add_argument('--keys', type=int, default=5, help="APIキーの数")
+    live_parser.add_argument('--speed', type=float, default=30.0, help="録音を書き込む速さ（実時間の倍率）")
+    live_parser.add_argument('--segment-minutes', type=float, default=5.0, help="録音中に文字起こしする区間の長さ（分）")
+    live_parser.add_argument('--interval', type=float, default=0.5, help="録音ファイルを確認する間隔（秒）")
+    live_parser.add_argument('--repeat', type=int, default=1, help="計測回数")
+    live_parser.add_argument('--results', help="結果の保存先（既定はbenchmark_results/live.jsonl）")
+    live_parser.add_argument('--verbose', action='store_true', help="計測中のログを表示する")
+    add_fake_backend_arguments(live_parser)
+    live_parser.set_defaults(func=bench_live)
+
+    live_run_parser = subparsers.add_parser('live-run', help=argparse.SUPPRESS)
+    live_run_parser.add_argument('--audio', required=True)
+    live_run_parser.add_argument('--keys', type=int, required=True)
+    live_run_parser.add_argument('--speed', type=float, required=True)
+    live_run_parser.add_argument('--segment-minutes', type=float, required=True)
+    live_run_parser.add_argument('--interval', type=float, required=True)
+    add_fake_backend_arguments(live_run_parser)
+    live_run_parser.set_defaults(func=run_live_case)
+
+    e2e_run_parser = subparsers.add_parser('e2e-run', help=argparse.SUPPRESS)
+    e2e_run_parser.add_argument('--audio', required=True)
+    e2e_run_parser.add_argument('--keys', type=int, required=True)
+    e2e_run_parser.add_argument('--transcription-model')
+    e2e_run_parser.add_argument('--extraction-model')
+    e2e_run_parser.add_argument('--fallback-models')
+    e2e_run_parser.add_argument('--profiles', help="モデル名 -> 応答の傾向のJSON文字列")
+    add_fake_backend_arguments(e2e_run_parser)
+    e2e_run_parser.set_defaults(func=run_e2e_case)
+
+    args = parser.parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,40 +1,69 @@
 import os
 import json
-import google.generativeai as genai
-import openpyxl
 import logging
 import argparse
-from openpyxl.styles import Alignment
-from openpyxl.utils.datetime import from_excel
 from dotenv import load_dotenv
 import subprocess
 import concurrent.futures
-import tkinter as tk
-from tkinter import filedialog, messagebox
 import threading
 import sys
 from pathlib import Path
 import time
-import google.api_core.exceptions
-from docx import Document
+import tempfile
+import shutil
+import contextlib
+import collections
+import re
+import random
+import hashlib
+import math
+import unicodedata
+import bisect
+import glob
+import sqlite3
+import csv
+import multiprocessing
+import io
+import zipfile
 import datetime
-import xml.parsers.expat
-from tkinter import ttk, font
-from PIL import Image, ImageTk
+import queue
 
 # ユーザーディレクトリのDocumentsフォルダのパスを取得
 documents_path = Path.home() / "Documents"
 log_file_path = documents_path / "app_log.txt"
 
-# ログファイルの設定
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file_path),  # ログファイルのパスを変更
-        logging.StreamHandler()
-    ]
-)
+def setup_logging():
+    """ログの出力先（ドキュメントフォルダのapp_log.txtと画面）を設定する関数（mainから呼ぶ）"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_file_path),  # ログファイルのパスを変更
+            logging.StreamHandler()
+        ]
+    )
+
+# 重いライブラリは、使う段階になってから読み込む（起動を速くし、GUIなしの実行で不要なものを読み込まない）
+def load_genai():
+    """google.generativeaiを読み込む関数（最初にAPIを呼ぶときに読み込む）"""
+    global genai
+    import google.generativeai as genai
+    return genai
+
+def load_openpyxl():
+    """openpyxlを読み込む関数（最初にExcelファイルを読み書きするときに読み込む）"""
+    global openpyxl, Alignment, from_excel, Hyperlink
+    import openpyxl
+    from openpyxl.styles import Alignment
+    from openpyxl.utils.datetime import from_excel
+    from openpyxl.worksheet.hyperlink import Hyperlink
+    return openpyxl
+
+def load_docx():
+    """python-docxを読み込む関数（最初に議事録テンプレートを使うときに読み込む）"""
+    global Document, qn
+    from docx import Document
+    from docx.oxml.ns import qn
 
 def get_current_dir():
     if getattr(sys, 'frozen', False):
@@ -47,32 +76,592 @@ def get_current_dir():
 # 現在のスクリプトのディレクトリを取得
 current_dir = Path(__file__).resolve().parent
 
-# 環境変数の読み込み
-load_dotenv(current_dir / '環境変数.env')
-
 # プロジェクトディレクトリの設定
 project_dir = os.path.dirname(os.path.abspath(__file__))
 
-# APIキーの設定
-API_KEYS = [os.getenv(f'GEMINI_API_KEY_{i}') for i in range(1, 11)]  # 10個のAPIキーを取得
+def load_api_keys():
+    """環境変数GEMINI_API_KEY_nからAPIキーを番号順に取得する関数（未設定・空の番号は飛ばす）"""
+    numbered_keys = []
+    for name, value in os.environ.items():
+        match = re.fullmatch(r'GEMINI_API_KEY_(\d+)', name)
+        if match and value and value.strip():
+            numbered_keys.append((int(match.group(1)), value.strip()))
+    return [api_key for _, api_key in sorted(numbered_keys)]
+
+# APIキーの設定（load_configで環境変数から読み込む）
+API_KEYS = None
+
+def load_config():
+    """環境変数.envを読み込み、APIキーを設定する関数（mainから呼ぶ）
 
-# 処理済みファイルのログファイル
+    mainを通さずにモジュールとして使う場合は、get_api_key_poolが最初に呼ばれたときに読み込む。
+    """
+    global API_KEYS
+    load_dotenv(current_dir / '環境変数.env')
+    API_KEYS = load_api_keys()
+
+# 処理済みファイルの旧形式のログファイル（ジョブストアへの初回移行にのみ使用）
 PROCESSED_FILES_LOG = os.path.join(current_dir, 'processed_files.json')
 
-def load_processed_files():
-    if os.path.exists(PROCESSED_FILES_LOG):
-        with open(PROCESSED_FILES_LOG, 'r') as f:
-            return json.load(f)
-    return {}
+# 処理状況を記録するジョブストア
+JOB_STORE_PATH = os.path.join(current_dir, 'minutes_jobs.db')
+
+def get_env_float(name, default):
+    """環境変数を浮動小数点数として取得する関数（未設定・不正値の場合は既定値）"""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        logging.warning(f"環境変数{name}の値が不正です: {value}（既定値{default}を使用します）")
+        return default
+
+def get_env_int(name, default):
+    """環境変数を整数として取得する関数（未設定・不正値の場合は既定値）"""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logging.warning(f"環境変数{name}の値が不正です: {value}（既定値{default}を使用します）")
+        return default
+
+def get_env_bool(name, default):
+    """環境変数を真偽値として取得する関数（1/true/yes/onを真とみなす）"""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+# 処理対象とする音声ファイルの拡張子
+AUDIO_EXTENSIONS = ('.mp3', '.wav')
+
+class JobStore:
+    """処理状況を記録するSQLite（WALモード）のジョブストア
+
+    ファイル単位・チャンク単位の状態、時刻、出力先を保持する。接続はスレッドごとに作り、
+    状態の変更は1つのトランザクションで行うため、複数のワーカーから同時に更新しても壊れない。
+    """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    # 途中までしか文字起こしできなかったチャンク（と、それを含むファイル）。処理済みとはみなさず、次回の処理で再処理する
+    PARTIAL = 'partial'
+
+    # 実行中のまま一定時間更新がないジョブは、異常終了したものとみなして再処理を許可する
+    STALE_RUNNING_SECONDS = 6 * 60 * 60
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            name TEXT PRIMARY KEY,
+            path TEXT,
+            status TEXT NOT NULL,
+            output_path TEXT,
+            size_bytes INTEGER,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS files_status ON files (status);
+        CREATE TABLE IF NOT EXISTS chunks (
+            file_name TEXT NOT NULL REFERENCES files (name) ON DELETE CASCADE,
+            chunk_index INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            start_seconds REAL,
+            end_seconds REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            started_at REAL,
+            finished_at REAL,
+            PRIMARY KEY (file_name, chunk_index)
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, db_path, legacy_json_path=None):
+        self.db_path = str(db_path)
+        self._local = threading.local()
+        self._connect().executescript(self.SCHEMA)
+        if legacy_json_path:
+            self.import_legacy_json(legacy_json_path)
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # トランザクションは自前でBEGIN IMMEDIATEを発行して管理する
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('PRAGMA foreign_keys=ON')
+            self._local.connection = connection
+        return connection
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def import_legacy_json(self, json_path):
+        """旧形式のprocessed_files.jsonを一度だけ取り込む"""
+        with self._transaction() as connection:
+            if connection.execute("SELECT 1 FROM meta WHERE key = 'legacy_json_imported'").fetchone():
+                return
+            imported = 0
+            if os.path.exists(json_path):
+                with open(json_path, 'r') as f:
+                    processed_files = json.load(f)
+                now = time.time()
+                for name, output_path in processed_files.items():
+                    cursor = connection.execute(
+                        "INSERT OR IGNORE INTO files (name, status, output_path, created_at, finished_at) VALUES (?, ?, ?, ?, ?)",
+                        (name, self.DONE, output_path, now, now)
+                    )
+                    imported += cursor.rowcount
+            connection.execute("INSERT INTO meta (key, value) VALUES ('legacy_json_imported', ?)", (str(time.time()),))
+        if imported:
+            logging.info(f"{json_path}から処理済みファイル{imported}件を取り込みました。")
+
+    def start_file(self, name, path, size_bytes=None, force=False):
+        """ファイルの処理を開始済みにする（処理済み・処理中で開始できない場合はFalse）"""
+        now = time.time()
+        with self._transaction() as connection:
+            row = connection.execute("SELECT status, started_at FROM files WHERE name = ?", (name,)).fetchone()
+            if row and not force:
+                if row['status'] == self.DONE:
+                    return False
+                if row['status'] == self.RUNNING and now - (row['started_at'] or 0) < self.STALE_RUNNING_SECONDS:
+                    return False
+            connection.execute(
+                """
+                INSERT INTO files (name, path, status, size_bytes, attempts, created_at, started_at)
+                VALUES (?, ?, ?, ?, 1, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    path = excluded.path, status = excluded.status, size_bytes = excluded.size_bytes,
+                    attempts = files.attempts + 1, error = NULL, started_at = excluded.started_at, finished_at = NULL
+                """,
+                (name, path, self.RUNNING, size_bytes, now, now)
+            )
+            connection.execute("DELETE FROM chunks WHERE file_name = ?", (name,))
+        return True
+
+    def finish_file(self, name, output_path):
+        """ファイルの処理を完了にする（途中までのチャンクがあればPARTIALにする）。記録した状態を返す"""
+        with self._transaction() as connection:
+            partial = connection.execute(
+                "SELECT 1 FROM chunks WHERE file_name = ? AND status = ?", (name, self.PARTIAL)
+            ).fetchone()
+            status = self.PARTIAL if partial else self.DONE
+            connection.execute(
+                "UPDATE files SET status = ?, output_path = ?, finished_at = ? WHERE name = ?",
+                (status, output_path, time.time(), name)
+            )
+        return status
+
+    def fail_file(self, name, error):
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE files SET status = ?, error = ?, finished_at = ? WHERE name = ?",
+                (self.FAILED, str(error), time.time(), name)
+            )
+
+    def add_chunks(self, name, segments):
+        """ファイルのチャンクを未処理として登録する（前回の処理で分割数が多かった分は削除する）"""
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM chunks WHERE file_name = ? AND chunk_index >= ?", (name, len(segments)))
+            connection.executemany(
+                """
+                INSERT INTO chunks (file_name, chunk_index, status, start_seconds, end_seconds) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (file_name, chunk_index) DO UPDATE SET
+                    status = excluded.status, start_seconds = excluded.start_seconds, end_seconds = excluded.end_seconds
+                """,
+                [(name, i, self.PENDING, segment.start, segment.end) for i, segment in enumerate(segments)]
+            )
+
+    def update_chunk(self, name, chunk_index, status):
+        """チャンクの状態を更新する（処理中にすると試行回数を数え、完了・失敗で終了時刻を記録する）"""
+        now = time.time()
+        with self._transaction() as connection:
+            if status == self.RUNNING:
+                connection.execute(
+                    "UPDATE chunks SET status = ?, attempts = attempts + 1, started_at = ? WHERE file_name = ? AND chunk_index = ?",
+                    (status, now, name, chunk_index)
+                )
+            else:
+                connection.execute(
+                    "UPDATE chunks SET status = ?, finished_at = ? WHERE file_name = ? AND chunk_index = ?",
+                    (status, now, name, chunk_index)
+                )
+
+    def unprocessed(self, names, batch_size=500):
+        """namesのうち処理済みでないものを順序を保って返す（索引を使って照会する）"""
+        names = list(names)
+        processed = set()
+        connection = self._connect()
+        for i in range(0, len(names), batch_size):
+            batch = names[i:i + batch_size]
+            placeholders = ','.join('?' * len(batch))
+            rows = connection.execute(
+                f"SELECT name FROM files WHERE status = ? AND name IN ({placeholders})",
+                [self.DONE] + batch
+            )
+            processed.update(row['name'] for row in rows)
+        return [name for name in names if name not in processed]
+
+# アプリ全体で共有するジョブストア
+_job_store = None
+_job_store_lock = threading.Lock()
+
+def get_job_store():
+    """共有のジョブストアを取得する関数（初回呼び出し時に作成し、旧形式のログを取り込む）"""
+    global _job_store
+    with _job_store_lock:
+        if _job_store is None:
+            _job_store = JobStore(os.environ.get('MINUTES_JOB_STORE') or JOB_STORE_PATH, PROCESSED_FILES_LOG)
+        return _job_store
+
+def collect_files(inputs, extensions):
+    """ディレクトリ・グロブ・ファイルパスの指定から、指定した拡張子のファイルを集める関数"""
+    files = []
+    seen = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            candidates = [os.path.join(item, name) for name in sorted(os.listdir(item))]
+        elif glob.has_magic(item):
+            candidates = sorted(glob.glob(item))
+        else:
+            candidates = [item]
+        for candidate in candidates:
+            path = os.path.abspath(candidate)
+            if path in seen or not os.path.isfile(path) or not path.lower().endswith(extensions):
+                continue
+            # Excelが開いている間に作る一時ファイル（~$で始まる）は除く
+            if os.path.basename(path).startswith('~$'):
+                continue
+            seen.add(path)
+            files.append(path)
+    return files
+
+def collect_audio_files(inputs):
+    """ディレクトリ・グロブ・ファイルパスの指定から音声ファイルを集める関数"""
+    return collect_files(inputs, AUDIO_EXTENSIONS)
+
+class TraceSpan:
+    """処理の1区間（ステージ）の記録。setで属性を追加する"""
+
+    def __init__(self, name, span_id, parent_id, attributes):
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.status = 'ok'
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def fail(self, error, **attributes):
+        self.status = 'error'
+        self.attributes['error'] = f"{type(error).__name__}: {error}"
+        self.attributes.update(attributes)
+
+class Tracer:
+    """処理の各ステージの所要時間をJSONL（1行1区間）とPrometheusのテキスト形式に書き出すクラス
+
+    区間はスレッドごとに入れ子で管理し、親の区間のjob属性（ファイル名）を引き継ぐ。
+    trace_pathがNoneの場合は何も書き出さない。トレースファイルがmax_bytesを超えると「.1」を付けた名前に
+    移して新しいファイルに書き始める（1世代前の分だけ残す）。
+    """
+
+    DURATION_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+    # 区間の属性のうち、Prometheusのカウンターとして合計する数値
+    COUNTER_ATTRIBUTES = ('tokens', 'output_tokens', 'bytes_sent', 'wait_seconds', 'prompt_chars', 'response_chars', 'hedges', 'hedge_wins')
+
+    def __init__(self, trace_path=None, metrics_path=None, max_bytes=0):
+        self.trace_path = trace_path
+        self.metrics_path = metrics_path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._trace_file = None
+        self._trace_bytes = 0
+        self._stages = {}  # ステージ名 -> {'count', 'errors', 'sum', 'buckets', 属性の合計}
+
+    @property
+    def enabled(self):
+        return self.trace_path is not None
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current_span(self):
+        """このスレッドで実行中の一番内側の区間（なければNone）"""
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    @contextlib.contextmanager
+    def continue_span(self, span):
+        """別のスレッドで開始した区間を、このスレッドでの区間の親として使う（spanは記録し直さない）"""
+        stack = self._stack()
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        if parent is not None and 'job' in parent.attributes:
+            attributes.setdefault('job', parent.attributes['job'])
+        span = TraceSpan(name, os.urandom(8).hex(), parent.span_id if parent else None, attributes)
+        stack.append(span)
+        started_at = time.time()
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            if span.status == 'ok':
+                span.fail(e)
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            if self.enabled:
+                self._record(span, started_at, duration)
+
+    def _record(self, span, started_at, duration):
+        record = {
+            'name': span.name,
+            'span_id': span.span_id,
+            'parent_id': span.parent_id,
+            'start': round(started_at, 6),
+            'duration': round(duration, 6),
+            'status': span.status,
+            'thread': threading.current_thread().name,
+        }
+        record.update(span.attributes)
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            stage = self._stages.get(span.name)
+            if stage is None:
+                stage = self._stages[span.name] = {
+                    'count': 0, 'errors': 0, 'sum': 0.0, 'buckets': [0] * len(self.DURATION_BUCKETS)
+                }
+            stage['count'] += 1
+            stage['errors'] += span.status != 'ok'
+            stage['sum'] += duration
+            for i, bound in enumerate(self.DURATION_BUCKETS):
+                if duration <= bound:
+                    stage['buckets'][i] += 1
+            for key in self.COUNTER_ATTRIBUTES:
+                value = span.attributes.get(key)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    stage[key] = stage.get(key, 0) + value
+            try:
+                if self._trace_file is None:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.trace_path)), exist_ok=True)
+                    self._trace_file = open(self.trace_path, 'a', encoding='utf-8')
+                    self._trace_bytes = self._trace_file.tell()
+                self._trace_file.write(line + '\n')
+                self._trace_file.flush()
+                self._trace_bytes += len(line.encode('utf-8')) + 1
+                if self.max_bytes and self._trace_bytes >= self.max_bytes:
+                    self._rotate()
+            except OSError as e:
+                logging.warning(f"トレースの書き込みに失敗しました: {str(e)}")
+
+    def _rotate(self):
+        """トレースファイルを1世代前のファイルに移す（呼び出し側で_lockを取得しておく）"""
+        self._trace_file.close()
+        self._trace_file = None
+        os.replace(self.trace_path, get_rotated_trace_path(self.trace_path))
+
+    def write_metrics(self):
+        """ここまでの集計をPrometheusのテキスト形式で書き出す（node_exporterのtextfileコレクター向け）"""
+        if not self.enabled or not self.metrics_path:
+            return
+        with self._lock:
+            stages = {name: dict(stage, buckets=list(stage['buckets'])) for name, stage in self._stages.items()}
+        lines = [
+            '# HELP minutes_stage_duration_seconds 処理ステージごとの所要時間',
+            '# TYPE minutes_stage_duration_seconds histogram',
+        ]
+        for name, stage in sorted(stages.items()):
+            for bound, count in zip(self.DURATION_BUCKETS, stage['buckets']):
+                lines.append(f'minutes_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+            lines.append(f'minutes_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {stage["count"]}')
+            lines.append(f'minutes_stage_duration_seconds_sum{{stage="{name}"}} {stage["sum"]:.6f}')
+            lines.append(f'minutes_stage_duration_seconds_count{{stage="{name}"}} {stage["count"]}')
+        lines += [
+            '# HELP minutes_stage_errors_total 失敗した処理ステージの数',
+            '# TYPE minutes_stage_errors_total counter',
+        ]
+        lines += [f'minutes_stage_errors_total{{stage="{name}"}} {stage["errors"]}' for name, stage in sorted(stages.items())]
+        for key in self.COUNTER_ATTRIBUTES:
+            metric = f'minutes_stage_{key}_total'
+            lines += [f'# TYPE {metric} counter']
+            lines += [f'{metric}{{stage="{name}"}} {stage[key]}' for name, stage in sorted(stages.items()) if key in stage]
+
+        temp_path = f"{self.metrics_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.metrics_path)), exist_ok=True)
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.replace(temp_path, self.metrics_path)
+        except OSError as e:
+            logging.warning(f"メトリクスの書き込みに失敗しました: {str(e)}")
+
+# アプリ全体で共有するトレーサー
+_tracer = None
+_tracer_lock = threading.Lock()
+
+def get_tracer():
+    """共有のトレーサーを取得する関数（MINUTES_TRACE=0の場合は何も書き出さない）"""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            if get_env_bool('MINUTES_TRACE', True):
+                _tracer = Tracer(
+                    os.environ.get('MINUTES_TRACE_FILE') or documents_path / 'minutes_trace.jsonl',
+                    os.environ.get('MINUTES_METRICS_FILE') or documents_path / 'minutes_metrics.prom',
+                    max_bytes=max(0, get_env_int('MINUTES_TRACE_MAX_MB', 50)) * 1024 * 1024
+                )
+            else:
+                _tracer = Tracer()
+        return _tracer
+
+def trace_span(name, **attributes):
+    """処理の区間を記録するコンテキストマネージャを返す関数"""
+    return get_tracer().span(name, **attributes)
+
+def set_span_attributes(**attributes):
+    """実行中の区間に属性を追加する関数（区間の外では何もしない）"""
+    span = get_tracer().current_span()
+    if span is not None:
+        span.set(**attributes)
 
-def save_processed_files(processed_files):
-    with open(PROCESSED_FILES_LOG, 'w') as f:
-        json.dump(processed_files, f, indent=2)
+def percentile(values, ratio):
+    """ソート済みの値のリストから、最近傍法でパーセンタイル値を求める関数"""
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, math.ceil(ratio * len(values)) - 1))
+    return values[index]
 
-def get_unprocessed_audio_files():
-    processed_files = load_processed_files()
-    audio_files = [f for f in os.listdir(current_dir) if f.endswith('.mp3')]
-    return [f for f in audio_files if f not in processed_files]
+def get_rotated_trace_path(trace_path):
+    """上限を超えて移した1世代前のトレースファイルのパス"""
+    return f"{trace_path}.1"
+
+def read_trace_lines(trace_path):
+    """1世代前のトレースファイルと現在のトレースファイルの行を、古い順に返すジェネレータ"""
+    for path in (get_rotated_trace_path(trace_path), trace_path):
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding='utf-8') as f:
+            yield from f
+
+def summarize_trace(trace_path, since=None):
+    """トレースファイルを読み、ステージごとの件数・失敗数・所要時間（p50/p95/最大/合計）を集計する関数
+
+    APIの試行の区間は、キーの空き待ち時間（wait_seconds）も「名前.wait」、ストリーミングで最初のテキストが
+    届くまでの時間（ttft）も「名前.ttft」として集計する。
+    モデルが記録されている区間は、モデルごとにも「名前@モデル」として集計する。
+    """
+    durations = collections.defaultdict(list)
+    errors = collections.Counter()
+    jobs = set()
+    for line in read_trace_lines(trace_path):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if since is not None and record.get('start', 0) < since:
+            continue
+        name = record.get('name')
+        durations[name].append(float(record.get('duration', 0)))
+        errors[name] += record.get('status') != 'ok'
+        if 'wait_seconds' in record:
+            durations[f"{name}.wait"].append(float(record['wait_seconds']))
+        if 'ttft' in record:
+            durations[f"{name}.ttft"].append(float(record['ttft']))
+        if record.get('model') and not record.get('cache_hit'):
+            durations[f"{name}@{record['model']}"].append(float(record.get('duration', 0)))
+            errors[f"{name}@{record['model']}"] += record.get('status') != 'ok'
+        if record.get('job'):
+            jobs.add(record['job'])
+
+    summary = []
+    for name, values in durations.items():
+        values.sort()
+        summary.append({
+            'stage': name,
+            'count': len(values),
+            'errors': errors.get(name, 0),
+            'p50': percentile(values, 0.5),
+            'p95': percentile(values, 0.95),
+            'max': values[-1],
+            'total': sum(values),
+        })
+    summary.sort(key=lambda row: row['total'], reverse=True)
+    return summary, jobs
+
+def print_trace_summary(trace_path, since_hours=None):
+    since = time.time() - since_hours * 3600 if since_hours else None
+    summary, jobs = summarize_trace(trace_path, since)
+    if not summary:
+        print("集計できる記録がありません。")
+        return
+    print(f"{trace_path}（ジョブ{len(jobs)}件）")
+    # 列見出しは全角文字だと桁がずれるため英字にする（単位は秒）
+    print(f"{'stage':<40}{'count':>8}{'errors':>8}{'p50':>10}{'p95':>10}{'max':>10}{'total':>11}")
+    for row in summary:
+        print(f"{row['stage']:<40}{row['count']:>8}{row['errors']:>8}{row['p50']:>10.2f}{row['p95']:>10.2f}{row['max']:>10.2f}{row['total']:>11.1f}")
+
+# 議題一覧の出力形式（create_excelが読み取る形式）
+EXTRACTION_OUTPUT_FORMAT = """\
+    抽出する際は、必ず以下の形式で出力してください：
+    議題①: [議題の内容]
+    議題①の要約: [要約内容]
+
+    議題②: [議題の内容]
+    議題②の要約: [要約内容]
+
+    議題③: [議題の内容]
+    議題③の要約: [要約内容]
+
+    ...
+
+    議題⑩: [議題の内容]
+    議題⑩の要約: [要約内容]
+
+    注意事項:
+    - 各議題とその要約を必ず上記の形式で出力してください。
+    - 議題が10個未満の場合は、存在する議題のみを抽出してください。
+    - 要約は簡潔かつ具体的にしてください。
+    - 議題の番号（①、②など）は必ず付けてください。
+    - 各行は必ず「議題○:」または「議題○の要約:」で始まるようにしてください。
+    - 議題や要約の前に「*」や「**」などの記号を付けないでください。
+    - 議題というのはあくまで表現の一つであり、会話内容が議事録形式で記されていれば構いません。インタビューの文章等からも適切に議題を抽出してください。
+    - インタビューのような文章であっても、適切に議題を抽出してください。
+
+"""
 
 def create_extraction_prompt(text):
     return f"""
@@ -99,35 +688,41 @@ def create_extraction_prompt(text):
     19. 議題⑩
     20. 議題⑩の要約
 
-    抽出する際は、必ず以下の形式で出力してください：
-    議題①: [議題の内容]
-    議題①の要約: [要約内容]
-
-    議題②: [議題の内容]
-    議題②の要約: [要約内容]
-
-    議題③: [議題の内容]
-    議題③の要約: [要約内容]
+{EXTRACTION_OUTPUT_FORMAT}    文章:
+    {text}
+    """
 
-    ...
+def create_chunk_extraction_prompt(text, index, total):
+    """会議の一部分から議題の候補を抽出するプロンプト（map-reduce方式のmap側）"""
+    return f"""
+    この文章は、ある会議を時間順に分割したうちの一部分（全{total}部分中の{index}番目）の文字起こしです。
+    この部分で話し合われている議題の候補と、その要約を抽出してください。
 
-    議題⑩: [議題の内容]
-    議題⑩の要約: [要約内容]
+    必ず以下の形式で出力してください：
+    議題候補: [議題の内容]
+    要約: [要約内容]
 
     注意事項:
-    - 各議題とその要約を必ず上記の形式で出力してください。
-    - 議題が10個未満の場合は、存在する議題のみを抽出してください。
+    - この部分に含まれる議題だけを、最大5個まで抽出してください。
     - 要約は簡潔かつ具体的にしてください。
-    - 議題の番号（①、②など）は必ず付けてください。
-    - 各行は必ず「議題○:」または「議題○の要約:」で始まるようにしてください。
     - 議題や要約の前に「*」や「**」などの記号を付けないでください。
-    - 議題というのはあくまで表現の一つであり、会話内容が議事録形式で記されていれば構いません。インタビューの文章等からも適切に議題を抽出してください。
-    - インタビューのような文章であっても、適切に議題を抽出してください。
+    - 話が前後の部分から続いている場合も、この部分で話されている内容を抽出してください。
 
     文章:
     {text}
     """
 
+def create_merge_extraction_prompt(candidates):
+    """各部分から抽出した議題の候補を、会議全体の議題一覧にまとめるプロンプト（map-reduce方式のreduce側）"""
+    numbered_candidates = "\n\n".join(f"[部分{i}]\n{candidate.strip()}" for i, candidate in enumerate(candidates, start=1))
+    return f"""
+    以下は、ある会議を時間順に分割し、各部分から抽出した議題の候補とその要約です。
+    同じ議題の候補は1つにまとめ、会議全体の議題として最大10個に整理してください。
+    議題は会議で話された順に並べ、要約は各部分の要約を統合して作成してください。
+
+{EXTRACTION_OUTPUT_FORMAT}    議題の候補:
+    {numbered_candidates}
+    """
 
 def get_ffmpeg_path():
     """ffmpegのパスを取得する関数"""
@@ -142,172 +737,2096 @@ def get_ffmpeg_path():
     if ffmpeg_path.exists():
         return str(ffmpeg_path)
 
-    # システムのPATHから検索
-    return 'ffmpeg'
+    # システムのPATHから検索
+    return 'ffmpeg'
+
+def get_ffprobe_path():
+    """ffprobeのパスを取得する関数"""
+    # 環境変数からパスを取得
+    ffprobe_path = os.environ.get('FFPROBE_PATH')
+    if ffprobe_path:
+        return ffprobe_path
+
+    # 実行ファイルと同じディレクトリにffprobeがあるか確認
+    base_path = Path(sys.executable).parent if getattr(sys, 'frozen', False) else Path(__file__).parent
+    ffprobe_path = base_path / 'ffprobe.exe'
+    if ffprobe_path.exists():
+        return str(ffprobe_path)
+
+    # システムのPATHから検索
+    return 'ffprobe'
+
+def get_temp_root():
+    """分割ファイルを置く一時ディレクトリの親を取得する関数（tmpfsがあれば優先する）"""
+    # 環境変数で明示的に指定されている場合はそれを使用
+    temp_root = os.environ.get('MINUTES_TMPDIR')
+    if temp_root:
+        return temp_root
+
+    # Linuxの/dev/shm（tmpfs）が書き込み可能ならディスクI/Oを避けるために使用
+    shm_path = Path('/dev/shm')
+    if shm_path.is_dir() and os.access(shm_path, os.W_OK):
+        return str(shm_path)
+
+    # それ以外はOS既定の一時ディレクトリ
+    return None
+
+@contextlib.contextmanager
+def temporary_work_dir():
+    """ジョブ専用の一時ディレクトリを作成し、終了時（失敗時を含む）に削除する"""
+    work_dir = tempfile.mkdtemp(prefix='minutes_', dir=get_temp_root())  # 所有者のみアクセス可能
+    try:
+        yield work_dir
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+# 分割後の1区間（開始秒、終了秒、直前の区間と音声が重なっているか）
+AudioSegment = collections.namedtuple('AudioSegment', ['start', 'end', 'overlaps_previous'])
+
+def detect_silences(audio_file_path, windows=None, noise_db=-35.0, min_duration=0.4):
+    """ffmpegのsilencedetectで無音区間を検出する関数
+
+    windowsに(開始秒, 終了秒)のリストを渡すと、その範囲だけを1回のffmpeg実行でデコードする。
+    """
+    if windows is None:
+        inputs = ['-i', audio_file_path]
+        windows = [None]
+    else:
+        inputs = []
+        for window_start, window_end in windows:
+            inputs += ['-ss', str(window_start), '-t', str(window_end - window_start), '-i', audio_file_path]
+    filters = ';'.join(
+        f'[{i}:a]silencedetect=noise={noise_db}dB:d={min_duration}[s{i}]' for i in range(len(windows))
+    )
+    outputs = []
+    for i in range(len(windows)):
+        outputs += ['-map', f'[s{i}]', '-f', 'null', '-']
+
+    command = [
+        str(get_ffmpeg_path()),
+        '-hide_banner', '-nostats',
+        '-copyts',  # 入力側シークしても元の時刻で無音位置を出力させる
+    ] + inputs + ['-filter_complex', filters] + outputs
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='utf-8', errors='replace')
+    if result.returncode != 0:
+        logging.warning(f"無音検出に失敗しました。固定位置で分割します: {result.stderr[-500:]}")
+        return []
+
+    # 複数のフィルタの出力が混在するため、フィルタのインスタンスごとに開始と終了を対応付ける
+    silences = []
+    pending_starts = {}
+    for line in result.stderr.splitlines():
+        match = re.search(r'\[silencedetect @ (\S+)\] silence_(start|end): (-?[\d.]+)', line)
+        if not match:
+            continue
+        instance, kind, value = match.groups()
+        if kind == 'start':
+            pending_starts[instance] = max(0.0, float(value))
+        elif instance in pending_starts:
+            silences.append((pending_starts.pop(instance), float(value)))
+    silences.sort()
+    return silences
+
+def nearest_silence_cut(ideal, silences, tolerance, previous_cut=0.0):
+    """理想の分割位置から許容範囲内にある無音区間のうち、最も近い位置を返す関数（なければNone）"""
+    best_cut = None
+    for silence_start, silence_end in silences:
+        # 無音区間内で理想位置に最も近い点
+        candidate = min(max(ideal, silence_start), silence_end)
+        if abs(candidate - ideal) > tolerance or candidate <= previous_cut:
+            continue
+        if best_cut is None or abs(candidate - ideal) < abs(best_cut - ideal):
+            best_cut = candidate
+    return best_cut
+
+def plan_audio_segments(duration, num_parts, silences=(), tolerance_ratio=0.15, overlap_ratio=0.1):
+    """分割境界を決める関数
+
+    均等分割した位置から許容範囲内に無音区間があれば、その中で最も近い位置で切る（重なりなし）。
+    無音区間が見つからない境界にだけ、単語の途切れに備えて重なりを持たせる。
+    """
+    part_duration = duration / num_parts
+    tolerance = part_duration * min(tolerance_ratio, 0.45)  # 境界の順序が入れ替わらない範囲に制限
+    overlap = part_duration * overlap_ratio
+
+    cuts = []
+    previous_cut = 0.0
+    for k in range(1, num_parts):
+        ideal = k * part_duration
+        best_cut = nearest_silence_cut(ideal, silences, tolerance, previous_cut)
+        if best_cut is not None:
+            cuts.append((best_cut, True))
+            previous_cut = best_cut
+        else:
+            cuts.append((ideal, False))
+            previous_cut = ideal
+
+    segments = []
+    start_time = 0.0
+    overlaps_previous = False
+    for cut, at_silence in cuts + [(duration, True)]:
+        if at_silence:
+            end_time = cut
+            next_start = cut
+        else:
+            # 無音がない境界は前後に重なりを半分ずつ持たせる
+            end_time = min(duration, cut + overlap / 2)
+            next_start = max(0.0, cut - overlap / 2)
+        segments.append(AudioSegment(start_time, end_time, overlaps_previous))
+        start_time = next_start
+        overlaps_previous = not at_silence
+
+    return segments
+
+def plan_chunk_count(duration, bytes_per_second=0.0, slots=1, max_seconds=900.0, max_bytes=20 * 1024 * 1024, min_seconds=120.0):
+    """音声の長さ・送信量と使えるキーの枠数から分割数を決める関数
+
+    1パートの長さがmax_seconds、送信量がmax_bytesを超えない数を下限とし、min_secondsより短いパートを
+    作らない範囲でキーの枠数（slots）まで並列にする。枠数を超える場合は、どのキーも同じ数のパートを
+    受け持つよう枠数の倍数にそろえる。
+    """
+    if duration <= 0:
+        return 1
+    slots = max(1, slots)
+    # リクエストごとの上限（長さ・容量）を守るのに必要な数
+    required = 1
+    if max_seconds > 0:
+        required = max(required, math.ceil(duration / max_seconds))
+    if max_bytes > 0 and bytes_per_second > 0:
+        required = max(required, math.ceil(duration * bytes_per_second / max_bytes))
+    # 短すぎるパートを作らない範囲で、空いているキーの枠数まで並列にする
+    useful = max(1, int(duration // min_seconds)) if min_seconds > 0 else slots
+    count = max(required, min(slots, useful))
+    if count > slots:
+        rounded = math.ceil(count / slots) * slots
+        if min_seconds <= 0 or duration / rounded >= min_seconds:
+            count = rounded
+    return count
+
+def parse_bitrate(value):
+    """ffmpegのビットレート指定（"24k"など）をビット毎秒に変換する関数"""
+    value = str(value).strip().lower()
+    multiplier = {'k': 1000, 'm': 1000 * 1000}.get(value[-1:], 1)
+    return float(value[:-1] if multiplier > 1 else value) * multiplier
+
+def estimate_upload_bytes_per_second(audio_file_path, duration):
+    """分割後のパートの1秒あたりの送信量（バイト）を見積もる関数"""
+    _, encode_options = get_upload_encoding(audio_file_path)
+    if '-b:a' in encode_options:
+        return parse_bitrate(encode_options[encode_options.index('-b:a') + 1]) / 8
+    # 無変換の場合は元のファイルと同じ
+    return os.path.getsize(audio_file_path) / duration if duration > 0 else 0.0
+
+def plan_audio_split(audio_file_path, num_parts=None, slots=1):
+    """音声ファイルの長さと無音区間から分割区間を決める関数
+
+    num_partsを省略すると、環境変数MINUTES_CHUNK_COUNT（0は自動）またはplan_chunk_countで、
+    音声の長さ・送信量とslots（使えるキーの枠数）から分割数を決める。
+    """
+    duration = get_audio_duration(audio_file_path)  # 音声ファイルの長さを取得
+    if num_parts is None:
+        num_parts = get_env_int('MINUTES_CHUNK_COUNT', 0)
+    if not num_parts or num_parts < 1:
+        bytes_per_second = estimate_upload_bytes_per_second(audio_file_path, duration)
+        num_parts = plan_chunk_count(
+            duration,
+            bytes_per_second,
+            slots,
+            max_seconds=get_env_float('MINUTES_CHUNK_MAX_MINUTES', 15.0) * 60,
+            max_bytes=get_env_float('MINUTES_CHUNK_MAX_MB', 20.0) * 1024 * 1024,
+            min_seconds=get_env_float('MINUTES_CHUNK_MIN_MINUTES', 2.0) * 60
+        )
+        logging.info(
+            f"分割数を{num_parts}に決定しました（長さ{duration / 60:.1f}分、送信量の見積もり"
+            f"{duration * bytes_per_second / (1024 * 1024):.1f}MB、使えるキーの枠{slots}）"
+        )
+    tolerance_ratio = get_env_float('MINUTES_SPLIT_TOLERANCE_RATIO', 0.15)
+    silences = []
+    if num_parts > 1 and get_env_bool('MINUTES_SILENCE_AWARE', True):
+        # 境界候補の前後（許容範囲）だけを解析すれば十分なので、ファイル全体はデコードしない
+        part_duration = duration / num_parts
+        tolerance = part_duration * min(tolerance_ratio, 0.45)
+        windows = [
+            (max(0.0, k * part_duration - tolerance), min(duration, k * part_duration + tolerance))
+            for k in range(1, num_parts)
+        ]
+        with trace_span('detect_silences', windows=len(windows)) as span:
+            silences = detect_silences(
+                audio_file_path,
+                windows,
+                noise_db=get_env_float('MINUTES_SILENCE_NOISE_DB', -35.0),
+                min_duration=get_env_float('MINUTES_SILENCE_MIN_DURATION', 0.4)
+            )
+            span.set(silences=len(silences))
+    segments = plan_audio_segments(
+        duration,
+        num_parts,
+        silences,
+        tolerance_ratio=tolerance_ratio,
+        overlap_ratio=get_env_float('MINUTES_SPLIT_OVERLAP_RATIO', 0.1)
+    )
+    overlap_count = sum(1 for segment in segments if segment.overlaps_previous)
+    logging.info(f"分割境界を決定しました: {len(segments)}区間（無音位置で分割: {len(segments) - 1 - overlap_count}、重なりあり: {overlap_count}）")
+    return segments
+
+# 拡張子とMIMEタイプの対応
+AUDIO_MIME_TYPES = {
+    '.mp3': 'audio/mp3',
+    '.wav': 'audio/wav',
+    '.ogg': 'audio/ogg',
+    '.flac': 'audio/flac',
+    '.aac': 'audio/aac',
+    '.aiff': 'audio/aiff',
+}
+
+# 非圧縮・可逆圧縮の形式（autoの場合は変換する）
+LOSSLESS_AUDIO_EXTENSIONS = ('.wav', '.flac', '.aiff')
+
+def get_audio_mime_type(audio_file_path):
+    """拡張子から音声ファイルのMIMEタイプを取得する関数"""
+    return AUDIO_MIME_TYPES.get(os.path.splitext(audio_file_path)[1].lower(), 'audio/mp3')
+
+# 出力に乱数（Oggのストリーム番号）やエンコーダーのバージョンを含めないオプション
+BITEXACT_OPTIONS = ['-fflags', '+bitexact', '-flags:a', '+bitexact']
+
+def get_upload_encoding(audio_file_path):
+    """分割時の出力形式を決める関数
+
+    (拡張子, ffmpegの出力オプション)を返す。環境変数MINUTES_UPLOAD_FORMATで
+    copy（無変換）・opus・mp3・auto（非圧縮の入力だけopusに変換）を選べる。
+    音声認識には話し声が聞き取れれば十分なため、変換時はモノラル16kHzの低ビットレートにする。
+    変換時は同じ入力から毎回同じバイト列ができるよう（Oggのストリーム番号などを固定し）、キャッシュを効かせる。
+    """
+    source_extension = os.path.splitext(audio_file_path)[1].lower()
+    upload_format = (os.getenv('MINUTES_UPLOAD_FORMAT') or 'auto').strip().lower()
+    if upload_format == 'auto':
+        upload_format = 'opus' if source_extension in LOSSLESS_AUDIO_EXTENSIONS else 'copy'
+
+    if upload_format == 'opus':
+        bitrate = os.getenv('MINUTES_UPLOAD_BITRATE') or '24k'
+        return '.ogg', ['-ac', '1', '-ar', '16000', '-c:a', 'libopus', '-b:a', bitrate, '-application', 'voip'] + BITEXACT_OPTIONS
+    if upload_format == 'mp3':
+        bitrate = os.getenv('MINUTES_UPLOAD_BITRATE') or '32k'
+        return '.mp3', ['-ac', '1', '-ar', '16000', '-c:a', 'libmp3lame', '-b:a', bitrate] + BITEXACT_OPTIONS
+    # 無変換の場合は元の形式のまま切り出す（WAVをmp3として扱わないよう拡張子も元のまま）
+    return source_extension or '.mp3', ['-c', 'copy']
+
+def get_part_file_path(audio_file_path, output_dir, index, extension):
+    """分割したパートの保存先を決める関数"""
+    base_name = os.path.splitext(os.path.basename(audio_file_path))[0]
+    return os.path.join(output_dir, f"{base_name}_part{index+1}{extension}")
+
+def iter_audio_parts(audio_file_path, segments, output_dir, slots=None, start_index=0):
+    """音声ファイルを先頭の区間から1つずつ切り出し、できたパートから順に(番号, パス)を返すジェネレータ
+
+    slotsにセマフォを渡すと、切り出す前に枠を1つ確保する。枠は送信が終わったパートを
+    削除したときに解放させることで、ディスク上に残る未送信のパートの数を制限する。
+    start_indexを渡すと、パートの番号をそこから数える（録音中に区間を追加していく場合）。
+    """
+    extension, encode_options = get_upload_encoding(audio_file_path)
+    for i, segment in enumerate(segments, start=start_index):
+        if slots is not None:
+            slots.acquire()
+        part_file = get_part_file_path(audio_file_path, output_dir, i, extension)
+        command = [
+            str(get_ffmpeg_path()),
+            '-y',
+            '-v', 'error',
+            '-ss', str(segment.start),  # 入力側シークで必要な範囲だけを読み込む
+            '-t', str(segment.end - segment.start),
+            '-i', audio_file_path,
+            '-map', '0:a',
+        ] + encode_options + [part_file]
+        # 区間はyieldの前に閉じる（呼び出し側の処理を分割の時間に含めない）
+        with trace_span('split_audio_part', part=i + 1) as span:
+            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='utf-8')
+            if result.returncode != 0:
+                logging.error(f"FFmpegエラー: {result.stderr}")
+                raise RuntimeError(f"音声ファイルの分割に失敗しました: {audio_file_path}（パート{i + 1}）")
+            span.set(bytes_out=os.path.getsize(part_file))
+        yield i, part_file
+
+def get_audio_duration(audio_file_path):
+    """音声ファイルの長さを取得する関数"""
+    command = [
+        str(get_ffprobe_path()),  # ffprobeのパスを取得
+        '-v', 'error',
+        '-show_entries', 'format=duration',
+        '-of', 'default=noprint_wrappers=1:nokey=1',
+        audio_file_path
+    ]
+    with trace_span('get_audio_duration'):
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        return float(result.stdout.strip())
+
+def get_audio_bit_rate(audio_file_path):
+    """音声ファイルのビットレート（bps）を取得する関数（取得できなければNone）
+
+    録音中のファイルはヘッダーの長さが当てにならないため、ファイルサイズとこの値から長さを見積もる。
+    """
+    command = [
+        str(get_ffprobe_path()),
+        '-v', 'error',
+        '-select_streams', 'a:0',
+        '-show_entries', 'stream=bit_rate:format=bit_rate',
+        '-of', 'default=noprint_wrappers=1:nokey=1',
+        audio_file_path
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    for value in result.stdout.split():
+        try:
+            bit_rate = float(value)
+        except ValueError:
+            continue  # N/A
+        if bit_rate > 0:
+            return bit_rate
+    return None
+
+class TokenBucket:
+    """1分あたりの上限で補充されるトークンバケット（上限が0以下なら無制限）"""
+
+    def __init__(self, per_minute, clock=time.monotonic):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated_at = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        """amount分を消費できるまでの待ち秒数を返す"""
+        if self.capacity <= 0:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)  # 上限を超える要求は満タンになれば通す
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        if self.capacity <= 0:
+            return
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, amount):
+        """見積もりと実績の差分を反映する（負の値で返却）"""
+        if self.capacity <= 0:
+            return
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class ApiKeyState:
+    """APIキー1つ分のレート制限・健全性・利用状況"""
+
+    def __init__(self, index, api_key, rpm_limit, tpm_limit, clock):
+        self.index = index
+        self.api_key = api_key
+        self.label = f"APIキー{index + 1}"
+        self.request_bucket = TokenBucket(rpm_limit, clock)
+        self.token_bucket = TokenBucket(tpm_limit, clock)
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.consecutive_failures = 0
+        self.disabled = False
+        # 利用状況のカウンタ
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.tokens_used = 0
+        self.busy_seconds = 0.0
+
+
+class ApiKeyLease:
+    """ApiKeyPool.acquireで貸し出されたAPIキー"""
+
+    def __init__(self, state, estimated_tokens, acquired_at):
+        self.state = state
+        self.estimated_tokens = estimated_tokens
+        self.acquired_at = acquired_at
+
+    @property
+    def api_key(self):
+        return self.state.api_key
+
+    @property
+    def label(self):
+        return self.state.label
+
+
+class NoAvailableApiKeyError(RuntimeError):
+    """利用可能なAPIキーが1つも残っていない場合の例外"""
+
+
+class ApiKeyPool:
+    """複数のAPIキーを共有し、空いている健全なキーを順に貸し出すプール
+
+    キーごとにRPM/TPMのトークンバケットを持ち、429を受けたキーは一定時間休ませる。
+    連続して失敗したキーも一時的に外し、無効なキーは以後使わない。
+    """
+
+    SUCCESS = 'success'
+    RATE_LIMITED = 'rate_limited'
+    FAILURE = 'failure'
+    INVALID_KEY = 'invalid_key'
+    CANCELLED = 'cancelled'
+
+    # キャンセルを確認する間隔（秒）
+    CANCEL_POLL_SECONDS = 0.5
+
+    def __init__(self, api_keys, rpm_limit=0, tpm_limit=0, max_concurrency_per_key=1,
+                 cooldown_seconds=60.0, failure_threshold=3, clock=time.monotonic):
+        if not api_keys:
+            raise NoAvailableApiKeyError("APIキーが設定されていません。環境変数.envファイルを確認してください。")
+        self.clock = clock
+        self.max_concurrency_per_key = max(1, max_concurrency_per_key)
+        self.cooldown_seconds = cooldown_seconds
+        self.failure_threshold = failure_threshold
+        self.created_at = clock()
+        self._condition = threading.Condition()
+        self._states = [ApiKeyState(i, api_key, rpm_limit, tpm_limit, clock) for i, api_key in enumerate(api_keys)]
+
+    @property
+    def size(self):
+        return len(self._states)
+
+    @property
+    def capacity(self):
+        """同時に貸し出せるリクエスト数の上限"""
+        return len(self._states) * self.max_concurrency_per_key
+
+    def index_of(self, api_key):
+        """APIキーの番号を返す（acquireのexcludeに渡す。見つからなければNone）"""
+        for state in self._states:
+            if state.api_key == api_key:
+                return state.index
+        return None
+
+    def _wait_time(self, state, estimated_tokens, now):
+        if state.in_flight >= self.max_concurrency_per_key:
+            return None  # 返却されるまで待つ
+        return max(
+            state.cooldown_until - now,
+            state.request_bucket.wait_time(1),
+            state.token_bucket.wait_time(estimated_tokens),
+            0.0
+        )
+
+    def acquire(self, estimated_tokens=0, exclude=(), blocking=True, cancelled=None):
+        """空いている健全なキーを1つ貸し出す（blocking=Falseで空きがなければNoneを返す）
+
+        cancelledに関数を渡すと、キーの空きを待つ間に定期的に呼び、Trueを返したらJobCancelledを送出する。
+        """
+        with self._condition:
+            while True:
+                if cancelled is not None and cancelled():
+                    raise JobCancelled("キーの空きを待つ間にキャンセルされました。")
+                now = self.clock()
+                candidates = [state for state in self._states if not state.disabled and state.index not in exclude]
+                if not candidates:
+                    if not blocking:
+                        return None
+                    raise NoAvailableApiKeyError("利用可能なAPIキーがありません。")
+
+                ready = []
+                shortest_wait = None
+                for state in candidates:
+                    wait = self._wait_time(state, estimated_tokens, now)
+                    if wait is None:
+                        continue
+                    if wait <= 0:
+                        ready.append(state)
+                    elif shortest_wait is None or wait < shortest_wait:
+                        shortest_wait = wait
+
+                if ready:
+                    # 処理中の少ないキー、使用回数の少ないキーを優先して負荷を分散する
+                    state = min(ready, key=lambda s: (s.in_flight, s.requests))
+                    state.request_bucket.consume(1)
+                    state.token_bucket.consume(estimated_tokens)
+                    state.in_flight += 1
+                    state.requests += 1
+                    return ApiKeyLease(state, estimated_tokens, now)
+
+                if not blocking:
+                    return None
+                if cancelled is not None:
+                    shortest_wait = min(shortest_wait or self.CANCEL_POLL_SECONDS, self.CANCEL_POLL_SECONDS)
+                self._condition.wait(timeout=shortest_wait)
+
+    def release(self, lease, outcome, tokens_used=None, cooldown=None):
+        """貸し出したキーを結果とともに返却する"""
+        with self._condition:
+            state = lease.state
+            now = self.clock()
+            state.in_flight -= 1
+            state.busy_seconds += now - lease.acquired_at
+            if outcome == self.CANCELLED:
+                # 送信前にキャンセルされたリクエストは、予約した分を戻すだけにする
+                state.request_bucket.adjust(-1)
+                state.token_bucket.adjust(-lease.estimated_tokens)
+                state.requests -= 1
+            elif tokens_used is not None:
+                state.tokens_used += tokens_used
+                state.token_bucket.adjust(tokens_used - lease.estimated_tokens)
+            else:
+                state.tokens_used += lease.estimated_tokens
+
+            if outcome == self.CANCELLED:
+                pass
+            elif outcome == self.SUCCESS:
+                state.successes += 1
+                state.consecutive_failures = 0
+            elif outcome == self.RATE_LIMITED:
+                state.rate_limited += 1
+                state.cooldown_until = max(state.cooldown_until, now + (cooldown if cooldown is not None else self.cooldown_seconds))
+                logging.info(f"{state.label}をクールダウンします（{state.cooldown_until - now:.0f}秒）")
+            elif outcome == self.INVALID_KEY:
+                state.failures += 1
+                state.disabled = True
+                logging.error(f"{state.label}は無効なため、以後使用しません。")
+            else:
+                state.failures += 1
+                state.consecutive_failures += 1
+                if state.consecutive_failures >= self.failure_threshold:
+                    state.cooldown_until = max(state.cooldown_until, now + self.cooldown_seconds)
+                    logging.warning(f"{state.label}が{state.consecutive_failures}回連続で失敗したため、一時的に使用を停止します。")
+            self._condition.notify_all()
+
+    def stats(self):
+        """キーごとの利用状況を返す"""
+        with self._condition:
+            elapsed = max(self.clock() - self.created_at, 1e-9)
+            return [
+                {
+                    'key': state.label,
+                    'requests': state.requests,
+                    'successes': state.successes,
+                    'failures': state.failures,
+                    'rate_limited': state.rate_limited,
+                    'tokens': state.tokens_used,
+                    'busy_seconds': round(state.busy_seconds, 3),
+                    'utilization': round(state.busy_seconds / (elapsed * self.max_concurrency_per_key), 4),
+                    'disabled': state.disabled,
+                }
+                for state in self._states
+            ]
+
+    def log_stats(self):
+        for stat in self.stats():
+            logging.info(
+                f"{stat['key']}: リクエスト{stat['requests']}回 成功{stat['successes']} 失敗{stat['failures']} "
+                f"429:{stat['rate_limited']} トークン{stat['tokens']} 稼働率{stat['utilization']:.1%}"
+            )
+
+# アプリ全体で共有するAPIキープール
+_api_key_pool = None
+_api_key_pool_lock = threading.Lock()
+
+def get_api_key_pool():
+    """共有のAPIキープールを取得する関数（初回呼び出し時に作成）"""
+    global _api_key_pool
+    with _api_key_pool_lock:
+        if _api_key_pool is None:
+            if API_KEYS is None:
+                # mainを通さずにモジュールとして使う場合も、環境変数.envの設定とAPIキーを使う
+                load_config()
+            _api_key_pool = ApiKeyPool(
+                API_KEYS,
+                rpm_limit=get_env_int('GEMINI_RPM_LIMIT', 2),
+                tpm_limit=get_env_int('GEMINI_TPM_LIMIT', 32000),
+                max_concurrency_per_key=get_env_int('GEMINI_MAX_CONCURRENCY_PER_KEY', 1)
+            )
+        return _api_key_pool
+
+# Geminiは音声1秒あたり約32トークンとして数える
+AUDIO_TOKENS_PER_SECOND = 32
+
+# 既定のモデル（ステージごとに環境変数GEMINI_TRANSCRIPTION_MODEL・GEMINI_EXTRACTION_MODELで変更できる）
+TRANSCRIPTION_MODEL = 'gemini-1.5-pro'
+EXTRACTION_MODEL = 'gemini-1.5-pro'
+# クォータ超過時に切り替える既定の代替モデル
+FALLBACK_MODEL = 'gemini-1.5-flash'
+
+class ModelTiers:
+    """1つのステージで使うモデルの優先順（先頭が通常のモデル、以降がクォータ超過時の代替モデル）
+
+    あるモデルのクォータ超過（429）が成功を挟まずにfallback_after回続くと、そのモデルを
+    fallback_seconds秒間使わず、次の順位のモデルに切り替える。期間が過ぎると元のモデルに戻す。
+    """
+
+    def __init__(self, stage, models, fallback_after=3, fallback_seconds=300.0, clock=time.monotonic):
+        models = list(dict.fromkeys(models))
+        if not models:
+            raise ValueError(f"{stage}のモデルが指定されていません。")
+        self.stage = stage
+        self.models = models
+        self.fallback_after = max(1, fallback_after)
+        self.fallback_seconds = fallback_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._quota_errors = {model: 0 for model in models}
+        self._exhausted_until = {model: 0.0 for model in models}
+        self.fallbacks = 0
+
+    @classmethod
+    def from_env(cls, stage, default_model):
+        """環境変数GEMINI_<STAGE>_MODEL・GEMINI_<STAGE>_FALLBACK_MODELS（カンマ区切り）から作成する関数"""
+        prefix = f"GEMINI_{stage.upper()}"
+        model = (os.getenv(f"{prefix}_MODEL") or '').strip() or default_model
+        fallback_models = os.getenv(f"{prefix}_FALLBACK_MODELS")
+        if fallback_models is None:
+            fallback_models = FALLBACK_MODEL
+        return cls(
+            stage,
+            [model] + [name.strip() for name in fallback_models.split(',') if name.strip()],
+            fallback_after=get_env_int('GEMINI_MODEL_FALLBACK_AFTER', 3),
+            fallback_seconds=get_env_float('GEMINI_MODEL_FALLBACK_SECONDS', 300.0)
+        )
+
+    @property
+    def primary(self):
+        return self.models[0]
+
+    def select(self):
+        """今使うモデルを返す（すべてクォータ超過中なら最も早く回復するモデル）"""
+        now = self._clock()
+        with self._lock:
+            for model in self.models:
+                if self._exhausted_until[model] <= now:
+                    return model
+            return min(self.models, key=lambda model: self._exhausted_until[model])
+
+    def cache_models(self):
+        """キャッシュ済みの結果を使ってよいモデルを返す
+
+        通常は先頭のモデルだけ。先頭のモデルがクォータ超過中の間だけ、今使う代替モデルまでの結果も使う
+        （代替モデルの結果を使い続けて、回復した先頭のモデルで処理し直せなくなるのを防ぐ）。
+        """
+        return self.models[:self.models.index(self.select()) + 1]
+
+    def report(self, model, error=None):
+        """モデルを使ったリクエストの結果を記録する（errorがNoneなら成功）"""
+        with self._lock:
+            if error is None:
+                self._quota_errors[model] = 0
+                return
+            if classify_error(error) != ERROR_QUOTA:
+                return
+            self._quota_errors[model] += 1
+            if self._quota_errors[model] < self.fallback_after or self._exhausted_until[model] > self._clock():
+                return
+            self._exhausted_until[model] = self._clock() + self.fallback_seconds
+            self.fallbacks += 1
+        replacement = self.select()
+        if replacement != model:
+            logging.warning(
+                f"{model}のクォータが不足しているため、{MODEL_STAGE_LABELS.get(self.stage, self.stage)}では"
+                f"{self.fallback_seconds:.0f}秒間{replacement}を使用します。"
+            )
+
+    def run(self, func):
+        """今使うモデルでfunc(model)を実行し、(モデル名, 結果)を返す関数（失敗時は記録して例外を送出する）"""
+        model = self.select()
+        set_span_attributes(model=model)
+        try:
+            result = func(model)
+        except Exception as e:
+            self.report(model, e)
+            raise
+        self.report(model)
+        return model, result
+
+MODEL_STAGE_LABELS = {'transcription': '文字起こし', 'extraction': '情報抽出'}
+
+# ステージごとのモデルの優先順（環境変数から初回に作成する）
+_model_tiers = {}
+_model_tiers_lock = threading.Lock()
+
+def get_model_tiers(stage):
+    """ステージ（transcription・extraction）のモデルの優先順を取得する関数"""
+    with _model_tiers_lock:
+        if stage not in _model_tiers:
+            default_model = TRANSCRIPTION_MODEL if stage == 'transcription' else EXTRACTION_MODEL
+            _model_tiers[stage] = ModelTiers.from_env(stage, default_model)
+        return _model_tiers[stage]
+
+TRANSCRIPTION_PROMPT = """
+            以下の音声ファイルを文字起こししてください。以下の点に注意してください：
+            1. 日本語で出力してください。
+            2. 時間表記（例：13:05）は削除してください。
+            3. 相槌（例：はい、うん、ええ）や言い淀み（例：あの、えーと）は削除してください。
+            4. 文脈を損なわない範囲で、できるだけ簡潔に文字起こしを行ってください。
+            5. 話者の区別は不要です。
+            """
+
+def get_part_source_key(source_hash, segment, encode_options):
+    """分割したパートを、元の音声の内容のハッシュ・区間・変換方法で識別するキャッシュキーの材料を返す関数
+
+    パートのファイル自体は変換のたびにバイト列が変わりうるため、元の音声を基準にする。
+    """
+    return f"{source_hash}:{segment.start:.3f}-{segment.end:.3f}:{' '.join(encode_options)}"
+
+def hash_file(file_path, block_size=1024 * 1024):
+    """ファイルの内容のSHA-256を計算する関数（全体をメモリに読み込まない）"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """APIの結果を内容のハッシュをキーとしてディスクに保存するキャッシュ
+
+    合計サイズが上限を超えると、最後に使われた時刻が古いものから削除する（LRU）。
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts):
+        """キーの材料（文字列・バイト列）からキャッシュキーを作る"""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _path(self, namespace, key):
+        return self.directory / namespace / key[:2] / f"{key}.txt"
+
+    def get(self, namespace, key):
+        """保存済みの結果を返す（なければNone）"""
+        path = self._path(namespace, key)
+        try:
+            text = path.read_text(encoding='utf-8')
+        except (FileNotFoundError, OSError):
+            return None
+        try:
+            os.utime(path)  # 最終利用時刻を更新する
+        except OSError:
+            pass
+        return text
+
+    def put(self, namespace, key, text):
+        """結果を保存する（書き込み途中のファイルが残らないように一時ファイルから置き換える）"""
+        path = self._path(namespace, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        temp_path.write_text(text, encoding='utf-8')
+        os.replace(temp_path, path)
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            total_size = 0
+            for path in self.directory.rglob('*.txt'):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+            if total_size <= self.max_bytes:
+                return
+            for _, size, path in sorted(entries):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total_size -= size
+                if total_size <= self.max_bytes:
+                    break
+
+# アプリ全体で共有する結果キャッシュ
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+def get_result_cache():
+    """共有の結果キャッシュを取得する関数（無効化されている場合はNone）"""
+    global _result_cache
+    if not get_env_bool('MINUTES_CACHE', True):
+        return None
+    with _result_cache_lock:
+        if _result_cache is None:
+            cache_dir = os.environ.get('MINUTES_CACHE_DIR') or documents_path / 'minutes_cache'
+            _result_cache = ResultCache(cache_dir, get_env_int('MINUTES_CACHE_MAX_MB', 500) * 1024 * 1024)
+        return _result_cache
+
+def get_total_tokens(response):
+    """レスポンスの使用トークン数を取得する関数（取得できない場合はNone）"""
+    usage = getattr(response, 'usage_metadata', None)
+    return getattr(usage, 'total_token_count', None) if usage else None
+
+# エラーの分類
+ERROR_QUOTA = 'quota'              # クォータ超過（429）: キーを休ませて別のキーで再試行
+ERROR_TRANSIENT = 'transient'      # 5xx・タイムアウトなど一時的な障害: 待ってから再試行
+ERROR_INVALID_KEY = 'invalid_key'  # 無効なキー: そのキーを外して別のキーで再試行
+ERROR_PERMANENT = 'permanent'      # 不正な音声・リクエストなど: 再試行しない
+ERROR_STALLED = 'stalled'          # ストリーミングの応答が途切れた: 待たずに再試行
+
+def classify_error(error):
+    """APIの例外をクォータ超過・一時的な障害・無効なキー・恒久的な失敗・応答の途切れに分類する関数"""
+    if isinstance(error, StreamStalledError):
+        return ERROR_STALLED
+    code = getattr(error, 'code', None)
+    try:
+        code = int(code)
+    except (TypeError, ValueError):
+        code = None
+    message = str(error).lower()
+
+    if code == 429 or 'resource has been exhausted' in message or 'quota' in message:
+        return ERROR_QUOTA
+    if code in (401, 403) or 'api key not valid' in message or 'api_key_invalid' in message:
+        return ERROR_INVALID_KEY
+    if code in (400, 404, 413, 415, 422):
+        return ERROR_PERMANENT
+    if isinstance(error, (FileNotFoundError, IsADirectoryError, PermissionError)):
+        return ERROR_PERMANENT
+    # 5xx・408・タイムアウト・接続エラー・不明なエラーは一時的な障害として扱う
+    return ERROR_TRANSIENT
+
+def get_retry_delay_hint(error):
+    """サーバーが指定した再試行までの待ち秒数を取得する関数（指定がなければNone）"""
+    # HTTPのRetry-Afterヘッダー
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers:
+        try:
+            return float(headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            pass
+
+    # google.rpc.RetryInfo
+    for detail in getattr(error, 'details', None) or []:
+        retry_delay = getattr(detail, 'retry_delay', None)
+        if retry_delay is not None:
+            seconds = getattr(retry_delay, 'seconds', 0) + getattr(retry_delay, 'nanos', 0) / 1e9
+            if seconds > 0:
+                return seconds
+
+    # エラーメッセージ中の表記（例: "retry_delay { seconds: 27 }"、"Please retry in 27.3s"）
+    message = str(error)
+    match = re.search(r'retry_delay\s*\{\s*seconds:\s*(\d+)', message) or re.search(r'retry in ([\d.]+)\s*s', message, re.IGNORECASE)
+    if match:
+        return float(match.group(1))
+    return None
+
+
+class RetryPolicy:
+    """エラーの分類に応じた再試行方針（指数バックオフ＋ジッター）
+
+    sleepとrandom_funcを差し替えられるため、偽の時計で動作を確認できる（tests/test_retry_policy.py）。
+    sleepを省略すると実際の時間で待ち、JobControlを渡せば待っている間のキャンセルで打ち切る。
+    """
+
+    def __init__(self, max_attempts=4, base_delay=2.0, max_delay=60.0, quota_delay=30.0,
+                 multiplier=2.0, jitter=0.5, max_hint_delay=300.0, sleep=None, random_func=random.random):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.quota_delay = quota_delay
+        self.multiplier = multiplier
+        self.jitter = min(max(jitter, 0.0), 1.0)
+        self.max_hint_delay = max_hint_delay
+        self.sleep = sleep
+        self.random_func = random_func
+
+    @classmethod
+    def from_env(cls, **overrides):
+        """環境変数から再試行方針を作成する"""
+        settings = dict(
+            max_attempts=get_env_int('MINUTES_RETRY_MAX_ATTEMPTS', 4),
+            base_delay=get_env_float('MINUTES_RETRY_BASE_DELAY', 2.0),
+            max_delay=get_env_float('MINUTES_RETRY_MAX_DELAY', 60.0),
+            quota_delay=get_env_float('MINUTES_RETRY_QUOTA_DELAY', 30.0),
+            jitter=get_env_float('MINUTES_RETRY_JITTER', 0.5),
+        )
+        settings.update(overrides)
+        return cls(**settings)
+
+    def should_retry(self, kind, attempt):
+        """attempt回目の失敗の後に再試行するか"""
+        return kind != ERROR_PERMANENT and attempt < self.max_attempts
+
+    def backoff(self, kind, attempt, hint=None):
+        """attempt回目の失敗の後に待つ秒数"""
+        if hint is not None:
+            return min(max(hint, 0.0), self.max_hint_delay)  # サーバーの指定を優先する
+        base = self.quota_delay if kind == ERROR_QUOTA else self.base_delay
+        delay = min(self.max_delay, base * self.multiplier ** (attempt - 1))
+        return delay * (1 - self.jitter) + delay * self.jitter * self.random_func()
+
+    def wait(self, seconds, control=None):
+        """再試行までseconds秒待つ（controlを渡すと、キャンセルされていればJobCancelledを送出する）"""
+        if self.sleep is not None:
+            self.sleep(seconds)
+        elif control is not None:
+            control.sleep(seconds)
+        else:
+            time.sleep(seconds)
+        if control is not None:
+            control.check()
+
+class JobCancelled(Exception):
+    """ジョブがキャンセルされたことを表す例外"""
+
+
+class JobControl:
+    """処理中のジョブに進捗の通知先とキャンセルの指示を渡すオブジェクト
+
+    listenerは(イベント名, 属性の辞書)を受け取る関数で、処理を行うスレッドから呼ばれる。
+    GUIではウィジェットに触れず、EventBus.postでキューに積むだけの関数を渡す。
+    cancelを呼ぶと、まだ送信していないリクエストと再試行は行われず、JobCancelledで打ち切られる。
+    parentを渡すと、親がキャンセルされたときも打ち切られ、進捗は親の通知先に送られる
+    （ジョブの一部のリクエストだけを止めたい場合に使う）。
+    """
+
+    def __init__(self, listener=None, parent=None):
+        self.listener = listener
+        self.parent = parent
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set() or (self.parent is not None and self.parent.cancelled)
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def check(self):
+        """キャンセルされていればJobCancelledを送出する"""
+        if self.cancelled:
+            raise JobCancelled("処理がキャンセルされました。")
+
+    def sleep(self, seconds):
+        """seconds秒待つ（待っている間にキャンセルされたらすぐにJobCancelledを送出する）"""
+        deadline = time.monotonic() + max(0.0, seconds)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # 親のキャンセルも拾えるよう、短い間隔で確認する
+            self._cancel_event.wait(min(remaining, ApiKeyPool.CANCEL_POLL_SECONDS) if self.parent is not None else remaining)
+            self.check()
+        self.check()
+
+    def emit(self, event, **data):
+        """進捗イベントを通知する（通知先の失敗で処理を止めない）"""
+        if self.listener is None:
+            if self.parent is not None:
+                self.parent.emit(event, **data)
+            return
+        try:
+            self.listener(event, **data)
+        except Exception as e:
+            logging.warning(f"進捗の通知に失敗しました（{event}）: {str(e)}")
+
+
+def call_with_key_pool(operation, key_pool, retry_policy, description, estimated_tokens=0, span_name='api_attempt', control=None, lease=None):
+    """キープールからキーを借りてoperation(api_key)を実行し、失敗の分類に応じて再試行する関数
+
+    operationは(結果, 使用トークン数)を返す。クォータ超過・無効なキー・応答の途切れの場合は待たずに別のキーへ回し、
+    一時的な障害の場合だけバックオフしてから再試行する。恒久的な失敗はすぐに例外を送出する。
+    試行ごとに、キー・キーの空き待ち時間・結果をspan_nameの区間として記録する。
+    controlを渡すと、送信前・再試行前にキャンセルを確認し、再試行したことをretryイベントで通知する。
+    leaseに貸し出し済みのキーを渡すと、最初の試行ではそのキーを使う。
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        wait_start = time.perf_counter()
+        if lease is None:
+            lease = key_pool.acquire(estimated_tokens, cancelled=(lambda: control.cancelled) if control is not None else None)
+        wait_seconds = round(time.perf_counter() - wait_start, 3)
+        if control is not None and control.cancelled:
+            key_pool.release(lease, ApiKeyPool.CANCELLED)
+            control.check()
+        with trace_span(span_name, description=description, key=lease.label, attempt=attempt, wait_seconds=wait_seconds) as span:
+            try:
+                result, tokens_used = operation(lease.api_key)
+            except Exception as e:
+                error = e
+                kind = classify_error(e)
+                hint = get_retry_delay_hint(e)
+                span.fail(e, outcome=kind)
+                if kind == ERROR_QUOTA:
+                    key_pool.release(lease, ApiKeyPool.RATE_LIMITED, cooldown=retry_policy.backoff(kind, attempt, hint))
+                elif kind == ERROR_INVALID_KEY:
+                    key_pool.release(lease, ApiKeyPool.INVALID_KEY)
+                else:
+                    key_pool.release(lease, ApiKeyPool.FAILURE)
+                logging.error(f"{description}失敗: {str(e)}（{lease.label}、分類: {kind}）")
+            else:
+                span.set(outcome='success', tokens=tokens_used)
+                key_pool.release(lease, ApiKeyPool.SUCCESS, tokens_used)
+                return result
+        lease = None
+
+        if not retry_policy.should_retry(kind, attempt):
+            raise error
+        if control is not None:
+            control.check()
+            control.emit('retry', description=description, kind=kind, attempt=attempt + 1)
+        if kind == ERROR_TRANSIENT:
+            delay = retry_policy.backoff(kind, attempt, hint)
+            logging.info(f"{delay:.1f}秒後にリトライを試みます ({attempt + 1}/{retry_policy.max_attempts})")
+            retry_policy.wait(delay, control)
+        else:
+            logging.info(f"別のキーでリトライを試みます ({attempt + 1}/{retry_policy.max_attempts})")
+
+class StragglerHedger:
+    """遅れているチャンクに、空いている別のキーで同じリクエストを重複して送る（ヘッジ）
+
+    1つのジョブのチャンクで共有する。すべてのチャンクを送信し終えた後、送信中の時間が兄弟チャンクの
+    応答時間のpercentile点を超えたチャンクがあり、空いている別のキーがあれば、そのキーで1回だけ
+    同じリクエストを送る。先に成功した方の結果を使い、遅い方の結果は捨てて再試行もさせない。
+    重複リクエストはチャンク数×budget_ratio件（最低1件）までに制限する。
+    リクエストはヘッジ専用のスレッドプールで送る。同時に送るのは、キーの枠数分の最初のリクエストと、
+    予算分の重複リクエスト・結果を捨てたリクエストまでなので、その数だけスレッドを用意する。
+    ジョブの最後にshutdownを呼ぶ。
+    """
+
+    def __init__(self, key_pool, chunk_count, percentile=0.9, min_samples=3, budget_ratio=0.1, poll_interval=0.2):
+        self.key_pool = key_pool
+        self.chunk_count = chunk_count
+        self.percentile = percentile
+        self.min_samples = max(1, min_samples)
+        self.budget = max(1, int(chunk_count * budget_ratio)) if budget_ratio > 0 else 0
+        self.poll_interval = poll_interval
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+        self._started = set()  # 最初のリクエストを送信したチャンク
+        self._latencies = []  # 成功したリクエストの応答時間
+        self._chunks = {}  # チャンク -> 応答時間（ヘッジあり・最初のリクエストのみ）
+        self._losers = {}  # チャンク -> 結果を捨てたリクエストのFuture
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=key_pool.capacity + self.budget * 2, thread_name_prefix='hedge'
+        )
+
+    @classmethod
+    def from_env(cls, key_pool, chunk_count):
+        """環境変数MINUTES_HEDGEが有効な場合だけ作成する関数（無効な場合・チャンクが1つの場合はNone）"""
+        if not get_env_bool('MINUTES_HEDGE', False) or chunk_count < 2:
+            return None
+        return cls(
+            key_pool,
+            chunk_count,
+            percentile=get_env_float('MINUTES_HEDGE_PERCENTILE', 0.9),
+            min_samples=get_env_int('MINUTES_HEDGE_MIN_SAMPLES', 3),
+            budget_ratio=get_env_float('MINUTES_HEDGE_BUDGET', 0.1)
+        )
+
+    def skip(self, chunk):
+        """リクエストを送らずに済んだチャンク（キャッシュから返したものなど）を送信済みとして数える"""
+        with self._lock:
+            self._started.add(chunk)
+
+    def threshold(self):
+        """ヘッジを始める送信中の時間（秒）を返す（判断に必要な応答が揃っていなければNone）"""
+        with self._lock:
+            if len(self._started) < self.chunk_count or len(self._latencies) < self.min_samples:
+                return None
+            return percentile(sorted(self._latencies), self.percentile)
+
+    def _acquire_hedge_lease(self, exclude, estimated_tokens):
+        """予算が残っていて、別のキーがすぐに使える場合だけキーを借りる
+
+        キーはロックの外で借り（他のチャンクの記録を待たせない）、借りた後にロックの中で予算を確かめ直す。
+        """
+        with self._lock:
+            if self.hedges >= self.budget:
+                return None
+        lease = self.key_pool.acquire(estimated_tokens, exclude=exclude, blocking=False)
+        if lease is None:
+            return None
+        with self._lock:
+            if self.hedges < self.budget:
+                self.hedges += 1
+                return lease
+        # 借りている間に他のチャンクが予算を使い切った
+        self.key_pool.release(lease, ApiKeyPool.CANCELLED)
+        return None
+
+    def _timed(self, chunk, operation, sent=None):
+        """応答時間を記録するようにoperationを包む（sentには最初のリクエストのキーと送信時刻を残す）"""
+        def timed_operation(api_key):
+            started = time.monotonic()
+            if sent is not None:
+                sent.update(api_key=api_key, at=started)
+                with self._lock:
+                    self._started.add(chunk)
+            result = operation(api_key)
+            with self._lock:
+                self._latencies.append(time.monotonic() - started)
+            return result
+        return timed_operation
+
+    def _start(self, func, *args, **kwargs):
+        """funcをヘッジ用のスレッドプールで実行し、結果のFutureを返す（呼び出し元のトレースの区間を引き継ぐ）"""
+        parent_span = get_tracer().current_span()
+
+        def run():
+            with get_tracer().continue_span(parent_span) if parent_span else contextlib.nullcontext():
+                return func(*args, **kwargs)
+
+        return self._executor.submit(run)
+
+    def shutdown(self):
+        """スレッドプールを閉じる（結果を捨てたリクエストは終わるまで実行させる）"""
+        self._executor.shutdown(wait=False)
+
+    def call(self, chunk, operation, retry_policy, description, estimated_tokens=0, control=None,
+             span_name='api_attempt', hedge_span_name='hedge_attempt'):
+        """operation(api_key)をcall_with_key_poolで実行し、遅れた場合はヘッジして先に成功した結果を返す関数
+
+        chunkはチャンクを識別する値（分割したパートのパスなど）。どちらも失敗した場合は、最初のリクエストの例外を送出する。
+        """
+        chunk_start = time.monotonic()
+        sent = {}
+        primary_control = JobControl(parent=control)
+        primary = self._start(
+            call_with_key_pool, self._timed(chunk, operation, sent), self.key_pool, retry_policy, description,
+            estimated_tokens, span_name=span_name, control=primary_control
+        )
+        hedge = None
+        hedge_control = None
+        winner = None
+        while True:
+            futures = [future for future in (primary, hedge) if future is not None]
+            concurrent.futures.wait(futures, timeout=self.poll_interval, return_when=concurrent.futures.FIRST_COMPLETED)
+            winner = next((future for future in futures if future.done() and future.exception() is None and future.result()), None)
+            if winner is not None or all(future.done() for future in futures):
+                break
+            if hedge is not None or 'at' not in sent:
+                continue
+            threshold = self.threshold()
+            in_flight = time.monotonic() - sent['at']
+            if threshold is None or in_flight <= threshold:
+                continue
+            lease = self._acquire_hedge_lease({self.key_pool.index_of(sent['api_key'])}, estimated_tokens)
+            if lease is None:
+                continue
+            logging.info(f"{description}が{in_flight:.1f}秒応答しないため、{lease.label}で重複リクエストを送ります（基準{threshold:.1f}秒）。")
+            hedge_control = JobControl(parent=control)
+            hedge = self._start(
+                call_with_key_pool, self._timed(chunk, operation), self.key_pool, RetryPolicy.from_env(max_attempts=1),
+                f"{description}（重複）", estimated_tokens, span_name=hedge_span_name, control=hedge_control, lease=lease
+            )
+
+        latency = time.monotonic() - chunk_start
+        record = {'latency': latency, 'start': chunk_start, 'primary': latency if primary.done() else None}
+        if winner is hedge and hedge is not None:
+            logging.info(f"{description}は重複リクエストの応答を使用します。")
+            with self._lock:
+                self.hedge_wins += 1
+        # 遅い方のリクエストには再試行させず、終わるまで結果を待たない
+        for future, future_control in ((primary, primary_control), (hedge, hedge_control)):
+            if future is not None and future is not winner:
+                future_control.cancel()
+        if not primary.done():
+            primary.add_done_callback(lambda _: record.update(primary=time.monotonic() - chunk_start))
+        with self._lock:
+            self._chunks[chunk] = record
+            self._losers[chunk] = [future for future in (primary, hedge) if future is not None and future is not winner]
+
+        if winner is not None:
+            return winner.result()
+        if primary.exception() is not None:
+            raise primary.exception()
+        return primary.result()
+
+    def when_settled(self, chunk, callback):
+        """chunkで結果を捨てたリクエストがすべて終わってからcallbackを呼ぶ（残っていなければすぐに呼ぶ）
+
+        同じchunkに何度でも登録できる（パートの削除とスピルファイルの削除など）。
+        """
+        with self._lock:
+            remaining = [future for future in self._losers.get(chunk, []) if not future.done()]
+        if not remaining:
+            callback()
+            return
+        counter = {'remaining': len(remaining)}
+        lock = threading.Lock()
+
+        def on_done(_):
+            with lock:
+                counter['remaining'] -= 1
+                last = counter['remaining'] == 0
+            if last:
+                callback()
+
+        for future in remaining:
+            future.add_done_callback(on_done)
+
+    def summary(self):
+        """ヘッジの回数・勝った回数・割合と、チャンクの応答時間のp99（ヘッジあり・なし）を返す
+
+        ヘッジしなかった場合のp99は、まだ応答していない最初のリクエストを経過時間で数えるため下限になる。
+        """
+        now = time.monotonic()
+        with self._lock:
+            records = list(self._chunks.values())
+            hedges, hedge_wins = self.hedges, self.hedge_wins
+        latencies = sorted(record['latency'] for record in records)
+        unhedged = sorted(record['primary'] if record['primary'] is not None else now - record['start'] for record in records)
+        return {
+            'hedges': hedges,
+            'hedge_wins': hedge_wins,
+            'hedge_rate': round(hedges / max(len(records), 1), 3),
+            'chunk_p99': round(percentile(latencies, 0.99), 3) if latencies else 0.0,
+            'chunk_p99_unhedged': round(percentile(unhedged, 0.99), 3) if unhedged else 0.0,
+        }
+
+def wait_for_uploaded_file(uploaded_file, get_file, timeout=300.0, interval=2.0):
+    """File APIにアップロードしたファイルが使用可能になるまで待つ関数（get_fileはアップロードに使ったキーのもの）"""
+    deadline = time.monotonic() + timeout
+    while getattr(getattr(uploaded_file, 'state', None), 'name', 'ACTIVE') == 'PROCESSING':
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"アップロードしたファイルの処理が終わりません: {uploaded_file.name}")
+        time.sleep(interval)
+        uploaded_file = get_file(uploaded_file.name)
+    if getattr(getattr(uploaded_file, 'state', None), 'name', 'ACTIVE') == 'FAILED':
+        raise ValueError(f"アップロードしたファイルの処理に失敗しました: {uploaded_file.name}")
+    return uploaded_file
+
+# バックエンドの応答のうち、このアプリが使う部分（output_tokensは応答側のトークン数、不明ならNone）
+GenerationResult = collections.namedtuple('GenerationResult', ['text', 'total_tokens', 'output_tokens'], defaults=[None])
+
+# ストリーミングの応答の1片（finish_reasonは最後の片にだけ付く終了理由、なければNone）
+StreamChunk = collections.namedtuple('StreamChunk', ['text', 'finish_reason'])
+
+class StreamStalledError(TimeoutError):
+    """ストリーミングの応答が途切れた・途中で終わったことを表す例外（待たずに再試行する）"""
+
+def iter_stream_chunks(response):
+    """SDKのストリーミング応答をStreamChunkの列に変換する関数"""
+    for chunk in response:
+        candidates = getattr(chunk, 'candidates', None) or []
+        reason = getattr(candidates[0], 'finish_reason', None) if candidates else None
+        reason = getattr(reason, 'name', reason)
+        try:
+            text = chunk.text
+        except ValueError:
+            text = ''  # 終了理由だけの片など、テキストを含まない片
+        yield StreamChunk(text, reason if reason and reason != 'FINISH_REASON_UNSPECIFIED' and reason != 0 else None)
+
+def cancel_response_stream(response):
+    """SDKのストリーミング応答の受信を可能であれば打ち切る関数"""
+    iterator = getattr(response, '_iterator', None)
+    for name in ('cancel', 'close'):
+        method = getattr(iterator, name, None)
+        if callable(method):
+            try:
+                method()
+            except Exception:
+                pass
+            return
+
+class ResponseStream:
+    """ストリーミングで届く応答を受け取り、届いたテキストを逐次スピルファイルに書き足す
+
+    最初のテキストがfirst_token_timeout秒以内に、以降は次のテキストがstall_timeout秒以内に届かない場合や、
+    終了理由のないまま応答が終わった場合はStreamStalledErrorを送出する。
+    最初のテキストまでの時間（ttft）と1秒あたりの出力トークン数を、実行中の区間に記録する。
+    見切った場合は受信を打ち切り、受信用のスレッドが終わるのをcancel_join_timeout秒まで待つ。
+    """
+
+    def __init__(self, spill_path, first_token_timeout=120.0, stall_timeout=30.0, cancel_join_timeout=5.0):
+        self.spill_path = spill_path
+        self.first_token_timeout = first_token_timeout
+        self.stall_timeout = stall_timeout
+        self.cancel_join_timeout = cancel_join_timeout
+        self.chars = 0
+        self.first_token_seconds = None
+        self.generation_seconds = None
+
+    def consume(self, chunks, cancel=None):
+        """StreamChunkの列を読み切り、届いたテキスト全体を返す（cancelは途切れた場合に受信を打ち切る関数）"""
+        pieces = queue.Queue()
+
+        def read():
+            try:
+                for chunk in chunks:
+                    pieces.put(('chunk', chunk))
+                pieces.put(('end', None))
+            except BaseException as e:
+                pieces.put(('error', e))
+
+        # 受信はスレッドで行い、待ち時間の上限を超えたらこちらから見切る
+        reader = threading.Thread(target=read, name='response-stream', daemon=True)
+        reader.start()
+        start = time.perf_counter()
+        first_token = None
+        finish_reason = None
+        with open(self.spill_path, 'a', encoding='utf-8') as spill:
+            while True:
+                timeout = self.first_token_timeout if first_token is None else self.stall_timeout
+                try:
+                    kind, value = pieces.get(timeout=timeout if timeout > 0 else None)
+                except queue.Empty:
+                    if cancel is not None:
+                        cancel()
+                    # 打ち切れなかった受信用のスレッドと接続が、リトライのたびに溜まっていないか確認する
+                    reader.join(timeout=self.cancel_join_timeout)
+                    if reader.is_alive():
+                        logging.warning(f"{self.cancel_join_timeout:g}秒待っても応答の受信を打ち切れませんでした。受信用のスレッドと接続が残っています（{os.path.basename(self.spill_path)}）。")
+                    set_span_attributes(stream_chars=self.chars, reader_alive=reader.is_alive())
+                    raise StreamStalledError(f"{timeout:.0f}秒間応答が届きませんでした（受信済み{self.chars}文字）")
+                if kind == 'error':
+                    raise value
+                if kind == 'end':
+                    break
+                if value.finish_reason:
+                    finish_reason = value.finish_reason
+                if value.text:
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                        self.first_token_seconds = first_token - start
+                    spill.write(value.text)
+                    spill.flush()  # 途中で失敗しても、届いた分はファイルに残す
+                    self.chars += len(value.text)
+        self.generation_seconds = time.perf_counter() - (first_token or start)
+        set_span_attributes(stream_chars=self.chars, finish_reason=finish_reason)
+        if self.first_token_seconds is not None:
+            set_span_attributes(ttft=round(self.first_token_seconds, 3))
+
+        if finish_reason is None:
+            raise StreamStalledError(f"応答が途中で終わりました（受信済み{self.chars}文字）")
+        if finish_reason == 'MAX_TOKENS':
+            logging.warning(f"出力トークン数の上限に達したため、応答が途中で打ち切られています（{self.chars}文字）。")
+        elif finish_reason != 'STOP':
+            raise ValueError(f"応答が途中で打ち切られました（終了理由: {finish_reason}）")
+        with open(self.spill_path, encoding='utf-8') as spill:
+            return spill.read()
+
+    def record_rate(self, output_tokens):
+        """1秒あたりの出力トークン数を実行中の区間に記録する（トークン数が不明な場合は記録しない）"""
+        if output_tokens and self.generation_seconds:
+            set_span_attributes(output_tokens=output_tokens, tokens_per_second=round(output_tokens / self.generation_seconds, 1))
+
+class SpillFiles:
+    """1つのリクエスト（文字起こしのパート・抽出のプロンプト）の試行ごとのスピルファイルをまとめるクラス
+
+    directoryを省略すると一時ディレクトリを作成し、close時にディレクトリごと削除する。
+    すべての試行が失敗した場合でも、longest_textで途中まで届いたテキストを取り出せる。
+    """
+
+    def __init__(self, prefix, directory=None):
+        self.prefix = prefix
+        self._owned_directory = directory is None
+        self.directory = directory or tempfile.mkdtemp(prefix='minutes_spill_', dir=get_temp_root())
+        self._paths = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def new_stream(self):
+        """新しい試行用のResponseStreamを返す（タイムアウトは環境変数から読む）"""
+        fd, path = tempfile.mkstemp(prefix=f"{self.prefix}.", suffix='.partial.txt', dir=self.directory)
+        os.close(fd)
+        with self._lock:
+            self._paths.append(path)
+        return ResponseStream(
+            path,
+            first_token_timeout=get_env_float('MINUTES_STREAM_FIRST_TOKEN_TIMEOUT', 120.0),
+            stall_timeout=get_env_float('MINUTES_STREAM_STALL_TIMEOUT', 30.0),
+            cancel_join_timeout=get_env_float('MINUTES_STREAM_CANCEL_JOIN_TIMEOUT', 5.0)
+        )
+
+    def longest_text(self):
+        """試行のうち最も長く届いたテキストを返す（なければ空文字列）"""
+        best = ''
+        with self._lock:
+            paths = list(self._paths)
+        for path in paths:
+            try:
+                text = Path(path).read_text(encoding='utf-8')
+            except OSError:
+                continue
+            if len(text) > len(best):
+                best = text
+        return best
+
+    def close(self):
+        with self._lock:
+            paths, self._paths = self._paths, []
+        if self._owned_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            return
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def new_response_stream(spills):
+    """ストリーミングが有効（MINUTES_STREAM、既定で有効）ならspillsの新しいResponseStreamを返す関数"""
+    if spills is None or not get_env_bool('MINUTES_STREAM', True):
+        return None
+    return spills.new_stream()
+
+def get_genai_client_options():
+    """Geminiのクライアントに渡す接続設定（GEMINI_TRANSPORT・GEMINI_API_ENDPOINT）を返す関数"""
+    options = {}
+    transport = (os.getenv('GEMINI_TRANSPORT') or '').strip()
+    if transport:
+        options['transport'] = transport
+    endpoint = (os.getenv('GEMINI_API_ENDPOINT') or '').strip()
+    if endpoint:
+        options['client_options'] = {'api_endpoint': endpoint}
+    return options
+
+class _IsolationProbeSent(Exception):
+    """supports_isolated_clientsの確認で、モデルが差し替えたクライアントを使ったことを示す"""
+
+class _IsolationProbeClient:
+    """送信せずに_IsolationProbeSentを送出する、確認用の生成クライアント"""
+
+    def generate_content(self, *args, **kwargs):
+        raise _IsolationProbeSent()
+
+def supports_isolated_clients():
+    """SDKがキーごとに独立したクライアントを作れるか（genai.configureを使わずに済むか）を確かめる関数
+
+    GenaiKeyClientはSDKの非公開の_ClientManagerとGenerativeModel._clientに頼るため、存在するかだけでなく、
+    通信せずに次を確かめる: キーごとのクライアントがそれぞれのキーを持つこと、プロセス全体の設定が変わらないこと、
+    GenerativeModelが差し替えたクライアントで送信すること。
+    """
+    load_genai()
+    try:
+        from google.generativeai import client as genai_client
+        default_manager = genai_client._client_manager
+        default_clients = dict(default_manager.clients)
+        for api_key in ('isolation-probe-1', 'isolation-probe-2'):
+            manager = genai_client._ClientManager()
+            manager.configure(api_key=api_key, transport='rest')
+            credentials = getattr(manager.get_default_client('generative')._transport, '_credentials', None)
+            if getattr(credentials, 'token', None) != api_key:
+                return False
+        if dict(default_manager.clients) != default_clients:
+            return False
+        model = genai.GenerativeModel('isolation-probe')
+        if getattr(model, '_client', False) is not None:
+            return False
+        model._client = _IsolationProbeClient()
+        try:
+            model.generate_content('isolation-probe')
+        except _IsolationProbeSent:
+            return True
+        return False
+    except Exception as e:
+        logging.debug(f"キーごとのクライアントの確認に失敗しました: {str(e)}")
+        return False
+
+class GenaiKeyClient:
+    """APIキー1つ分のGeminiクライアント
+
+    genai.configureはプロセス全体の設定を書き換えるため、複数のスレッドから別々のキーで呼ぶと、
+    どのキーで送信されるかが競合で決まってしまう。このクラスはキーごとに独立した_ClientManagerを持ち、
+    生成・ファイルのクライアントを最初に一度だけ作って使い回す（接続もクライアントごとに再利用される）。
+    isolated=Falseの場合はgenai.configureで設定済みのプロセス全体のクライアントを使う
+    （キーごとのワーカープロセスの中だけで使う）。
+    """
+
+    def __init__(self, api_key, isolated=True):
+        load_genai()
+        self.api_key = api_key
+        self._lock = threading.Lock()
+        self._models = {}
+        self._manager = None
+        if isolated:
+            from google.generativeai import client as genai_client
+            self._manager = genai_client._ClientManager()
+            self._manager.configure(api_key=api_key, **get_genai_client_options())
+            self._generative_client = self._manager.get_default_client('generative')
+            self._file_client = self._manager.get_default_client('file')
+
+    def model(self, model_name):
+        """このキーのクライアントを使うGenerativeModelを返す（モデル名ごとに作成して使い回す）"""
+        with self._lock:
+            model = self._models.get(model_name)
+            if model is None:
+                model = genai.GenerativeModel(model_name)
+                if self._manager is not None:
+                    # GenerativeModelは_clientが未設定のときだけプロセス全体のクライアントを使う
+                    model._client = self._generative_client
+                self._models[model_name] = model
+            return model
+
+    def upload_file(self, path, mime_type):
+        if self._manager is None:
+            return genai.upload_file(path, mime_type=mime_type)
+        from google.generativeai.types import file_types
+        path = Path(path)
+        return file_types.File(self._file_client.create_file(path=path, mime_type=mime_type, display_name=path.name))
+
+    def get_file(self, name):
+        if self._manager is None:
+            return genai.get_file(name)
+        from google.generativeai.types import file_types
+        return file_types.File(self._file_client.get_file(name=name))
+
+    def delete_file(self, name):
+        if self._manager is None:
+            genai.delete_file(name)
+        else:
+            self._file_client.delete_file(request=genai.protos.DeleteFileRequest(name=name))
+
+class GenaiBackend:
+    """google.generativeaiでGeminiを呼び出すバックエンド
+
+    文字起こしと情報抽出はこのクラスのメソッドだけを通してAPIを呼ぶ。set_backendで同じメソッドを持つ
+    別の実装（計測用の偽のバックエンドなど）に差し替えられる。どちらのメソッドも1回分のリクエストで、
+    失敗時は例外を送出する（再試行はcall_with_key_poolが行う）。
+    リクエストは渡されたapi_key専用のGenaiKeyClientで送るため、複数のスレッドから同時に呼んでよい。
+    streamにResponseStreamを渡すと、ストリーミングで受信して届いた分から書き出す。
+    """
+
+    def __init__(self, isolated=True):
+        self.isolated = isolated
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+
+    def client(self, api_key):
+        """api_key専用のクライアントを返す（初回だけ作成する）"""
+        with self._clients_lock:
+            client = self._clients.get(api_key)
+            if client is None:
+                client = GenaiKeyClient(api_key, isolated=self.isolated)
+                self._clients[api_key] = client
+            return client
+
+    @staticmethod
+    def _generate(model, contents, stream):
+        if stream is None:
+            response = model.generate_content(contents)
+            text = response.text
+        else:
+            response = model.generate_content(contents, stream=True)
+            text = stream.consume(iter_stream_chunks(response), cancel=lambda: cancel_response_stream(response))
+        usage = getattr(response, 'usage_metadata', None)
+        return GenerationResult(text, get_total_tokens(response), getattr(usage, 'candidates_token_count', None) if usage else None)
+
+    def generate_text(self, api_key, model_name, prompt, stream=None):
+        """テキストのプロンプトを送り、GenerationResultを返す"""
+        return self._generate(self.client(api_key).model(model_name), prompt, stream)
+
+    def transcribe_audio(self, api_key, model_name, prompt, audio_file, mime_type, inline, stream=None):
+        """音声ファイルとプロンプトを送り、GenerationResultを返す（inline=Falseの場合はFile APIでアップロードする）"""
+        client = self.client(api_key)
+        model = client.model(model_name)
+
+        if inline:
+            with open(audio_file, 'rb') as audio:
+                audio_data = audio.read()
+            return self._generate(
+                model,
+                [
+                    prompt,
+                    {"mime_type": mime_type, "data": audio_data}
+                ],
+                stream
+            )
+        uploaded_file = client.upload_file(audio_file, mime_type=mime_type)
+        try:
+            uploaded_file = wait_for_uploaded_file(uploaded_file, client.get_file)
+            return self._generate(model, [prompt, uploaded_file], stream)
+        finally:
+            try:
+                client.delete_file(uploaded_file.name)
+            except Exception as e:
+                logging.warning(f"アップロードしたファイルの削除に失敗しました: {str(e)}")
+
+# キーごとのワーカープロセスで使うバックエンド
+_key_worker_backend = None
+
+def init_genai_key_worker(api_key):
+    """キー専用のワーカープロセスを初期化する関数（このプロセスではこのキーだけを使う）"""
+    global _key_worker_backend
+    setup_logging()
+    load_genai()
+    genai.configure(api_key=api_key, **get_genai_client_options())
+    _key_worker_backend = GenaiBackend(isolated=False)
+
+def run_genai_key_worker(method, api_key, *args):
+    """キー専用のワーカープロセスでバックエンドのメソッドを呼ぶ関数"""
+    return getattr(_key_worker_backend, method)(api_key, *args)
+
+class ProcessGenaiBackend:
+    """キーごとに専用のワーカープロセスでGeminiを呼び出すバックエンド
+
+    SDKがキーごとに独立したクライアントを作れない場合に使う。各プロセスは起動時に一度だけ
+    genai.configureでキーを設定するため、どのキーで送信されるかが競合しない。
+    ResponseStreamはプロセスをまたいで渡せないため、streamは無視して応答全体を一度に受け取る。
+    """
+
+    def __init__(self, max_workers_per_key=1):
+        self.max_workers_per_key = max(1, max_workers_per_key)
+        self._executors = {}
+        self._executors_lock = threading.Lock()
+
+    def _executor(self, api_key):
+        with self._executors_lock:
+            executor = self._executors.get(api_key)
+            if executor is None:
+                # gRPCのチャネルはforkしたプロセスに引き継げないため、spawnで起動する
+                executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.max_workers_per_key,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=init_genai_key_worker,
+                    initargs=(api_key,)
+                )
+                self._executors[api_key] = executor
+            return executor
+
+    def generate_text(self, api_key, model_name, prompt, stream=None):
+        return self._executor(api_key).submit(run_genai_key_worker, 'generate_text', api_key, model_name, prompt).result()
+
+    def transcribe_audio(self, api_key, model_name, prompt, audio_file, mime_type, inline, stream=None):
+        return self._executor(api_key).submit(
+            run_genai_key_worker, 'transcribe_audio', api_key, model_name, prompt, audio_file, mime_type, inline
+        ).result()
+
+    def shutdown(self):
+        with self._executors_lock:
+            for executor in self._executors.values():
+                executor.shutdown(wait=False, cancel_futures=True)
+            self._executors.clear()
+
+def create_default_backend():
+    """環境変数GEMINI_CLIENT_MODEに応じて既定のバックエンドを作成する関数
+
+    thread: キーごとのクライアントをこのプロセス内に持つ（GenaiBackend）
+    process: キーごとのワーカープロセスで呼び出す（ProcessGenaiBackend）
+    auto（既定）: SDKがキーごとのクライアントに対応していればthread、そうでなければprocess
+    threadでもSDKが対応していなければ、警告を出してprocessにする。
+    """
+    mode = (os.getenv('GEMINI_CLIENT_MODE') or 'auto').strip().lower()
+    if mode != 'process' and not supports_isolated_clients():
+        logging.warning(
+            f"google-generativeai {getattr(genai, '__version__', '（不明）')}ではAPIキーごとのクライアントを作れないため、"
+            "キーごとのワーカープロセスで呼び出します（ストリーミングでの受信は使えません）。"
+            "requrements.txtで指定したバージョンをインストールしてください。"
+        )
+        mode = 'process'
+    if mode == 'process':
+        logging.info("APIキーごとのワーカープロセスでGeminiを呼び出します。")
+        return ProcessGenaiBackend(get_env_int('GEMINI_MAX_CONCURRENCY_PER_KEY', 1))
+    return GenaiBackend()
+
+# API呼び出しに使うバックエンド
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    """APIの呼び出しに使うバックエンドを取得する関数（既定はcreate_default_backendで作成する）"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_default_backend()
+        return _backend
+
+def set_backend(backend):
+    """APIの呼び出しに使うバックエンドを差し替える関数（Noneで既定に戻す）"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+def transcribe_audio_with_key(audio_file, api_key, model_name=TRANSCRIPTION_MODEL, spills=None):
+    """指定されたAPIキー・モデルを使用して音声ファイルを文字起こしする関数（1回分のリクエスト）
+
+    (文字起こし結果, 使用トークン数)を返す。失敗時は例外を送出する。
+    一定サイズを超える音声はリクエストに埋め込まず、File APIでストリーミングアップロードする。
+    spills（SpillFiles）を渡すと応答をストリーミングで受け取り、届いた分から試行ごとのファイルに書き出す。
+    """
+    mime_type = get_audio_mime_type(audio_file)
+    inline_limit = get_env_float('MINUTES_INLINE_UPLOAD_MAX_MB', 15.0) * 1024 * 1024
+
+    size = os.path.getsize(audio_file)
+    set_span_attributes(bytes_sent=size, upload='inline' if size <= inline_limit else 'file_api', mime_type=mime_type)
+    stream = new_response_stream(spills)
+    result = get_backend().transcribe_audio(api_key, model_name, TRANSCRIPTION_PROMPT, audio_file, mime_type, size <= inline_limit, stream=stream)
+
+    if not result.text:
+        raise ValueError("レスポンスにテキストが含まれていません。")
+    set_span_attributes(response_chars=len(result.text))
+    if stream is not None:
+        stream.record_rate(result.output_tokens)
+    return result.text, result.total_tokens
+
+# 途中で途切れたパートの後ろに入れる印
+TRANSCRIPT_GAP_MARKER = "［この間の文字起こしは途中で途切れたため欠けています］"
+
+class PartialTranscript(str):
+    """すべての試行が失敗し、途中まで届いた分だけの文字起こし結果（末尾が欠けている）"""
+
+def get_transcript_status(text):
+    """文字起こし結果に対応するチャンクの状態を返す関数"""
+    if isinstance(text, PartialTranscript):
+        return JobStore.PARTIAL
+    return JobStore.DONE if text else JobStore.FAILED
+
+def transcribe_audio_part(audio_file, key_pool, estimated_tokens=0, retry_policy=None, control=None, hedger=None, source_key=None):
+    """キープールから空いているキーを借りて文字起こしする関数（失敗時はNoneを返す）
+
+    モデルは文字起こしのModelTiersで選び、クォータ超過が続くと代替のモデルに切り替える。
+    同じ音声・プロンプトで通常のモデル（クォータ超過中は今使う代替モデルまで）の結果がキャッシュにあれば、APIを呼ばずにそれを返す。
+    音声はsource_key（get_part_source_key、元の音声と区間と変換方法）で識別し、省略時はパートの内容のハッシュで識別する。
+    キャンセルされた場合はNoneを返さず、JobCancelledを送出する。
+    hedgerを渡すと、応答が遅れた場合に別のキーで重複リクエストを送る（StragglerHedger）。
+    応答はパートと同じディレクトリのスピルファイルに届いた分から書き出し、すべての試行が失敗しても
+    MINUTES_STREAM_MIN_PARTIAL_CHARS文字以上届いていれば、その途中までの結果をPartialTranscriptとして返す（キャッシュはしない）。
+    """
+    spills = SpillFiles(os.path.basename(audio_file), os.path.dirname(os.path.abspath(audio_file)))
+    with trace_span('transcribe', part=os.path.basename(audio_file)) as span, contextlib.ExitStack() as cleanup:
+        # 結果を捨てた重複リクエストがまだスピルファイルに書いている間は削除しない（Windowsでは削除に失敗して残る）
+        if hedger is not None:
+            cleanup.callback(hedger.when_settled, audio_file, spills.close)
+        else:
+            cleanup.callback(spills.close)
+        tiers = get_model_tiers('transcription')
+        cache = get_result_cache()
+        file_hash = None
+        if cache:
+            file_hash = source_key or hash_file(audio_file)
+            for model in tiers.cache_models():
+                cached_text = cache.get('transcript', ResultCache.make_key(file_hash, TRANSCRIPTION_PROMPT, model))
+                if cached_text:
+                    logging.info(f"{audio_file}はキャッシュ済みの文字起こし結果を使用します。")
+                    span.set(cache_hit=True, model=model)
+                    if hedger is not None:
+                        # 送信を待たずに済んだチャンクも数えないと、すべてのチャンクの送信を待つヘッジが始まらない
+                        hedger.skip(audio_file)
+                    return cached_text
+
+        def operation(api_key):
+            model, (text, tokens_used) = tiers.run(lambda model: transcribe_audio_with_key(audio_file, api_key, model, spills))
+            return (text, model), tokens_used
+
+        retry_policy = retry_policy or RetryPolicy.from_env()
+        description = f"文字起こし（{os.path.basename(audio_file)}）"
+        try:
+            if hedger is not None:
+                text, model = hedger.call(
+                    audio_file, operation, retry_policy, description, estimated_tokens, control=control,
+                    span_name='transcribe_attempt', hedge_span_name='transcribe_hedge'
+                )
+            else:
+                text, model = call_with_key_pool(
+                    operation,
+                    key_pool,
+                    retry_policy,
+                    description,
+                    estimated_tokens,
+                    span_name='transcribe_attempt',
+                    control=control
+                )
+        except JobCancelled as e:
+            span.fail(e)
+            raise
+        except Exception as e:
+            logging.error(f"{audio_file}の文字起こしに失敗しました: {str(e)}")
+            span.fail(e)
+            partial_text = spills.longest_text()
+            min_partial_chars = get_env_int('MINUTES_STREAM_MIN_PARTIAL_CHARS', 200)
+            if min_partial_chars > 0 and len(partial_text) >= min_partial_chars:
+                logging.warning(f"{audio_file}は途中まで届いた文字起こし結果（{len(partial_text)}文字）を使用します。")
+                span.set(partial=True, response_chars=len(partial_text))
+                return PartialTranscript(partial_text)
+            return None
+        logging.info(f"{audio_file}の文字起こしが成功しました。")  # 成功メッセージのみ
+        span.set(response_chars=len(text), model=model)
+        if cache:
+            cache.put('transcript', ResultCache.make_key(file_hash, TRANSCRIPTION_PROMPT, model), text)
+        return text
+
+def normalize_for_matching(text):
+    """照合用に空白・句読点を除いて小文字化した文字列と、元の文字位置の対応表を返す関数"""
+    chars = []
+    positions = []
+    for i, char in enumerate(text):
+        if char.isspace() or unicodedata.category(char).startswith('P'):
+            continue
+        chars.append(char.lower())
+        positions.append(i)
+    return ''.join(chars), positions
+
+def find_overlap_end(previous_text, next_text, window_ratio=0.25, min_window=200, ngram=3, min_matches=32, min_density=0.7,
+                     band=4, candidates=8, sentence_snap=20, max_chars=None):
+    """next_textの先頭のうち、previous_textの末尾と重複している部分の終わりの位置を返す関数
 
-def get_ffprobe_path():
-    """ffprobeのパスを取得する関数"""
-    # 環境変数からパスを取得
-    ffprobe_path = os.environ.get('FFPROBE_PATH')
-    if ffprobe_path:
-        return ffprobe_path
+    末尾・先頭の一定割合（max_charsを渡すとその文字数まで）で文字n-gramの一致を集め、一致が多い
+    ずれ（previous_text側の位置 − next_text側の位置）を候補にする。候補ごとに、ずれを±band文字の範囲で
+    追いかけながら（言い換えによる文字の増減に追従する）一致を数える。一致がnext_textの先頭から
+    previous_textの末尾まで続き、そのずれが表す重複の長さに占める一致の割合がmin_density以上のものを
+    重複とみなす。定型的な言い回しが多い会話では、無関係な文章でも同じn-gramが順不同に多数現れるため、
+    一致の数だけでなく位置のそろい方を見る。
+    言い換えで一致しなかった文末が残らないよう、近くに文の区切りがあればそこまで広げる。
+    重複が見つからなければ0を返す。
+    """
+    window = max(min_window, int(min(len(previous_text), len(next_text)) * window_ratio))
+    if max_chars is not None:
+        window = min(window, max_chars)
+    tail, _ = normalize_for_matching(previous_text[-window:])
+    head, head_positions = normalize_for_matching(next_text[:window])
+    if len(tail) < ngram or len(head) < ngram:
+        return 0
 
-    # 実行ファイルと同じディレクトリにffprobeがあるか確認
-    base_path = Path(sys.executable).parent if getattr(sys, 'frozen', False) else Path(__file__).parent
-    ffprobe_path = base_path / 'ffprobe.exe'
-    if ffprobe_path.exists():
-        return str(ffprobe_path)
+    tail_positions = collections.defaultdict(list)  # n-gram -> previous_text側の位置（昇順）
+    for i in range(len(tail) - ngram + 1):
+        tail_positions[tail[i:i + ngram]].append(i)
+    head_ngrams = [head[j:j + ngram] for j in range(len(head) - ngram + 1)]
+    offsets = collections.Counter()
+    for j, gram in enumerate(head_ngrams):
+        for i in tail_positions.get(gram, ()):
+            offsets[i - j] += 1
 
-    # システムのPATHから検索
-    return 'ffprobe'
+    best_matches = 0
+    best_end = 0
+    for offset, _ in offsets.most_common(candidates):
+        if offset < 0:
+            continue
+        # このずれのとき、next_textの先頭からexpected個のn-gramがprevious_textの末尾と重なるはず
+        expected = len(tail) - ngram + 1 - offset
+        matches = 0
+        first = None
+        end = 0
+        current = offset
+        for j in range(min(len(head_ngrams), expected + band)):
+            positions = tail_positions.get(head_ngrams[j])
+            if not positions:
+                continue
+            k = bisect.bisect_left(positions, j + current - band)
+            nearby = positions[k:bisect.bisect_right(positions, j + current + band)]
+            if nearby:
+                current = min(nearby, key=lambda i: abs(i - j - current)) - j
+                matches += 1
+                first = j if first is None else first
+                end = j + ngram
+        # 重なった音声は同じ位置から始まるため、一致はnext_textの先頭から始まり、previous_textの末尾まで続くはず
+        starts_at_head = first is not None and first <= band * 2
+        reaches_tail_end = end + current >= len(tail) - band - ngram
+        if (matches >= min_matches and matches / max(expected, 1) >= min_density and starts_at_head and reaches_tail_end
+                and matches > best_matches):
+            best_matches = matches
+            best_end = end
+    if not best_end:
+        return 0
 
-def split_audio_file(audio_file_path, num_parts):
-    """音声ファイルを指定された数の部分に重なりを持たせて分割する関数"""
-    file_size = os.path.getsize(audio_file_path)
-    duration = get_audio_duration(audio_file_path)  # 音声ファイルの長さを取得
-    part_duration = duration / num_parts  # 各部分の長さ
-    overlap_duration = part_duration * 0.1  # 10%の重なりを持たせる
+    # 正規化前の位置に戻し、近くに文の区切りがあればそこまで、続く句読点や空白も重複側に含める
+    cut = head_positions[best_end - 1] + 1
+    sentence_end = re.search(r'[。．.！!？?\n]', next_text[cut:cut + sentence_snap])
+    if sentence_end:
+        cut += sentence_end.end()
+    while cut < len(next_text) and (next_text[cut].isspace() or unicodedata.category(next_text[cut]).startswith('P')):
+        cut += 1
+    return cut
 
-    parts = []
-    for i in range(num_parts):
-        start_time = max(0, i * part_duration - (overlap_duration if i > 0 else 0))
-        part_file = f"{audio_file_path}_part{i+1}.mp3"
-        command = [
-            str(get_ffmpeg_path()),  # ffmpegのパスを取得
-            '-y',  # 追加: 出力ファイルが存在する場合は上書き
-            '-i', audio_file_path,
-            '-ss', str(start_time),
-            '-t', str(part_duration + (overlap_duration if i < num_parts - 1 else 0)),
-            '-c', 'copy',
-            part_file
-        ]
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='utf-8')
-        if result.returncode != 0:
-            logging.error(f"FFmpegエラー: {result.stderr}")
-        parts.append(part_file)
+def stitch_transcripts(texts, overlaps_previous, max_overlap_chars=None):
+    """分割ごとの文字起こしをつなぎ合わせ、重なり部分の重複を取り除く関数
 
-    return parts
+    overlaps_previous[i]が真のつなぎ目（音声が重なっている境界）だけ重複を探す。
+    max_overlap_chars[i]を渡すと、i番目のつなぎ目で削除する文字数をその範囲に限る。
+    (結合した文字列, つなぎ目ごとに削除した文字数のリスト)を返す。
+    """
+    pieces = []
+    removed_chars = []
+    previous_text = None
+    for i, text in enumerate(texts):
+        if i > 0:
+            removed = 0
+            # 途中で途切れたパートの末尾は重なりの区間まで届いていないため、重複を探さない
+            if text and previous_text and overlaps_previous[i] and not isinstance(previous_text, PartialTranscript):
+                removed = find_overlap_end(previous_text, text, max_chars=max_overlap_chars[i] if max_overlap_chars else None)
+                text = text[removed:]
+            removed_chars.append(removed)
+        if text:
+            pieces.append(text)
+            if isinstance(texts[i], PartialTranscript):
+                # 途中で途切れたパートの後ろは欠けているため、読み手にわかるよう印を入れる
+                pieces.append(TRANSCRIPT_GAP_MARKER)
+        previous_text = texts[i]
+    return "\n".join(pieces), removed_chars
 
-def get_audio_duration(audio_file_path):
-    """音声ファイルの長さを取得する関数"""
-    command = [
-        str(get_ffprobe_path()),  # ffprobeのパスを取得
-        '-v', 'error',
-        '-show_entries', 'format=duration',
-        '-of', 'default=noprint_wrappers=1:nokey=1',
-        audio_file_path
-    ]
-    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    return float(result.stdout.strip())
+def estimate_overlap_chars(texts, segments, slack=1.5, margin=40):
+    """つなぎ目ごとに、音声の重なりの長さから重複しうる文字数の上限を見積もる関数
 
-def transcribe_audio_with_key(audio_file, api_key, retries=3):
-    """指定されたAPIキーを使用して音声ファイルを文字起こしする���数"""
-    for attempt in range(retries):
-        try:
-            with open(audio_file, 'rb') as audio:
-                audio_data = audio.read()
+    重なりの秒数に、その区間の文字起こしの1秒あたりの文字数を掛け、言い換えの揺れの分だけ余裕を持たせる。
+    """
+    limits = [0]
+    for i in range(1, len(segments)):
+        overlap_seconds = max(0.0, segments[i - 1].end - segments[i].start)
+        duration = segments[i].end - segments[i].start
+        chars_per_second = len(texts[i] or '') / duration if duration > 0 else 0.0
+        limits.append(int(overlap_seconds * chars_per_second * slack) + margin)
+    return limits
 
-            model = genai.GenerativeModel('gemini-1.5-pro')
-            genai.configure(api_key=api_key)
+def generate_text(prompt, cache_namespace, description, key_pool=None, retry_policy=None, stage='generate', control=None):
+    """テキストのみのプロンプトを情報抽出用のモデルに送る関数（同じプロンプトの結果はキャッシュから返す）
 
-            prompt = """
-            以下の音声ファイルを文字起こししてください。以下の点に注意してください：
-            1. 日本語で出力してください。
-            2. 時間表記（例：13:05）は削除してください。
-            3. 相槌（例：はい、うん、ええ）や言い淀み（例：あの、えーと）は削除してください。
-            4. 文脈を損なわない範囲で、できるだけ簡潔に文字起こしを行ってください。
-            5. 話者の区別は不要です。
-            """
+    stageの名前で区間を記録し、プロンプトと応答の文字数・使用トークン数を属性に残す。
+    モデルは情報抽出のModelTiersで選び、クォータ超過が続くと代替のモデルに切り替える。
+    応答はストリーミングで受け取り、一時ディレクトリのスピルファイルに届いた分から書き出す。
+    """
+    tiers = get_model_tiers('extraction')
 
-            response = model.generate_content(
-                [
-                    prompt,
-                    {"mime_type": "audio/mp3", "data": audio_data}
-                ]
-            )
+    def request(api_key):
+        stream = new_response_stream(spills)
+        model, result = tiers.run(lambda model: get_backend().generate_text(api_key, model, prompt, stream=stream))
+        text = result.text.strip()
+        set_span_attributes(prompt_chars=len(prompt), response_chars=len(text))
+        if stream is not None:
+            stream.record_rate(result.output_tokens)
+        return (text, model), result.total_tokens
 
-            if hasattr(response, 'text'):
-                logging.info(f"{audio_file}の文字起こしが成功しました。")  # 成功メッセージのみ
-                return response.text
-            else:
-                logging.error(f"文字起こし失敗: {audio_file} - レスポンスにテキストが含まれていません。")
-        except google.api_core.exceptions.ResourceExhausted:
-            logging.error(f"文字起こし失敗: {audio_file} - 429 Resource has been exhausted (e.g. check quota).")
-        except Exception as e:
-            logging.error(f"文字起こし失敗: {audio_file} - {str(e)}")
-        
-        if attempt < retries - 1:
-            logging.info(f"リトライを試みます ({attempt + 2}/{retries})")
-            time.sleep(60)
-        else:
-            logging.error(f"{audio_file}の文字起こしが{retries}回失敗しました。")
-    
-    return None
+    with trace_span(stage, prompt_chars=len(prompt)) as span:
+        cache = get_result_cache()
+        if cache:
+            for model in tiers.cache_models():
+                cached_text = cache.get(cache_namespace, ResultCache.make_key(prompt, model))
+                if cached_text:
+                    logging.info(f"キャッシュ済みの{description}結果を使用します。")
+                    span.set(cache_hit=True, response_chars=len(cached_text), model=model)
+                    return cached_text
 
-def extract_information(text):
+        with SpillFiles(stage) as spills:
+            text, model = call_with_key_pool(
+                request,
+                key_pool or get_api_key_pool(),
+                retry_policy or RetryPolicy.from_env(),
+                description,
+                estimated_tokens=len(prompt),
+                span_name=f'{stage}_attempt',
+                control=control
+            )
+        span.set(response_chars=len(text or ''), model=model)
+        if cache and text:
+            cache.put(cache_namespace, ResultCache.make_key(prompt, model), text)
+        return text
+
+def extract_information(text, key_pool=None, retry_policy=None, control=None):
     # logging.info(f"抽出前のテキスト: {text}")  # 抽出前のテキストをログに出力しない
     cleaned_text = " ".join(text.split())
     # logging.info(f"クリーンアップ後のテキスト: {cleaned_text}")  # クリーンアップ後のテキストをログに出力しない
 
-    gemini_pro_api_key = os.getenv('GEMINI_API_KEY_1')
-    if not gemini_pro_api_key:
-        logging.error("Gemini-pro APIキーが設定されていません。環境変数.envファイルを確認してください。")
-        return
-
-    genai.configure(api_key=gemini_pro_api_key)
-    model = genai.GenerativeModel('gemini-1.5-pro')
-    
     # create_extraction_promptを使用してプロンプトを生成
     prompt = create_extraction_prompt(cleaned_text)
 
     try:
         logging.info("情報抽出を開始します。")
-        response = model.generate_content(prompt)
-        extracted_text = response.text.strip()
-        logging.info(f"抽出結果全体: {extracted_text}")
+        extracted_text = generate_text(prompt, 'extract', "情報抽出", key_pool, retry_policy, stage='extract', control=control)
+        logging.info(f"情報抽出が完了しました（{len(extracted_text or '')}文字）。")
+        logging.debug(f"抽出結果全体: {extracted_text}")
         return extracted_text
+    except JobCancelled:
+        raise
     except Exception as e:
         logging.exception(f"情報抽出中にエラーが発生しました: {str(e)}")
         raise
 
-def create_excel(extracted_info, output_file):
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "議事録"
+def extract_topic_candidates(text, index, total, key_pool=None, retry_policy=None, control=None):
+    """会議の一部分の文字起こしから議題の候補を抽出する関数（map-reduce方式のmap側）"""
+    cleaned_text = " ".join(text.split())
+    prompt = create_chunk_extraction_prompt(cleaned_text, index, total)
+    candidates = generate_text(prompt, 'extract_map', f"議題候補の抽出（パート{index}）", key_pool, retry_policy, stage='extract_map', control=control)
+    logging.info(f"パート{index}の議題候補を抽出しました。")
+    return candidates
 
-    # 列の幅を設定
-    ws.column_dimensions['A'].width = 20
-    ws.column_dimensions['B'].width = 80
-
-    # 会議詳細情報を追加
-    meeting_details = [
-        "会議名",
-        "日時",
-        "場所",
-        "参加者",
-        "欠席者"
-    ]
+def merge_topic_candidates(candidates, key_pool=None, retry_policy=None, control=None):
+    """各部分の議題候補を会議全体の議題一覧（議題①〜⑩の形式）にまとめる関数（map-reduce方式のreduce側）"""
+    logging.info(f"{len(candidates)}パート分の議題候補を統合します。")
+    prompt = create_merge_extraction_prompt(candidates)
+    extracted_text = generate_text(prompt, 'extract', "議題の統合", key_pool, retry_policy, stage='extract_merge', control=control)
+    logging.info(f"議題候補の統合が完了しました（{len(extracted_text or '')}文字）。")
+    logging.debug(f"抽出結果全体: {extracted_text}")
+    return extracted_text
+
+def use_mapreduce_extraction(duration):
+    """情報抽出をmap-reduce方式で行うかを決める関数
+
+    環境変数MINUTES_EXTRACTION_MODEでsingle（全文を1回で抽出）・mapreduce・autoを選べる。
+    autoの場合は、録音がMINUTES_MAPREDUCE_MIN_MINUTES分以上のときにmap-reduce方式にする。
+    """
+    mode = (os.getenv('MINUTES_EXTRACTION_MODE') or 'auto').strip().lower()
+    if mode == 'mapreduce':
+        return True
+    if mode == 'single':
+        return False
+    return duration >= get_env_float('MINUTES_MAPREDUCE_MIN_MINUTES', 60.0) * 60
+
+# 会議の詳細項目（Excelの1〜5行目、テンプレートの「会議名」などに対応）
+MEETING_DETAIL_KEYS = ("会議名", "日時", "場所", "参加者", "欠席者")
+# テンプレートに用意されている議題の数（議題①〜⑩）
+MAX_TEMPLATE_TOPICS = 10
+
+MeetingTopic = collections.namedtuple('MeetingTopic', ['label', 'title', 'summary'])
+
+def get_topic_key(number):
+    """議題の番号（1始まり）から「議題①」形式のキーを返す関数"""
+    return f'議題{chr(0x2460 + number - 1)}'
+
+class MeetingMinutes:
+    """会議の詳細と議題の一覧を保持する抽出結果
+
+    Excel・Wordのどちらもこのオブジェクトから出力するため、同じジョブで両方を作るときに
+    ファイルを書き出して読み直す必要がない。
+    """
 
-    for i, detail in enumerate(meeting_details, start=1):
-        ws.cell(row=i, column=1, value=detail)
-        ws.cell(row=i, column=1).font = openpyxl.styles.Font(bold=True)
-        ws.cell(row=i, column=1).fill = openpyxl.styles.PatternFill(start_color="E0E0E0", end_color="E0E0E0", fill_type="solid")
+    def __init__(self, details=None, topics=None):
+        self.details = {key: '' for key in MEETING_DETAIL_KEYS}
+        self.details.update(details or {})
+        self.topics = list(topics or [])
 
-    row = 6  # 会議詳細情報の後から開始
+    def to_template_data(self):
+        """テンプレートの置換に使う辞書（extract_info_from_xlsxと同じ形式）を返す"""
+        data = {key: self.details.get(key) or '' for key in MEETING_DETAIL_KEYS}
+        for i in range(1, MAX_TEMPLATE_TOPICS + 1):
+            topic = self.topics[i - 1] if i <= len(self.topics) else None
+            data[get_topic_key(i)] = topic.title if topic else ''
+            data[f'{get_topic_key(i)}の要約'] = topic.summary if topic else ''
+        return data
 
-    lines = extracted_info.split('\n')
+    @classmethod
+    def from_template_data(cls, data):
+        """extract_info_from_xlsxが返す辞書からMeetingMinutesを作る"""
+        topics = []
+        for i in range(1, MAX_TEMPLATE_TOPICS + 1):
+            title = data.get(get_topic_key(i)) or ''
+            summary = data.get(f'{get_topic_key(i)}の要約') or ''
+            if title or summary:
+                topics.append(MeetingTopic(get_topic_key(i), title, summary))
+        return cls({key: data.get(key) or '' for key in MEETING_DETAIL_KEYS}, topics)
+
+def parse_extracted_info(extracted_info):
+    """Geminiが返した「議題①: ...」「議題①の要約: ...」形式のテキストをMeetingMinutesに変換する関数"""
+    # 従来のExcel出力と同じ規則で（見出し, 内容）の行に分解する
+    rows = []
     current_topic = ""
     current_summary = ""
-
-    for line in lines:
+    for line in extracted_info.split('\n'):
         line = line.strip()
         if line.startswith("議題"):
             if current_topic and current_summary:
-                # 前の議題を書き込む
-                ws.cell(row=row, column=1, value=current_topic)
-                cell = ws.cell(row=row, column=2, value=current_summary)
-                cell.alignment = Alignment(wrap_text=True)
-                row += 1
+                rows.append((current_topic, current_summary))
             parts = line.split(':', 1)
             if len(parts) == 2:
                 current_topic = parts[0].strip()
@@ -320,192 +2839,1019 @@ def create_excel(extracted_info, output_file):
                 current_summary = line.split("の要約:", 1)[1].strip()
         elif current_summary:
             current_summary += " " + line.strip()
-
-    # 最後の議題を書き込む
     if current_topic and current_summary:
-        ws.cell(row=row, column=1, value=current_topic)
-        cell = ws.cell(row=row, column=2, value=current_summary)
-        cell.alignment = Alignment(wrap_text=True)
-
-    # セルのスタイルを設定
-    for row in ws['A1:B'+str(ws.max_row)]:
-        for cell in row:
-            cell.border = openpyxl.styles.Border(left=openpyxl.styles.Side(style='thin'), 
-                                                 right=openpyxl.styles.Side(style='thin'), 
-                                                 top=openpyxl.styles.Side(style='thin'), 
-                                                 bottom=openpyxl.styles.Side(style='thin'))
-            if cell.column == 1:  # A列のセルの場合
-                cell.font = openpyxl.styles.Font(bold=True)
-                cell.fill = openpyxl.styles.PatternFill(start_color="E0E0E0", end_color="E0E0E0", fill_type="solid")
-            elif cell.column == 2:  # B列のセルの場合
-                cell.alignment = Alignment(wrap_text=True)
-
-    # B列の幅を内容に合わせて自動調整
-    for column_cells in ws.columns:
-        length = max(len(str(cell.value)) for cell in column_cells)
-        if column_cells[0].column_letter == 'B':
-            ws.column_dimensions[column_cells[0].column_letter].width = min(100, max(80, length))
+        rows.append((current_topic, current_summary))
 
-    try:
-        wb.save(output_file)
-        logging.info(f"Excelファイルが正常に作成されました: {output_file}")
-    except PermissionError:
-        logging.error(f"Excelファイルの保存失敗しました。書き込み権限がありません: {output_file}")
-    except Exception as e:
-        logging.error(f"Excelファイルの保存中にエラーが発生しました: {str(e)}")
+    # 「議題①」の行と続く「議題①の要約」の行を1つの議題にまとめる
+    topics = []
+    for label, value in rows:
+        if label.endswith("の要約") and topics and topics[-1].label == label[:-len("の要約")] and not topics[-1].summary:
+            topics[-1] = topics[-1]._replace(summary=value)
+        elif label.endswith("の要約"):
+            topics.append(MeetingTopic(label[:-len("の要約")], '', value))
+        else:
+            topics.append(MeetingTopic(label, value, ''))
+    return MeetingMinutes(topics=topics)
+
+# Excel出力で使う名前付きスタイル（セルごとに書式オブジェクトを作らず、ブック内で共有する）
+EXCEL_LABEL_STYLE = 'minutes_label'
+EXCEL_VALUE_STYLE = 'minutes_value'
+EXCEL_INDEX_SHEET = '目次'
+
+def register_excel_styles(wb):
+    """見出し列（A列）と内容列（B列）の名前付きスタイルをブックに登録する関数"""
+    load_openpyxl()
+    if EXCEL_LABEL_STYLE in wb.named_styles:
+        return
+    thin = openpyxl.styles.Side(style='thin')
+    border = openpyxl.styles.Border(left=thin, right=thin, top=thin, bottom=thin)
+    label_style = openpyxl.styles.NamedStyle(name=EXCEL_LABEL_STYLE)
+    label_style.font = openpyxl.styles.Font(bold=True)
+    label_style.fill = openpyxl.styles.PatternFill(start_color="E0E0E0", end_color="E0E0E0", fill_type="solid")
+    label_style.border = border
+    value_style = openpyxl.styles.NamedStyle(name=EXCEL_VALUE_STYLE)
+    value_style.alignment = Alignment(wrap_text=True)
+    value_style.border = border
+    wb.add_named_style(label_style)
+    wb.add_named_style(value_style)
+
+def iter_minutes_rows(minutes):
+    """抽出結果をExcelの（見出し, 内容）の行に展開するジェネレータ"""
+    # 会議詳細情報（1〜5行目）
+    for detail in MEETING_DETAIL_KEYS:
+        yield detail, minutes.details.get(detail) or None
+    # 議題ごとに「議題①」「議題①の要約」の2行
+    for topic in minutes.topics:
+        for label, value in ((topic.label, topic.title), (f"{topic.label}の要約", topic.summary)):
+            if value:
+                yield label, value
+
+def write_minutes_sheet(wb, title, minutes):
+    """書き込み専用のブックに会議1件分のシートを追加する関数"""
+    load_openpyxl()
+    rows = []
+    length = 0
+    for label, value in iter_minutes_rows(minutes):
+        rows.append((label, value))
+        length = max(length, len(str(value)))
+
+    ws = wb.create_sheet(title)
+    # 書き込み専用モードでは、列の幅は行を書き込む前に決める必要がある
+    ws.column_dimensions['A'].width = 20
+    ws.column_dimensions['B'].width = min(100, max(80, length))  # B列の幅を内容に合わせて調整
+    for label, value in rows:
+        label_cell = openpyxl.cell.WriteOnlyCell(ws, value=label)
+        label_cell.style = EXCEL_LABEL_STYLE
+        value_cell = openpyxl.cell.WriteOnlyCell(ws, value=value)
+        value_cell.style = EXCEL_VALUE_STYLE
+        ws.append([label_cell, value_cell])
+    return ws
+
+def create_excel(minutes, output_file):
+    """抽出結果（MeetingMinutesまたは抽出テキスト）をExcelファイルに書き出す関数"""
+    if isinstance(minutes, str):
+        minutes = parse_extracted_info(minutes)
+
+    with trace_span('create_excel', topics=len(minutes.topics)) as span:
+        load_openpyxl()
+        wb = openpyxl.Workbook(write_only=True)
+        register_excel_styles(wb)
+        write_minutes_sheet(wb, "議事録", minutes)
+
+        try:
+            wb.save(output_file)
+            logging.info(f"Excelファイルが正常に作成されました: {output_file}")
+        except PermissionError as e:
+            span.fail(e)
+            logging.error(f"Excelファイルの保存失敗しました。書き込み権限がありません: {output_file}")
+        except Exception as e:
+            span.fail(e)
+            logging.error(f"Excelファイルの保存中にエラーが発生しました: {str(e)}")
+
+def make_sheet_title(name, used_titles):
+    """Excelのシート名に使えない文字を除き、31文字以内の重複しない名前にする関数"""
+    title = re.sub(r'[\\/*?:\[\]]', '_', name).strip("'") or 'Sheet'
+    title = title[:31]
+    candidate = title
+    number = 2
+    while candidate.lower() in used_titles:
+        suffix = f"_{number}"
+        candidate = title[:31 - len(suffix)] + suffix
+        number += 1
+    used_titles.add(candidate.lower())
+    return candidate
+
+class ConsolidatedWorkbook:
+    """複数の会議の抽出結果を1つのExcelファイルにまとめるライター
+
+    会議ごとに1シートを追加し、closeのときに各シートへのリンクを並べた目次シートを先頭に書き込む。
+    書き込み専用モードで行を順に書き出すため、会議の数が多くてもメモリを使いすぎない。
+    """
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        load_openpyxl()
+        self._wb = openpyxl.Workbook(write_only=True)
+        register_excel_styles(self._wb)
+        self._index = self._wb.create_sheet(EXCEL_INDEX_SHEET)
+        self._used_titles = {EXCEL_INDEX_SHEET.lower()}
+        self._entries = []
+        self._lock = threading.Lock()
+
+    def add(self, name, minutes, source=''):
+        """会議1件分のシートを追加し、シート名を返す（複数のスレッドから呼び出せる）"""
+        with self._lock:
+            title = make_sheet_title(name, self._used_titles)
+            write_minutes_sheet(self._wb, title, minutes)
+            self._entries.append((title, minutes.details.get('会議名') or '', len(minutes.topics), source))
+            return title
 
-def process_audio_file(audio_file_path, processed_files):
+    def close(self):
+        with self._lock:
+            self._index.column_dimensions['A'].width = 6
+            self._index.column_dimensions['B'].width = 40
+            self._index.column_dimensions['C'].width = 30
+            self._index.column_dimensions['D'].width = 8
+            self._index.column_dimensions['E'].width = 60
+            header = []
+            for value in ('No', 'シート', '会議名', '議題数', '元ファイル'):
+                cell = openpyxl.cell.WriteOnlyCell(self._index, value=value)
+                cell.style = EXCEL_LABEL_STYLE
+                header.append(cell)
+            self._index.append(header)
+            for number, (title, meeting_name, topic_count, source) in enumerate(self._entries, start=1):
+                link = openpyxl.cell.WriteOnlyCell(self._index, value=title)
+                link.hyperlink = Hyperlink(ref='', location=f"'{title}'!A1")
+                self._index.append([number, link, meeting_name, topic_count, source])
+            self._wb.save(self.output_file)
+            logging.info(f"{len(self._entries)}件の会議をまとめたExcelファイルを作成しました: {self.output_file}")
+
+OUTPUT_FORMATS = ('xlsx', 'docx')
+
+def get_output_dir():
+    """抽出結果・議事録の保存先を取得する関数（環境変数MINUTES_OUTPUT_DIR、既定はドキュメントフォルダ）"""
+    return os.environ.get('MINUTES_OUTPUT_DIR') or os.path.join(Path.home(), 'Documents')
+
+def get_output_formats():
+    """音声処理の出力形式を環境変数MINUTES_OUTPUT_FORMATS（例: xlsx,docx）から取得する関数"""
+    formats = []
+    for name in os.getenv('MINUTES_OUTPUT_FORMATS', 'xlsx').split(','):
+        name = name.strip().lower().lstrip('.')
+        if name in OUTPUT_FORMATS and name not in formats:
+            formats.append(name)
+        elif name:
+            logging.warning(f"未対応の出力形式です: {name}")
+    return formats or ['xlsx']
+
+def write_meeting_outputs(minutes, stem, formats=None):
+    """抽出結果を指定された形式（xlsx / docx）で保存先フォルダに書き出し、作成したパスの一覧を返す関数"""
+    output_files = []
+    for output_format in formats or get_output_formats():
+        if output_format == 'xlsx':
+            output_file = os.path.join(get_output_dir(), f"{stem}_抽出結果.xlsx")
+            create_excel(minutes, output_file)
+        else:
+            # Excelを経由せず、抽出結果から直接議事録を作成する
+            output_file = os.path.join(get_output_dir(), f"{stem}_議事録.docx")
+            with trace_span('render_docx', topics=len(minutes.topics)):
+                get_compiled_template().save(minutes.to_template_data(), output_file)
+            logging.info(f"議事録が作成されました: {output_file}")
+        output_files.append(output_file)
+    return output_files
+
+def stitch_job_transcripts(transcribed_texts, segments):
+    """パートごとの文字起こしを結合し、つなぎ目で削除した重複をログに残す関数（結合した文字列を返す）"""
+    with trace_span('stitch') as span:
+        combined_text, removed_chars = stitch_transcripts(
+            transcribed_texts, [segment.overlaps_previous for segment in segments], estimate_overlap_chars(transcribed_texts, segments)
+        )
+        span.set(removed_chars=sum(removed_chars))
+    for boundary, removed in enumerate(removed_chars, start=1):
+        if removed:
+            logging.info(f"パート{boundary}とパート{boundary + 1}のつなぎ目で重複した{removed}文字を削除しました。")
+    logging.info(f"重複の削除量: 合計{sum(removed_chars)}文字")
+    return combined_text
+
+def extract_and_write_minutes(audio_file_path, combined_text, transcribed_texts, topic_candidates, key_pool, job_store, control, workbook=None):
+    """文字起こし結果から情報を抽出して議事録を出力し、ジョブの記録を更新する関数（成功したらTrueを返す）
+
+    topic_candidatesにパートごとの議題候補（map-reduce方式の場合）を渡すと、候補が揃っていれば
+    統合リクエストだけで抽出し、揃っていなければ全文から抽出する。
+    """
+    audio_file_name = os.path.basename(audio_file_path)
+    extracted_info = None
+    if topic_candidates is not None:
+        # 文字起こしに成功したすべてのパートで候補が揃っていれば、小さな統合リクエストだけで済む
+        if all(topic_candidates[i] for i, text in enumerate(transcribed_texts) if text) and any(topic_candidates):
+            try:
+                extracted_info = merge_topic_candidates([c for c in topic_candidates if c], key_pool, control=control)
+            except JobCancelled:
+                raise
+            except Exception as e:
+                logging.error(f"議題候補の統合に失敗しました。全文から抽出します: {str(e)}")
+        else:
+            logging.warning("一部のパートで議題候補を抽出できなかったため、全文から抽出します。")
+    if not extracted_info:
+        extracted_info = extract_information(combined_text, control=control)
+    control.check()
+    if not extracted_info:
+        logging.error(f"{audio_file_name}の情報抽出に失敗しました。")
+        job_store.fail_file(audio_file_name, "情報抽出に失敗しました。")
+        return False
+    minutes = parse_extracted_info(extracted_info)
+    output_files = write_meeting_outputs(minutes, os.path.splitext(audio_file_name)[0])
+    if workbook is not None:
+        # 一括処理では、全録音をまとめたExcelファイルにもシートを追加する
+        workbook.add(os.path.splitext(audio_file_name)[0], minutes, os.path.abspath(audio_file_path))
+    if job_store.finish_file(audio_file_name, os.pathsep.join(output_files)) == JobStore.PARTIAL:
+        logging.warning(f"{audio_file_name}は文字起こしが途中で途切れたパートがあるため、次回の処理で再処理します。")
+    return True
+
+def process_audio_file(audio_file_path, job_store=None, force=True, workbook=None, control=None):
+    """音声ファイルを文字起こしし、抽出した議事録の情報を出力する関数（成功したらTrueを返す）
+
+    controlを渡すと、パートの分割・文字起こし・再試行・情報抽出の進捗をイベントで通知し、
+    キャンセルされた時点で未送信のリクエストをやめてFalseを返す。
+    """
+    audio_file_name = os.path.basename(audio_file_path)
+    job_store = job_store or get_job_store()
+    control = control or JobControl()
     try:
-        audio_file_name = os.path.basename(audio_file_path)
         file_size = os.path.getsize(audio_file_path)
-        logging.info(f"{audio_file_name}の処理を開始します。ファイルサイズ: {file_size / (1024 * 1024):.2f}MB")
+        with trace_span('job', job=audio_file_name, bytes=file_size) as job_span:
+            if not job_store.start_file(audio_file_name, os.path.abspath(audio_file_path), file_size, force=force):
+                logging.info(f"{audio_file_name}は処理済みまたは処理中のためスキップします。")
+                job_span.set(skipped=True)
+                return True
+            logging.info(f"{audio_file_name}の処理を開始します。ファイルサイズ: {file_size / (1024 * 1024):.2f}MB")
 
-        # 音声ファイルを分割する数を決定
-        num_parts = 10  # 10個のAPIキーを使用するため、分割数を10に設定
+            # 分割ファイルは専用の一時ディレクトリに置き、処理の成否にかかわらず削除する
+            with temporary_work_dir() as work_dir:
+                # 分割数は録音の長さ・送信量と、登録されているキーの枠数から決める
+                # （その時点で休ませているキーの数で変えると、再処理のたびに境界が変わりキャッシュが使えなくなる）
+                key_pool = get_api_key_pool()
+                segments = plan_audio_split(audio_file_path, slots=key_pool.capacity)
+                num_parts = len(segments)
+                duration = segments[-1].end
+                job_store.add_chunks(audio_file_name, segments)
+                job_span.set(parts=num_parts, duration=round(duration, 1))
+                control.emit('planned', name=audio_file_name, parts=num_parts, duration=duration)
 
-        transcribed_texts = [None] * num_parts  # インデックスに基づいて配置するリスト
+                transcribed_texts = [None] * num_parts  # インデックスに基づいて配置するリスト
 
-        audio_parts = split_audio_file(audio_file_path, num_parts)
+                # キャッシュは元の音声と区間で引く（パートを切り出し直してもバイト列が同じとは限らないため）
+                source_hash = None
+                if get_result_cache():
+                    with trace_span('hash_source'):
+                        source_hash = hash_file(audio_file_path)
+                encode_options = get_upload_encoding(audio_file_path)[1]
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future_to_index = {executor.submit(transcribe_audio_with_key, part, API_KEYS[i]): i for i, part in enumerate(audio_parts)}
-            failed_parts = []
-            for future in concurrent.futures.as_completed(future_to_index):
-                index = future_to_index[future]
-                part = audio_parts[index]
-                result = future.result()
-                if result:
-                    transcribed_texts[index] = result
-                    logging.info(f"{part}の処理が成功しました。")
-                else:
-                    logging.error(f"{part}の処理が失敗しました。")
-                    failed_parts.append((index, part))
-
-        # 失敗したパートのリトライ
-        if failed_parts:
-            logging.info("失敗したファイルのリトライを1分後に開始します。")
-            time.sleep(60)
-            for index, part in failed_parts:
-                result = transcribe_audio_with_key(part, API_KEYS[0])
-                if result:
-                    transcribed_texts[index] = result
-                    logging.info(f"{part}のリトライが成功しました。")
-                else:
-                    logging.error(f"{part}のリトライが失敗しました。")
+                # チャンクは共有の作業キューに積まれ、空いた健全なキーから順に処理される
+                token_estimates = [int((segment.end - segment.start) * AUDIO_TOKENS_PER_SECOND) for segment in segments]
 
-        # 分割されたファイルを削除
-        for part in audio_parts:
-            os.remove(part)
-        logging.info(f"{audio_file_name}の分割されたファイルを削除しました。")
+                # 長い録音では、文字起こしが届いたパートから順に議題候補の抽出（map）を並列に進める
+                mapreduce = len(segments) > 1 and use_mapreduce_extraction(duration)
+                topic_candidates = [None] * num_parts
+                map_futures = {}
+                map_futures_lock = threading.Lock()
 
-        # 文字起こし結果を結合（Noneを除外）
-        combined_text = "\n".join(filter(None, transcribed_texts))
-        logging.info(f"{audio_file_name}の文字起こしが完了しました。情報を抽出します。")
+                # 切り出したが送信が終わっていないパートの数を制限する（ffmpegが先行しすぎないようにする）
+                part_slots = threading.BoundedSemaphore(max(1, get_env_int('MINUTES_MAX_PARTS_IN_FLIGHT', key_pool.capacity * 2)))
 
-        # 30秒のバッファを持たせる
-        time.sleep(60)
+                # 応答が遅れたパートには、空いている別のキーで重複リクエストを送る（MINUTES_HEDGE=1の場合）
+                hedger = StragglerHedger.from_env(key_pool, num_parts)
 
-        extracted_info = extract_information(combined_text)
-        if extracted_info:
-            output_file = os.path.join(Path.home(), 'Documents', f"{os.path.splitext(audio_file_name)[0]}_抽出結果.xlsx")
-            create_excel(extracted_info, output_file)
-            processed_files[audio_file_name] = output_file
-        else:
-            logging.error(f"{audio_file_name}の情報抽出に失敗しました。")
+                def transcribe_chunk(index, part):
+                    def remove_part():
+                        # 送信が終わったパートはすぐに削除し、次のパートを切り出せるようにする
+                        try:
+                            os.remove(part)
+                        except OSError:
+                            pass
+                        part_slots.release()
 
-        return True
+                    try:
+                        control.check()
+                        job_store.update_chunk(audio_file_name, index, JobStore.RUNNING)
+                        with get_tracer().continue_span(job_span):
+                            text = transcribe_audio_part(
+                                part, key_pool, token_estimates[index], control=control, hedger=hedger,
+                                source_key=get_part_source_key(source_hash, segments[index], encode_options) if source_hash else None
+                            )
+                        job_store.update_chunk(audio_file_name, index, get_transcript_status(text))
+                        control.emit('transcribed', index=index, success=bool(text))
+                    finally:
+                        if hedger is not None:
+                            # 結果を捨てた重複リクエストがパートを読み終えてから削除する
+                            hedger.when_settled(part, remove_part)
+                        else:
+                            remove_part()
+
+                    if text:
+                        transcribed_texts[index] = text
+                        logging.info(f"{part}の処理が成功しました。")
+                        if mapreduce and not control.cancelled:
+                            with map_futures_lock:
+                                map_futures[executor.submit(extract_chunk_candidates, text, index)] = index
+                    else:
+                        logging.error(f"{part}の処理が失敗しました。")
+                    return text
+
+                def extract_chunk_candidates(text, index):
+                    with get_tracer().continue_span(job_span):
+                        return extract_topic_candidates(text, index + 1, num_parts, key_pool, control=control)
+
+                # 切り出せたパートから順に送信し、ffmpegの処理とAPIの待ち時間を重ねる
+                upload_bytes = 0
+                with concurrent.futures.ThreadPoolExecutor(max_workers=key_pool.capacity) as executor:
+                    transcribe_futures = {}
+                    for index, part in iter_audio_parts(audio_file_path, segments, work_dir, part_slots):
+                        upload_bytes += os.path.getsize(part)
+                        transcribe_futures[executor.submit(transcribe_chunk, index, part)] = index
+                        control.emit('split', index=index)
+                        if control.cancelled:
+                            break  # 残りのパートは切り出さない
+
+                    # 送信量を変換前（元の音声の同じ区間）と比較して記録する
+                    source_bytes = sum(file_size * (segment.end - segment.start) / duration for segment in segments) if duration else file_size
+                    logging.info(
+                        f"送信する音声の容量: 変換前{source_bytes / (1024 * 1024):.2f}MB → 変換後{upload_bytes / (1024 * 1024):.2f}MB"
+                        f"（{source_bytes / max(upload_bytes, 1):.1f}分の1）"
+                    )
+
+                    for future in concurrent.futures.as_completed(transcribe_futures):
+                        index = transcribe_futures[future]
+                        try:
+                            future.result()
+                        except JobCancelled:
+                            pass
+                        except Exception as e:
+                            # 記録やファイル削除の失敗などで結果が入らなかったパートも、原因を残して失敗として扱う
+                            logging.exception(f"パート{index + 1}の文字起こしの処理中にエラーが発生しました: {str(e)}")
+                    for future in concurrent.futures.as_completed(list(map_futures)):
+                        index = map_futures[future]
+                        try:
+                            topic_candidates[index] = future.result()
+                        except JobCancelled:
+                            pass
+                        except Exception as e:
+                            logging.error(f"パート{index + 1}の議題候補の抽出に失敗しました: {str(e)}")
+                key_pool.log_stats()
+                control.check()
+            logging.info(f"{audio_file_name}の分割されたファイルを削除しました。")
+
+            # 文字起こし結果を結合（Noneを除外し、重なり部分の重複を取り除く）
+            combined_text = stitch_job_transcripts(transcribed_texts, segments)
+            logging.info(f"{audio_file_name}の文字起こしが完了しました。情報を抽出します。")
+            control.emit('extracting')
+
+            if not extract_and_write_minutes(
+                audio_file_path, combined_text, transcribed_texts, topic_candidates if mapreduce else None,
+                key_pool, job_store, control, workbook
+            ):
+                job_span.status = 'error'
+
+            if hedger is not None:
+                # 結果を捨てた遅いリクエストもなるべく終わった後に集計できるよう、ジョブの最後に記録する
+                hedge_stats = hedger.summary()
+                job_span.set(**hedge_stats)
+                logging.info(
+                    f"重複リクエスト: {hedge_stats['hedges']}件（{hedge_stats['hedge_rate']:.0%}）、うち採用{hedge_stats['hedge_wins']}件。"
+                    f"パートの応答時間p99: {hedge_stats['chunk_p99']:.1f}秒（重複なしの場合 {hedge_stats['chunk_p99_unhedged']:.1f}秒以上）"
+                )
+                hedger.shutdown()
+            return True
+    except JobCancelled:
+        logging.info(f"{audio_file_name}の処理をキャンセルしました。")
+        job_store.fail_file(audio_file_name, "キャンセルされました。")
+        return False
     except Exception as e:
         logging.exception(f"{audio_file_path}の処理中にエラーが発生しました: {str(e)}")
+        job_store.fail_file(audio_file_name, e)
         return False
+    finally:
+        get_tracer().write_metrics()
+
+class LiveTranscriber:
+    """録音中の音声ファイルを追いかけ、確定した区間から順にバックグラウンドで文字起こしする（ライブモード）
+
+    poll_interval秒ごとにファイルの増加を確認し、末尾のguard_seconds秒を除いた部分でsegment_seconds秒の
+    区間が確定するたびに、境界付近の無音位置で切り出して送信する（無音がなければ前後を少し重ねる）。
+    先頭から揃った文字起こしは、途中経過として「（録音名）_文字起こし.txt」に書き出す。
+    録音が終わると（stopの呼び出し、is_recordingが偽になる、またはidle_seconds秒間ファイルが増えない）、
+    最後の区間の文字起こしと情報抽出だけを行って議事録を出力する。
+    """
+
+    def __init__(self, recording_path, segment_seconds=300.0, guard_seconds=3.0, poll_interval=2.0, idle_seconds=30.0,
+                 is_recording=None, stop_recording=None, job_store=None, control=None):
+        self.recording_path = recording_path
+        self.segment_seconds = segment_seconds
+        self.guard_seconds = guard_seconds
+        self.poll_interval = poll_interval
+        self.idle_seconds = idle_seconds
+        self.is_recording = is_recording
+        self.stop_recording = stop_recording
+        self.job_store = job_store or get_job_store()
+        self.control = control or JobControl()
+        self.segments = []
+        self.texts = []
+        self.topic_candidates = []
+        self.finalize_seconds = None
+        self._finished = set()
+        self._job_span = None  # runの間だけ設定する（区間の処理をジョブの区間に記録する）
+        self._key_pool = None
+        self._cut_start = 0.0
+        self._bit_rate = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._futures = {}
+        self._map_futures = {}
+        self._mapreduce = False
+
+    @classmethod
+    def from_env(cls, recording_path, **kwargs):
+        """区間の長さなどを環境変数（MINUTES_LIVE_*）から読み込んで作成する"""
+        kwargs.setdefault('segment_seconds', get_env_float('MINUTES_LIVE_SEGMENT_MINUTES', 5.0) * 60)
+        kwargs.setdefault('guard_seconds', get_env_float('MINUTES_LIVE_GUARD_SECONDS', 3.0))
+        kwargs.setdefault('poll_interval', get_env_float('MINUTES_LIVE_POLL_SECONDS', 2.0))
+        kwargs.setdefault('idle_seconds', get_env_float('MINUTES_LIVE_IDLE_SECONDS', 30.0))
+        return cls(recording_path, **kwargs)
+
+    @property
+    def transcript_path(self):
+        stem = os.path.splitext(os.path.basename(self.recording_path))[0]
+        return os.path.join(get_output_dir(), f"{stem}_文字起こし.txt")
+
+    @property
+    def finished_count(self):
+        """文字起こしを終えた区間の数（失敗した区間も含む。別のスレッドから読んでよい）"""
+        with self._lock:
+            return len(self._finished)
+
+    def stop(self):
+        """録音の終了を知らせる（別のスレッドから呼んでよい）"""
+        self._stopped.set()
+
+    def recorded_seconds(self):
+        """これまでに書き込まれた音声の長さ（秒）をファイルサイズとビットレートから見積もる（不明なら0）"""
+        try:
+            size = os.path.getsize(self.recording_path)
+        except OSError:
+            return 0.0
+        if self._bit_rate is None and size >= 16 * 1024:
+            self._bit_rate = get_audio_bit_rate(self.recording_path)
+        return size * 8 / self._bit_rate if self._bit_rate else 0.0
+
+    def _next_segment(self, available):
+        """available秒まで確定している録音から、次の区間と、その次の区間の開始位置を決める（まだ確定していなければNone）
+
+        区間はまだ記録しない（切り出しに成功してから_submitで記録する）。
+        """
+        target = self._cut_start + self.segment_seconds
+        tolerance = self.segment_seconds * min(get_env_float('MINUTES_SPLIT_TOLERANCE_RATIO', 0.15), 0.45)
+        if available < target + tolerance:
+            return None
+        silences = []
+        if get_env_bool('MINUTES_SILENCE_AWARE', True):
+            with trace_span('detect_silences', windows=1) as span:
+                silences = detect_silences(
+                    self.recording_path,
+                    [(target - tolerance, target + tolerance)],
+                    noise_db=get_env_float('MINUTES_SILENCE_NOISE_DB', -35.0),
+                    min_duration=get_env_float('MINUTES_SILENCE_MIN_DURATION', 0.4)
+                )
+                span.set(silences=len(silences))
+        cut = nearest_silence_cut(target, silences, tolerance, self._cut_start)
+        overlaps_previous = bool(self.segments) and self.segments[-1].end > self._cut_start
+        if cut is not None:
+            return AudioSegment(self._cut_start, cut, overlaps_previous), cut
+        # 無音が見つからない境界は前後を少し重ね、結合時に重複を取り除く
+        half_overlap = self.segment_seconds * get_env_float('MINUTES_SPLIT_OVERLAP_RATIO', 0.1) / 2
+        return AudioSegment(self._cut_start, target + half_overlap, overlaps_previous), target - half_overlap
+
+    def _submit(self, segment, next_cut_start, work_dir, executor):
+        """区間を切り出して文字起こしを依頼する
+
+        区間と次の開始位置は切り出しに成功してから記録する（FFmpegの失敗や中断で、その区間が抜け落ちないようにする）。
+        """
+        index = len(self.segments)
+        _, part = next(iter_audio_parts(self.recording_path, [segment], work_dir, start_index=index))
+        with self._lock:
+            self.segments.append(segment)
+            self.texts.append(None)
+            self.topic_candidates.append(None)
+        self._cut_start = next_cut_start
+        logging.info(f"録音の{segment.start / 60:.1f}〜{segment.end / 60:.1f}分を切り出しました（パート{index + 1}）。")
+        self._futures[executor.submit(self._transcribe, index, part, executor)] = index
+        self.control.emit('split', index=index)
+
+    def _transcribe(self, index, part, executor):
+        segment = self.segments[index]
+        try:
+            self.control.check()
+            with get_tracer().continue_span(self._job_span):
+                text = transcribe_audio_part(part, self._key_pool, int((segment.end - segment.start) * AUDIO_TOKENS_PER_SECOND), control=self.control)
+        finally:
+            try:
+                os.remove(part)
+            except OSError:
+                pass
+        self.control.emit('transcribed', index=index, success=bool(text))
+        if not text:
+            logging.error(f"{part}の処理が失敗しました。")
+        with self._lock:
+            self.texts[index] = text
+            self._finished.add(index)
+        self._extract_candidates(executor)
+        self._write_transcript()
+        return text
+
+    def _extract_candidates(self, executor):
+        """map-reduce方式のときは、文字起こしが届いた区間から議題候補の抽出（map）を始める"""
+        if not self._mapreduce or self.control.cancelled:
+            return
+        with self._lock:
+            indexes = [i for i in self._finished if self.texts[i] and i not in self._map_futures.values()]
+            for index in indexes:
+                self._map_futures[executor.submit(self._extract_chunk_candidates, index)] = index
+
+    def _extract_chunk_candidates(self, index):
+        with get_tracer().continue_span(self._job_span):
+            # 録音中は全体のパート数がわからないため、分母にはその時点の区間数を使う
+            return extract_topic_candidates(self.texts[index], index + 1, len(self.segments), self._key_pool, control=self.control)
+
+    def _write_transcript(self, final=False):
+        """先頭から揃った区間の文字起こしを結合して書き出す（最後は全区間）"""
+        with self._write_lock:
+            with self._lock:
+                count = len(self.segments)
+                if not final:
+                    count = 0
+                    while count in self._finished:
+                        count += 1
+                texts = list(self.texts[:count])
+                segments = list(self.segments[:count])
+            if not count:
+                return ''
+            combined_text, _ = stitch_transcripts(
+                texts, [segment.overlaps_previous for segment in segments], estimate_overlap_chars(texts, segments)
+            )
+            os.makedirs(get_output_dir(), exist_ok=True)
+            temp_path = self.transcript_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                file.write(combined_text)
+            os.replace(temp_path, self.transcript_path)  # 読み手が書きかけのファイルを見ないようにする
+            return combined_text
+
+    def _follow(self, work_dir, executor):
+        """録音が終わるまでファイルを追いかけ、確定した区間を送信する"""
+        last_size = None
+        last_growth = time.monotonic()
+        while not self._stopped.is_set():
+            self.control.check()
+            try:
+                size = os.path.getsize(self.recording_path)
+            except OSError:
+                size = 0
+            if size != last_size:
+                last_size = size
+                last_growth = time.monotonic()
+
+            available = self.recorded_seconds() - self.guard_seconds
+            self._mapreduce = use_mapreduce_extraction(available)
+            planned = self._next_segment(available)
+            while planned is not None:
+                try:
+                    self._submit(*planned, work_dir, executor)
+                except RuntimeError as e:
+                    # 切り出せなかった区間は記録していないため、次の確認で同じ位置から切り出し直す
+                    logging.error(f"録音の切り出しに失敗しました。次の確認で再試行します: {str(e)}")
+                    break
+                planned = self._next_segment(available)
+            self._extract_candidates(executor)
+
+            if self.is_recording is not None:
+                if not self.is_recording():
+                    logging.info("録音が終了しました。")
+                    return
+            elif size and time.monotonic() - last_growth >= self.idle_seconds:
+                logging.info(f"{self.idle_seconds:.0f}秒間録音ファイルが増えなかったため、録音が終了したとみなします。")
+                return
+            self._stopped.wait(self.poll_interval)
+        logging.info("録音の終了が指示されました。")
+
+    def run(self):
+        """録音を追いかけて文字起こしし、録音の終了後に議事録を出力する（成功したらTrueを返す）"""
+        audio_file_name = os.path.basename(self.recording_path)
+        control = self.control
+        try:
+            with trace_span('job', job=audio_file_name, live=True) as job_span:
+                self._job_span = job_span
+                self._key_pool = get_api_key_pool()
+                self.job_store.start_file(audio_file_name, os.path.abspath(self.recording_path), None, force=True)
+                logging.info(f"{audio_file_name}の録音を追いかけて文字起こしします（{self.segment_seconds / 60:.1f}分ごと）。")
+
+                with temporary_work_dir() as work_dir, \
+                        concurrent.futures.ThreadPoolExecutor(max_workers=self._key_pool.capacity) as executor:
+                    try:
+                        self._follow(work_dir, executor)
+                    except KeyboardInterrupt:
+                        logging.info("録音の終了が指示されました。")
+                    if self.stop_recording is not None:
+                        self.stop_recording()
+                    stopped_at = time.perf_counter()
+
+                    # 録音が終わった後に残っているのは、最後の区間と情報抽出だけ
+                    # （ヘッダーの長さは録音前の値のことがあるため、ビットレートがわかればサイズから求める）
+                    duration = self.recorded_seconds() or get_audio_duration(self.recording_path)
+                    if duration - self._cut_start >= 1.0 or not self.segments:
+                        overlaps_previous = bool(self.segments) and self.segments[-1].end > self._cut_start
+                        self._submit(AudioSegment(self._cut_start, duration, overlaps_previous), duration, work_dir, executor)
+                    self._mapreduce = len(self.segments) > 1 and use_mapreduce_extraction(duration)
+                    job_span.set(parts=len(self.segments), recorded_seconds=round(duration, 1))
+                    control.emit('planned', name=audio_file_name, parts=len(self.segments), duration=duration)
+
+                    for future in concurrent.futures.as_completed(self._futures):
+                        index = self._futures[future]
+                        try:
+                            future.result()
+                        except JobCancelled:
+                            pass
+                        except Exception as e:
+                            # 結果が入らなかった区間も、原因を残して失敗として扱う
+                            logging.exception(f"パート{index + 1}の文字起こしの処理中にエラーが発生しました: {str(e)}")
+                    self._extract_candidates(executor)
+                    for future in concurrent.futures.as_completed(list(self._map_futures)):
+                        index = self._map_futures[future]
+                        try:
+                            self.topic_candidates[index] = future.result()
+                        except JobCancelled:
+                            pass
+                        except Exception as e:
+                            logging.error(f"パート{index + 1}の議題候補の抽出に失敗しました: {str(e)}")
+                self._key_pool.log_stats()
+                control.check()
+
+                # 区間は録音が終わるまで決まらないため、チャンクの状態は最後にまとめて記録する
+                self.job_store.add_chunks(audio_file_name, self.segments)
+                for index, text in enumerate(self.texts):
+                    self.job_store.update_chunk(audio_file_name, index, get_transcript_status(text))
+
+                combined_text = stitch_job_transcripts(self.texts, self.segments)
+                self._write_transcript(final=True)
+                logging.info(f"{audio_file_name}の文字起こしが完了しました。情報を抽出します。")
+                control.emit('extracting')
+                success = extract_and_write_minutes(
+                    self.recording_path, combined_text, self.texts, self.topic_candidates if self._mapreduce else None,
+                    self._key_pool, self.job_store, control
+                )
+                if not success:
+                    job_span.status = 'error'
+                self.finalize_seconds = time.perf_counter() - stopped_at
+                job_span.set(finalize_seconds=round(self.finalize_seconds, 3))
+                logging.info(f"録音の終了から{self.finalize_seconds:.1f}秒で処理が完了しました。")
+                return success
+        except JobCancelled:
+            logging.info(f"{audio_file_name}の処理をキャンセルしました。")
+            self.job_store.fail_file(audio_file_name, "キャンセルされました。")
+            return False
+        except Exception as e:
+            logging.exception(f"{self.recording_path}の処理中にエラーが発生しました: {str(e)}")
+            self.job_store.fail_file(audio_file_name, e)
+            return False
+        finally:
+            get_tracer().write_metrics()
+
+def start_audio_capture(capture, recording_path):
+    """FFmpegで録音を開始し、録音中のプロセスを返す関数
+
+    captureは「入力形式:デバイス」（例: pulse:default、dshow:audio=マイク、avfoundation::0）。
+    ライブモードで追いかけられるよう、長さのヘッダーを書かないMP3として少しずつ書き出す。
+    """
+    input_format, _, device = capture.partition(':')
+    if not input_format or not device:
+        raise ValueError(f"録音の入力は「入力形式:デバイス」の形で指定してください: {capture}")
+    command = [
+        str(get_ffmpeg_path()),
+        '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', input_format, '-i', device,
+        '-ac', '1', '-ar', '16000',
+        '-c:a', 'libmp3lame', '-b:a', '32k',
+        '-write_xing', '0',
+        '-flush_packets', '1',
+        recording_path
+    ]
+    logging.info(f"録音を開始しました: {recording_path}（Ctrl+Cで録音を終了します）")
+    return subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+
+def stop_audio_capture(process, timeout=10.0):
+    """FFmpegの録音を終了させる関数（qを送ってファイルを閉じさせ、応答がなければ強制終了する）"""
+    if process.poll() is not None:
+        return
+    try:
+        process.stdin.write(b'q')
+        process.stdin.flush()
+    except OSError:
+        pass
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def run_live(recording_path, capture=None, segment_minutes=None, idle_seconds=None, interval=None):
+    """録音中のファイル（またはFFmpegで録音した音声）を追いかけて議事録を作成する関数（GUIを使わない）"""
+    kwargs = {}
+    if segment_minutes:
+        kwargs['segment_seconds'] = segment_minutes * 60
+    if idle_seconds:
+        kwargs['idle_seconds'] = idle_seconds
+    if interval:
+        kwargs['poll_interval'] = interval
+    process = None
+    if capture:
+        process = start_audio_capture(capture, recording_path)
+        kwargs['is_recording'] = lambda: process.poll() is None
+        kwargs['stop_recording'] = lambda: stop_audio_capture(process)
+    try:
+        return LiveTranscriber.from_env(recording_path, **kwargs).run()
+    finally:
+        if process is not None:
+            stop_audio_capture(process)
 
 def extract_info_from_xlsx(file_path):
-    wb = openpyxl.load_workbook(file_path)
-    sheet = wb.active
+    # 読み取り専用モードでB列の1〜25行目だけを読む
+    load_openpyxl()
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        values = [row[0] for row in wb.active.iter_rows(min_row=1, max_row=25, min_col=2, max_col=2, values_only=True)]
+    finally:
+        wb.close()
+    values += [None] * (25 - len(values))
     data = {
-        '会議名': sheet['B1'].value or '',
-        '日時': convert_excel_date(sheet['B2'].value),
-        '場所': sheet['B3'].value or '',
-        '参加者': sheet['B4'].value or '',
-        '欠席者': sheet['B5'].value or '',
+        '会議名': values[0] or '',
+        '日時': convert_excel_date(values[1]),
+        '場所': values[2] or '',
+        '参加者': values[3] or '',
+        '欠席者': values[4] or '',
     }
     for i in range(1, 11):  # 議題①から⑩まで
-        data[f'議題{chr(0x2460 + i - 1)}'] = sheet[f'B{5+i*2-1}'].value or ''
-        data[f'議題{chr(0x2460 + i - 1)}の要約'] = sheet[f'B{5+i*2}'].value or ''
-    
-    print("抽出されたデータ:")
-    for key, value in data.items():
-        print(f"{key}: {value}")
-    
+        data[f'議題{chr(0x2460 + i - 1)}'] = values[5 + i * 2 - 2] or ''
+        data[f'議題{chr(0x2460 + i - 1)}の要約'] = values[5 + i * 2 - 1] or ''
+
+    logging.debug(f"{file_path}から抽出されたデータ: {data}")
     return data
 
 def convert_excel_date(value):
     if isinstance(value, (int, float)):
+        load_openpyxl()
         return from_excel(value).strftime('%Y-%m-%d')
     return value
 
-def create_minutes_from_template(data, template_path):
-    # 修正後
-    template_path = os.path.join(get_current_dir(), 'テンプレート.docx')
+# テンプレート中の「…」の置換対象（XMLのタグや属性をまたがないもの）
+TEMPLATE_PLACEHOLDER_PATTERN = re.compile(r'「([^「」<>"]+)」')
+# 置換対象を探すパーツ（本文・ヘッダー・フッター）
+TEMPLATE_TEXT_PART_PATTERN = re.compile(r'^word/(document|header\d*|footer\d*)\.xml$')
+# XMLに書き込めない制御文字
+XML_INVALID_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
 
-    doc = Document(template_path)
-    
-    for paragraph in doc.paragraphs:
-        # 会議名、日時、場所、参加者、欠席者の置き換え
-        for key, value in data.items():
-            placeholder = f'「{key}」'
-            if placeholder in paragraph.text:
-                old_text = paragraph.text
-                new_text = paragraph.text.replace(placeholder, str(value) if value is not None else '')
-                paragraph.text = new_text
-                print(f"置換: '{old_text}' -> '{new_text}'")
-
-        # 議題と要約の置き換え
-        for i in range(1, 11):
-            topic_key = f'議題{chr(0x2460 + i - 1)}'
-            topic_content = data.get(topic_key, '')
-            summary_key = f'議題{chr(0x2460 + i - 1)}の要約'
-            summary_content = data.get(summary_key, '')
-
-            # 議題の名称を置き換え
-            topic_placeholder = f'「{topic_key}」'
-            if topic_placeholder in paragraph.text:
-                old_text = paragraph.text
-                new_text = paragraph.text.replace(topic_placeholder, topic_content)
-                paragraph.text = new_text
-                print(f"議題名置換: '{old_text}' -> '{new_text}'")
-
-            # 要約の置き換え
-            summary_placeholder = f'「{summary_key}」'
-            if summary_placeholder in paragraph.text:
-                old_text = paragraph.text
-                new_text = paragraph.text.replace(summary_placeholder, summary_content)
-                paragraph.text = new_text
-                print(f"要約置換: '{old_text}' -> '{new_text}'")
-
-    return doc
+def xml_escape(text):
+    """XMLの本文に書けるように&・<・>をエスケープする関数（xml.sax.saxutilsは読み込みが重いため使わない）"""
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def xml_unescape(text):
+    return text.replace('&lt;', '<').replace('&gt;', '>').replace('&amp;', '&')
+
+def get_default_template_path():
+    return os.path.join(get_current_dir(), 'テンプレート.docx')
+
+def format_template_value(value):
+    """置換する値をw:tの中に書ける形にする関数（改行・タブは改行要素・タブ要素に変換する）"""
+    text = XML_INVALID_CHARS.sub('', str(value) if value is not None else '')
+    text = xml_escape(text)
+    if '\n' in text or '\t' in text:
+        text = text.replace('\r\n', '\n').replace('\n', '</w:t><w:br/><w:t xml:space="preserve">')
+        text = text.replace('\t', '</w:t><w:tab/><w:t xml:space="preserve">')
+    return text
+
+class CompiledTemplate:
+    """議事録テンプレート（docx）を一度だけ解析し、置換箇所を索引化したもの
+
+    複数のランに分かれた「…」は最初のランにまとめ（そのランの書式を引き継ぐ）、表・ヘッダー・
+    フッターを含む各パーツのXMLを「固定部分」と「置換キー」の列に分解して保持する。
+    renderはこの列を先頭から順に連結するだけで済む。
+    """
+
+    def __init__(self, template_path):
+        self.template_path = template_path
+        self.placeholder_count = 0
+        self._entries = []
+
+        load_docx()
+        document = Document(template_path)
+        for part in document.part.package.iter_parts():
+            if TEMPLATE_TEXT_PART_PATTERN.match(part.partname.lstrip('/')) and hasattr(part, 'element'):
+                for paragraph in part.element.iter(qn('w:p')):
+                    self._merge_split_placeholders(paragraph)
+
+        normalized = io.BytesIO()
+        document.save(normalized)
+        with zipfile.ZipFile(normalized) as archive:
+            for info in archive.infolist():
+                content = archive.read(info.filename)
+                pieces = None
+                if TEMPLATE_TEXT_PART_PATTERN.match(info.filename):
+                    # 偶数番目が固定部分、奇数番目が置換キーになる
+                    pieces = TEMPLATE_PLACEHOLDER_PATTERN.split(content.decode('utf-8'))
+                    if len(pieces) == 1:
+                        pieces = None
+                    else:
+                        pieces[1::2] = [xml_unescape(key) for key in pieces[1::2]]
+                        self.placeholder_count += len(pieces) // 2
+                self._entries.append((info.filename, info.date_time, content, pieces))
+
+    @staticmethod
+    def _merge_split_placeholders(paragraph):
+        """段落内で複数のw:tに分かれた「…」を、開始位置のw:tにまとめる"""
+        texts = [t for t in paragraph.iter(qn('w:t')) if next(t.iterancestors(qn('w:p'))) is paragraph]
+        if not texts:
+            return
+        offsets = []
+        position = 0
+        for t in texts:
+            offsets.append(position)
+            position += len(t.text or '')
+        joined = ''.join(t.text or '' for t in texts)
+
+        def locate(index):
+            for i in range(len(texts) - 1, -1, -1):
+                if offsets[i] <= index:
+                    return i
+            return 0
+
+        # 後ろの置換箇所から処理すれば、前の箇所のオフセットは変わらない
+        for match in reversed(list(TEMPLATE_PLACEHOLDER_PATTERN.finditer(joined))):
+            first, last = locate(match.start()), locate(match.end() - 1)
+            if first == last:
+                continue
+            start_text = texts[first].text or ''
+            texts[first].text = start_text[:match.start() - offsets[first]] + match.group(0)
+            for t in texts[first + 1:last]:
+                t.text = ''
+            texts[last].text = (texts[last].text or '')[match.end() - offsets[last]:]
+            for t in texts[first:last + 1]:
+                t.set(qn('xml:space'), 'preserve')
+
+    def render(self, data):
+        """置換後のdocxをバイト列で返す（dataにないキーは「…」のまま残す）"""
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for filename, date_time, content, pieces in self._entries:
+                if pieces is not None:
+                    filled = []
+                    for i, piece in enumerate(pieces):
+                        if i % 2 == 0:
+                            filled.append(piece)
+                        elif piece in data:
+                            filled.append(format_template_value(data[piece]))
+                        else:
+                            filled.append(f'「{xml_escape(piece)}」')
+                    content = ''.join(filled).encode('utf-8')
+                archive.writestr(zipfile.ZipInfo(filename, date_time), content, zipfile.ZIP_DEFLATED)
+        return buffer.getvalue()
+
+    def save(self, data, output_path):
+        with open(output_path, 'wb') as f:
+            f.write(self.render(data))
+
+_compiled_templates = {}
+_compiled_templates_lock = threading.Lock()
+
+def get_compiled_template(template_path=None):
+    """解析済みのテンプレートを返す関数（ファイルが更新されるまで再解析しない）"""
+    template_path = os.path.abspath(template_path or get_default_template_path())
+    stat = os.stat(template_path)
+    cache_key = (template_path, stat.st_mtime_ns, stat.st_size)
+    with _compiled_templates_lock:
+        compiled = _compiled_templates.get(template_path)
+        if compiled is None or compiled[0] != cache_key:
+            compiled = (cache_key, CompiledTemplate(template_path))
+            _compiled_templates[template_path] = compiled
+            logging.info(f"テンプレートを読み込みました: {template_path}（置換箇所{compiled[1].placeholder_count}件）")
+        return compiled[1]
+
+def create_minutes_from_template(data, template_path=None):
+    """テンプレートを置換したDocumentを返す関数（保存するだけならget_compiled_template(...).saveの方が速い）"""
+    load_docx()
+    return Document(io.BytesIO(get_compiled_template(template_path).render(data)))
 
 def create_minutes(xlsx_path, template_path, output_path):
     try:
         data = extract_info_from_xlsx(xlsx_path)
-        doc = create_minutes_from_template(data, template_path)
-        doc.save(output_path)
-        print(f"議事録が作成されました: {output_path}")
+        get_compiled_template(template_path).save(data, output_path)
+        logging.info(f"議事録が作成されました: {output_path}")
         return True
     except Exception as e:
         logging.error(f"議事録の作成中にエラーが発生しました: {str(e)}")
-        print(f"エラーが発生しました: {str(e)}")
         return False
+
+def init_minutes_worker(template_path):
+    """一括作成のワーカープロセスの初期化（テンプレートをワーカーごとに1回だけ解析する）"""
+    get_compiled_template(template_path)
+
+def create_minutes_task(xlsx_path, template_path, output_dir):
+    """1つのExcelファイルから議事録を作成し、(Excelのパス, 出力先, エラー)を返す関数（ワーカープロセスで実行される）"""
+    output_path = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(xlsx_path))[0]}_議事録.docx")
+    try:
+        data = extract_info_from_xlsx(xlsx_path)
+        get_compiled_template(template_path).save(data, output_path)
+        return xlsx_path, output_path, None
+    except Exception as e:
+        return xlsx_path, output_path, f"{type(e).__name__}: {e}"
+
+def run_bulk_minutes(inputs, output_dir=None, jobs=None, template_path=None, report_path=None):
+    """複数のExcelファイルから議事録をまとめて作成する関数
+
+    CPUのコア数（またはjobs）分のプロセスに振り分け、各プロセスはテンプレートを1回だけ読み込む。
+    ファイルごとの結果はCSVの集計レポートに書き出す。
+    """
+    xlsx_files = collect_files(inputs, ('.xlsx',))
+    if not xlsx_files:
+        logging.warning("処理するExcelファイルが見つかりませんでした。")
+        return True
+
+    output_dir = output_dir or get_output_dir()
+    os.makedirs(output_dir, exist_ok=True)
+    template_path = os.path.abspath(template_path or get_default_template_path())
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(xlsx_files)))
+    logging.info(f"{len(xlsx_files)}件のExcelファイルから議事録を作成します（{jobs}プロセス）。")
+
+    start = time.perf_counter()
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=init_minutes_worker, initargs=(template_path,)) as executor:
+        futures = [executor.submit(create_minutes_task, path, template_path, output_dir) for path in xlsx_files]
+        for future in concurrent.futures.as_completed(futures):
+            xlsx_path, output_path, error = future.result()
+            if error:
+                logging.error(f"{os.path.basename(xlsx_path)}の議事録作成に失敗しました: {error}")
+            results.append((xlsx_path, output_path, error))
+    elapsed = time.perf_counter() - start
+
+    results.sort()
+    report_path = report_path or os.path.join(output_dir, f"議事録作成結果_{datetime.datetime.now():%Y%m%d_%H%M%S}.csv")
+    with open(report_path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Excelファイル', '結果', '議事録', 'エラー'])
+        for xlsx_path, output_path, error in results:
+            writer.writerow([xlsx_path, '失敗' if error else '成功', '' if error else output_path, error or ''])
+
+    failed = sum(1 for _, _, error in results if error)
+    logging.info(
+        f"議事録の一括作成が終了しました: 成功{len(results) - failed}件、失敗{failed}件"
+        f"（{elapsed:.1f}秒、{len(results) / max(elapsed, 1e-9):.1f}件/秒）。結果: {report_path}"
+    )
+    return failed == 0
     
+class EventBus:
+    """作業スレッドからGUIスレッドへイベントを渡すキュー
+
+    tkinterのウィジェットはGUIスレッドからしか操作できないため、作業スレッドはpostでイベントを積むだけにする。
+    GUIスレッドはroot.afterで定期的にdrainを呼び、積まれたイベントを順に処理する。
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def post(self, event, **data):
+        self._queue.put((event, data))
+
+    def drain(self, handler, limit=200):
+        """積まれたイベントを最大limit件取り出し、順にhandler(イベント名, 属性の辞書)に渡す"""
+        for _ in range(limit):
+            try:
+                event, data = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            handler(event, data)
+
+# 作業スレッドから届いたイベントを確認する間隔（ミリ秒）
+GUI_POLL_INTERVAL_MS = 100
+
 # グローバル変数
 selected_file = None
 file_label = None
 excel_file_label = None
 uploading_label = None
 elapsed_time_label = None
+cancel_button = None
 root = None
+gui_events = EventBus()
+audio_job = None  # 処理中の音声ファイルのJobControl（処理中でなければNone）
+audio_progress = {}  # 処理中の音声ファイルの進捗（GUIスレッドだけが更新する）
 
 def show_main_menu():
-    global root, file_label, excel_file_label, uploading_label, elapsed_time_label, selected_file
+    global root, file_label, excel_file_label, uploading_label, elapsed_time_label, cancel_button, selected_file
     selected_file = None
     for widget in root.winfo_children():
         widget.destroy()
@@ -526,14 +3872,22 @@ def show_main_menu():
     main_frame.pack(expand=True, fill="both", padx=50)
 
     # 音声ファイル処理フレーム
-    audio_frame = create_process_frame(main_frame, "音声ファイル処理", upload_audio_file, complete_audio_upload)
+    audio_frame, file_label, uploading_label, cancel_button = create_process_frame(
+        main_frame, "音声ファイル処理", upload_audio_file, complete_audio_upload, cancel_audio_processing)
     audio_frame.pack(side="left", padx=(0, 25))
+    if audio_job is not None and not audio_job.cancelled:
+        cancel_button.config(state="normal")
 
     # Excelファイル処理フレーム
-    excel_frame = create_process_frame(main_frame, "Excelファイル処理", upload_xlsx_file, complete_xlsx_upload)
+    excel_frame, excel_file_label, elapsed_time_label, _ = create_process_frame(
+        main_frame, "Excelファイル処理", upload_xlsx_file, complete_xlsx_upload)
     excel_frame.pack(side="right", padx=(25, 0))
 
-def create_process_frame(parent, title, upload_func, process_func):
+def create_process_frame(parent, title, upload_func, process_func, cancel_func=None):
+    """処理フレームを作成し、(フレーム, ファイル名のラベル, 状態のラベル, キャンセルボタン)を返す関数
+
+    cancel_funcを渡した場合だけキャンセルボタンを作成する（初期状態は無効）。
+    """
     frame = tk.Frame(parent, bg="white", bd=0, relief="ridge", width=400, height=450)
     frame.pack_propagate(False)
 
@@ -549,10 +3903,15 @@ def create_process_frame(parent, title, upload_func, process_func):
     process_button = ttk.Button(frame, text="ファイルを処理", command=process_func, style="TButton")
     process_button.pack(pady=(20, 0))
 
-    status_label = tk.Label(frame, text="", bg="white", fg="#666666", font=("Noto Sans CJK JP", 12))
-    status_label.pack(pady=25)
+    cancel_button = None
+    if cancel_func is not None:
+        cancel_button = ttk.Button(frame, text="キャンセル", command=cancel_func, style="TButton", state="disabled")
+        cancel_button.pack(pady=(10, 0))
+
+    status_label = tk.Label(frame, text="", wraplength=350, justify="center", bg="white", fg="#666666", font=("Noto Sans CJK JP", 12))
+    status_label.pack(pady=25 if cancel_func is None else 15)
 
-    return frame
+    return frame, file_label, status_label, cancel_button
 
 def configure_styles():
     style = ttk.Style()
@@ -566,6 +3925,13 @@ def configure_styles():
     style.map("TButton",
               background=[('active', '#45a049')])
 
+def format_elapsed_time(seconds):
+    """経過秒数を「1分5秒」「5秒」の形式にする関数"""
+    minutes, seconds = divmod(int(seconds), 60)
+    if minutes > 0:
+        return f"{minutes}分{seconds}秒"
+    return f"{seconds}秒"
+
 def upload_audio_file():
     global selected_file
     selected_file = filedialog.askopenfilename(filetypes=[("Audio Files", "*.wav *.mp3")])
@@ -573,15 +3939,28 @@ def upload_audio_file():
         file_label.config(text=f"選択したファイル\n{os.path.basename(selected_file)}")
 
 def complete_audio_upload():
-    if selected_file:
-        start_time = time.time()  # 処理開始時刻を記録
+    global audio_job
+    if audio_job is not None:
+        messagebox.showwarning("警告", "音声ファイルを処理中です。")
+    elif selected_file:
+        audio_job = JobControl(gui_events.post)
+        audio_progress.clear()
+        audio_progress.update(start_time=time.time(), parts=0, split=0, transcribed=0, failed=0, retries=0, extracting=False)
         uploading_label.config(text="音声ファイル処理中...")
-        root.update_idletasks()
-        processed_files = load_processed_files()
-        threading.Thread(target=process_audio_file_async, args=(selected_file, processed_files, start_time)).start()
+        cancel_button.config(state="normal")
+        threading.Thread(target=process_audio_file_async, args=(selected_file, audio_job)).start()
+        update_elapsed_time(audio_job)
     else:
         messagebox.showwarning("警告", "ファイルが選択されていません。")
 
+def cancel_audio_processing():
+    """処理中の音声ファイルをキャンセルする（未送信のリクエストと再試行を止める）"""
+    if audio_job is not None and not audio_job.cancelled:
+        logging.info("音声ファイルの処理のキャンセルが要求されました。")
+        audio_job.cancel()
+        cancel_button.config(state="disabled")
+        refresh_audio_status()
+
 def upload_xlsx_file():
     global selected_file
     selected_file = filedialog.askopenfilename(filetypes=[("Excel Files", "*.xlsx")])
@@ -596,47 +3975,117 @@ def complete_xlsx_upload():
     else:
         messagebox.showwarning("警告", "ファイルが選択されていません。")
 
-def process_audio_file_async(audio_file, processed_files, start_time):
-    def update_elapsed_time():
-        while not processing_done:
-            elapsed_time = int(time.time() - start_time)
-            minutes, seconds = divmod(elapsed_time, 60)
-            if minutes > 0:
-                uploading_label.config(text=f"経過時間: {minutes}分{seconds}秒")
-            else:
-                uploading_label.config(text=f"経過時間: {seconds}秒")
-            time.sleep(1)
+def process_audio_file_async(audio_file, control):
+    """作業スレッドで音声ファイルを処理する（結果はaudio_doneイベントでGUIスレッドに伝える）"""
+    success = False
+    try:
+        success = process_audio_file(audio_file, control=control)
+    finally:
+        gui_events.post('audio_done', control=control, success=success)
 
-    processing_done = False
-    threading.Thread(target=update_elapsed_time).start()
+def process_xlsx_file_async(xlsx_file):
+    """作業スレッドでExcelファイルから議事録を作成する（結果はxlsx_doneイベントでGUIスレッドに伝える）"""
+    template_path = os.path.join(get_current_dir(), 'テンプレート.docx')  # dist直下から取得
+    output_path = os.path.join(get_output_dir(), f"{os.path.splitext(os.path.basename(xlsx_file))[0]}_議事録.docx")
 
-    success = process_audio_file(audio_file, processed_files)
-    processing_done = True
-    total_elapsed_time = int(time.time() - start_time)
-    minutes, seconds = divmod(total_elapsed_time, 60)
-    if minutes > 0:
-        uploading_label.config(text=f"処理にかかった時間: {minutes}分{seconds}秒で処理が完了しました")
-    else:
-        uploading_label.config(text=f"処理にかかった時間: {seconds}秒で処理が完了しました")
+    success = False
+    try:
+        success = create_minutes(xlsx_file, template_path, output_path)
+    finally:
+        gui_events.post('xlsx_done', success=success)
 
-    if success:
-        root.after(0, lambda: (messagebox.showinfo("完了", "ファイルのアップロードが完了しました。"), show_main_menu()))
-    else:
-        messagebox.showerror("エラー", "ファイルの処理中にエラーが発生しました。")
+def refresh_audio_status():
+    """処理中の音声ファイルの経過時間と進捗を表示する（GUIスレッドで実行）"""
+    if audio_job is None:
+        return
+    lines = [f"経過時間: {format_elapsed_time(time.time() - audio_progress['start_time'])}"]
+    parts = audio_progress['parts']
+    if audio_job.cancelled:
+        lines.append("キャンセルしています...")
+    elif audio_progress['extracting']:
+        lines.append("情報を抽出しています...")
+    elif parts:
+        progress = f"分割 {audio_progress['split']}/{parts}　文字起こし {audio_progress['transcribed']}/{parts}"
+        if audio_progress['failed']:
+            progress += f"（失敗{audio_progress['failed']}）"
+        lines.append(progress)
+    if audio_progress['retries']:
+        lines.append(f"再試行 {audio_progress['retries']}回")
+    uploading_label.config(text="\n".join(lines))
 
-def process_xlsx_file_async(xlsx_file):
-    template_path = os.path.join(get_current_dir(), 'テンプレート.docx')  # dist直下から取得
-    output_path = os.path.join(Path.home(), 'Documents', f"{os.path.splitext(os.path.basename(xlsx_file))[0]}_議事録.docx")
-    
-    success = create_minutes(xlsx_file, template_path, output_path)
-    elapsed_time_label.config(text="")
+def update_elapsed_time(control):
+    """controlの処理が終わるまで、1秒ごとに経過時間を更新する（GUIスレッドで実行）"""
+    if audio_job is not control:
+        return
+    refresh_audio_status()
+    root.after(1000, update_elapsed_time, control)
+
+def finish_audio_processing(control, success):
+    """音声ファイルの処理の終了を表示する（GUIスレッドで実行）"""
+    global audio_job
+    if audio_job is not control:
+        return
+    total_elapsed_time = format_elapsed_time(time.time() - audio_progress['start_time'])
+    audio_job = None
+    cancel_button.config(state="disabled")
+    if control.cancelled:
+        uploading_label.config(text=f"処理をキャンセルしました（{total_elapsed_time}）")
+        messagebox.showinfo("キャンセル", "音声ファイルの処理をキャンセルしました。")
+        return
+    uploading_label.config(text=f"処理にかかった時間: {total_elapsed_time}で処理が完了しました")
     if success:
-        root.after(0, lambda: (messagebox.showinfo("完了", "議事録の作成が完了しました。"), show_main_menu()))
+        messagebox.showinfo("完了", "ファイルのアップロードが完了しました。")
+        show_main_menu()
     else:
         messagebox.showerror("エラー", "ファイルの処理中にエラーが発生しました。")
 
-def main():
+def handle_gui_event(event, data):
+    """作業スレッドから届いたイベントを画面に反映する（GUIスレッドで実行）"""
+    if event == 'audio_done':
+        finish_audio_processing(data['control'], data['success'])
+    elif event == 'xlsx_done':
+        elapsed_time_label.config(text="")
+        if data['success']:
+            messagebox.showinfo("完了", "議事録の作成が完了しました。")
+            show_main_menu()
+        else:
+            messagebox.showerror("エラー", "ファイルの処理中にエラーが発生しました。")
+    elif audio_job is not None:
+        if event == 'planned':
+            audio_progress['parts'] = data['parts']
+        elif event == 'split':
+            audio_progress['split'] += 1
+        elif event == 'transcribed':
+            audio_progress['transcribed' if data['success'] else 'failed'] += 1
+        elif event == 'retry':
+            audio_progress['retries'] += 1
+        elif event == 'extracting':
+            audio_progress['extracting'] = True
+        refresh_audio_status()
+
+def poll_gui_events():
+    """作業スレッドから届いたイベントを処理し、次の確認を予約する（GUIスレッドで実行）"""
+    try:
+        gui_events.drain(handle_gui_event)
+    except Exception:
+        logging.exception("GUIイベントの処理中にエラーが発生しました。")
+    root.after(GUI_POLL_INTERVAL_MS, poll_gui_events)
+
+def close_window():
+    """ウィンドウを閉じる（処理中の音声ファイルがあればキャンセルする）"""
+    if audio_job is not None:
+        audio_job.cancel()
+    root.destroy()
+
+def load_tkinter():
+    """GUIで使うtkinterを読み込む関数（ヘッドレス実行ではtkinterを読み込まない）"""
+    global tk, ttk, filedialog, messagebox, font
+    import tkinter as tk
+    from tkinter import ttk, filedialog, messagebox, font
+
+def run_gui():
     global root
+    load_tkinter()
     try:
         root = tk.Tk()
         # フォントの設定
@@ -646,11 +4095,119 @@ def main():
         
         configure_styles()
         show_main_menu()
+        root.protocol("WM_DELETE_WINDOW", close_window)
+        root.after(GUI_POLL_INTERVAL_MS, poll_gui_events)
         root.mainloop()
     except Exception as e:
         logging.exception("アプリケーションの実行中にエラーが発生しました。")
         messagebox.showerror("エラー", f"アプリケーションの実行中にエラーが発生しました:\n{str(e)}")
         logging.error(f"アプリケーションの起動時にエラーが発生しました: {str(e)}")
 
+def run_batch(inputs, jobs, watch=False, interval=30.0, combine_path=None):
+    """音声ファイルをまとめて処理する関数（GUIを使わない）
+
+    最大jobs件の録音を同時に処理する。API呼び出しはすべての録音で共有のキープールを通るため、
+    同時リクエスト数はキーの数とキーごとの同時実行数の範囲に収まる。
+    watch=Trueの場合は、新しく置かれたファイルを待ち続ける（Ctrl+Cで終了）。
+    combine_pathを指定すると、処理した録音の抽出結果を1つのExcelファイル（会議ごとのシート＋目次）にもまとめる。
+    """
+    job_store = get_job_store()
+    workbook = ConsolidatedWorkbook(combine_path) if combine_path else None
+    submitted = set()
+    pending_sizes = {}  # 書き込み中のファイルを避けるため、サイズが変わらなくなってから処理する
+    results = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = {}
+        try:
+            while True:
+                candidates = [path for path in collect_audio_files(inputs) if path not in submitted]
+                unprocessed = set(job_store.unprocessed([os.path.basename(path) for path in candidates]))
+                for path in candidates:
+                    name = os.path.basename(path)
+                    if name not in unprocessed:
+                        logging.info(f"{name}は処理済みのためスキップします。")
+                        submitted.add(path)
+                        continue
+                    if watch:
+                        size = os.path.getsize(path)
+                        if pending_sizes.get(path) != size or size == 0:
+                            pending_sizes[path] = size
+                            continue
+                    submitted.add(path)
+                    logging.info(f"{name}を処理待ちに追加しました。")
+                    futures[executor.submit(process_audio_file, path, job_store, False, workbook)] = path
+
+                for future in [f for f in futures if f.done()]:
+                    results[futures.pop(future)] = future.result()
+
+                if not watch:
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            logging.info("中断しました。処理中のファイルが終わるまで待ちます。")
+            for future in futures:
+                future.cancel()
+
+        for future in concurrent.futures.as_completed(futures):
+            if not future.cancelled():
+                results[futures[future]] = future.result()
+
+    if workbook is not None:
+        workbook.close()
+    get_tracer().write_metrics()
+
+    succeeded = sum(1 for success in results.values() if success)
+    logging.info(f"一括処理が終了しました: 成功{succeeded}件、失敗{len(results) - succeeded}件")
+    return succeeded == len(results)
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="爆速議事録（引数なしで起動するとGUIを表示します）")
+    subparsers = parser.add_subparsers(dest='command')
+
+    batch_parser = subparsers.add_parser('batch', help="音声ファイルをまとめて処理する（GUIなし）")
+    batch_parser.add_argument('inputs', nargs='+', help="音声ファイル（.mp3/.wav）、ディレクトリ、またはグロブ")
+    batch_parser.add_argument('--jobs', type=int, default=get_env_int('MINUTES_BATCH_JOBS', 2), help="同時に処理する録音の数")
+    batch_parser.add_argument('--watch', action='store_true', help="新しく置かれたファイルを待ち続けて処理する")
+    batch_parser.add_argument('--interval', type=float, default=30.0, help="監視モードでの確認間隔（秒）")
+    batch_parser.add_argument('--combine', metavar='XLSX', help="処理した録音の抽出結果をまとめるExcelファイル")
+
+    minutes_parser = subparsers.add_parser('minutes', help="Excelファイルから議事録をまとめて作成する（GUIなし）")
+    minutes_parser.add_argument('inputs', nargs='+', help="Excelファイル（.xlsx）、ディレクトリ、またはグロブ")
+    minutes_parser.add_argument('--output-dir', help="議事録の保存先（省略時はドキュメントフォルダ）")
+    minutes_parser.add_argument('--jobs', type=int, default=get_env_int('MINUTES_BULK_JOBS', 0), help="使うプロセス数（省略時はCPUのコア数）")
+    minutes_parser.add_argument('--template', help="テンプレート（省略時はテンプレート.docx）")
+    minutes_parser.add_argument('--report', help="集計レポート（CSV）の保存先")
+
+    live_parser = subparsers.add_parser('live', help="録音中のファイルを追いかけて文字起こしする（録音の終了後すぐに議事録を作成する）")
+    live_parser.add_argument('recording', help="録音中の音声ファイル（--captureを指定した場合は録音の保存先）")
+    live_parser.add_argument('--capture', metavar='FORMAT:DEVICE', help="FFmpegで録音する入力（例: pulse:default、dshow:audio=マイク）")
+    live_parser.add_argument('--segment-minutes', type=float, help="録音中に文字起こしする区間の長さ（分、既定はMINUTES_LIVE_SEGMENT_MINUTESまたは5）")
+    live_parser.add_argument('--idle-seconds', type=float, help="録音ファイルが増えなくなってから録音の終了とみなすまでの時間（秒）")
+    live_parser.add_argument('--interval', type=float, help="録音ファイルを確認する間隔（秒）")
+
+    trace_parser = subparsers.add_parser('trace-summary', help="トレースファイルからステージごとの所要時間（p50/p95）を集計する")
+    trace_parser.add_argument('trace_file', nargs='?', help="トレースファイル（省略時はMINUTES_TRACE_FILEまたはドキュメントフォルダのminutes_trace.jsonl）")
+    trace_parser.add_argument('--since-hours', type=float, help="直近の指定時間内の記録だけを集計する")
+    return parser
+
+def main(argv=None):
+    setup_logging()
+    load_config()
+    args = build_arg_parser().parse_args(argv)
+    if args.command == 'batch':
+        return 0 if run_batch(args.inputs, args.jobs, watch=args.watch, interval=args.interval, combine_path=args.combine) else 1
+    if args.command == 'live':
+        return 0 if run_live(args.recording, args.capture, args.segment_minutes, args.idle_seconds, args.interval) else 1
+    if args.command == 'minutes':
+        return 0 if run_bulk_minutes(args.inputs, args.output_dir, args.jobs, args.template, args.report) else 1
+    if args.command == 'trace-summary':
+        print_trace_summary(args.trace_file or os.environ.get('MINUTES_TRACE_FILE') or documents_path / 'minutes_trace.jsonl', args.since_hours)
+        return 0
+    run_gui()
+    return 0
+
 if __name__ == "__main__":
-    main()
+    # PyInstallerで固めた実行ファイルでもプロセスプールを使えるようにする
+    multiprocessing.freeze_support()
+    sys.exit(main())
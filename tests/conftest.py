@@ -0,0 +1,8 @@
+import os
+import sys
+
+# テストではトレース・キャッシュ・ジョブの記録をディスクに残さない
+os.environ.setdefault('MINUTES_TRACE', '0')
+os.environ.setdefault('MINUTES_CACHE', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,55 @@
+"""各リクエストが、キープールが割り当てたAPIキーで送信されることをローカルのスタブで確認する
+
+同時に送るリクエストをキーの設定の後・送信の前で揃えてから送るため、genai.configureでプロセス全体の
+キーを切り替える従来の方式では必ずキーを取り違える。キーごとのクライアントを使う方式では取り違えない。
+"""
+import pytest
+
+import benchmark
+import minutes_app
+
+KEYS = [f"stub-key-{i + 1}" for i in range(4)]
+CHUNKS = 12
+
+
+@pytest.fixture
+def stub_server(monkeypatch):
+    server, environment = benchmark.start_stub_server(latency=0.01)
+    for name, value in environment.items():
+        monkeypatch.setenv(name, value)
+    yield server
+    server.shutdown()
+
+
+def send_held(stub_server, backend, tmp_path):
+    key_pool = minutes_app.ApiKeyPool(KEYS)
+    with benchmark.hold_requests_before_send(key_pool.capacity):
+        recorder, results = benchmark.send_key_chunks(backend, key_pool, CHUNKS, str(tmp_path), part_kb=4)
+    assert all(results)
+    assert len(stub_server.received) == CHUNKS
+    return benchmark.find_key_mismatches(stub_server.received, recorder.assigned)
+
+
+def test_legacy_global_configure_sends_with_the_wrong_key(stub_server, tmp_path):
+    mismatches = send_held(stub_server, benchmark.LegacyGlobalBackend(), tmp_path)
+    # 揃えた件数のうち、最後にキーを設定した1件以外は他のスレッドのキーで届く
+    assert len(mismatches) == CHUNKS - CHUNKS // len(KEYS)
+
+
+def test_isolated_clients_send_with_the_leased_key(stub_server, tmp_path):
+    assert minutes_app.supports_isolated_clients()
+    assert send_held(stub_server, minutes_app.GenaiBackend(), tmp_path) == []
+
+
+def test_unusable_sdk_falls_back_to_worker_processes(monkeypatch, caplog):
+    minutes_app.load_genai()
+    # GenerativeModelが差し替えたクライアントを使わないSDKを模す
+    monkeypatch.setattr(minutes_app.genai.GenerativeModel, 'generate_content', lambda self, *args, **kwargs: None)
+    monkeypatch.setenv('GEMINI_CLIENT_MODE', 'thread')
+    assert not minutes_app.supports_isolated_clients()
+    backend = minutes_app.create_default_backend()
+    try:
+        assert isinstance(backend, minutes_app.ProcessGenaiBackend)
+        assert "ワーカープロセスで呼び出します" in caplog.text
+    finally:
+        backend.shutdown()
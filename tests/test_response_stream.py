@@ -0,0 +1,52 @@
+"""応答を見切った後の受信用スレッドの後始末と、重複リクエストが終わるまでの削除の先送りを確認する"""
+import concurrent.futures
+import logging
+import threading
+import types
+
+import pytest
+
+from minutes_app import ResponseStream, StragglerHedger, StreamChunk, StreamStalledError
+
+
+def blocking_chunks(release):
+    """最初のテキストを返した後、releaseがセットされるまで止まる応答"""
+    yield StreamChunk('途中まで', None)
+    release.wait()
+
+
+def test_stalled_reader_is_joined_after_cancel(tmp_path, caplog):
+    release = threading.Event()
+    stream = ResponseStream(str(tmp_path / 'a.partial.txt'), first_token_timeout=1.0, stall_timeout=0.1, cancel_join_timeout=1.0)
+
+    with caplog.at_level(logging.WARNING), pytest.raises(StreamStalledError):
+        stream.consume(blocking_chunks(release), cancel=release.set)
+
+    assert not [t for t in threading.enumerate() if t.name == 'response-stream']
+    assert '打ち切れませんでした' not in caplog.text
+
+
+def test_reader_left_alive_is_logged(tmp_path, caplog):
+    release = threading.Event()
+    stream = ResponseStream(str(tmp_path / 'a.partial.txt'), first_token_timeout=1.0, stall_timeout=0.1, cancel_join_timeout=0.1)
+    try:
+        with caplog.at_level(logging.WARNING), pytest.raises(StreamStalledError):
+            stream.consume(blocking_chunks(release), cancel=lambda: None)
+        assert '打ち切れませんでした' in caplog.text
+    finally:
+        release.set()
+
+
+def test_when_settled_runs_every_callback_after_losers_finish():
+    hedger = StragglerHedger(types.SimpleNamespace(capacity=1), chunk_count=1)
+    loser = concurrent.futures.Future()
+    hedger._losers['part1.mp3'] = [loser]
+    called = []
+    try:
+        hedger.when_settled('part1.mp3', lambda: called.append('spills'))
+        hedger.when_settled('part1.mp3', lambda: called.append('part'))
+        assert called == []
+        loser.set_result(None)
+        assert called == ['spills', 'part']
+    finally:
+        hedger.shutdown()
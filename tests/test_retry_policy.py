@@ -0,0 +1,178 @@
+"""RetryPolicy・classify_error・get_retry_delay_hintと、call_with_key_poolの再試行を偽の時計で確認する"""
+import types
+
+import pytest
+
+from minutes_app import (
+    ERROR_INVALID_KEY, ERROR_PERMANENT, ERROR_QUOTA, ERROR_STALLED, ERROR_TRANSIENT,
+    ApiKeyPool, JobCancelled, JobControl, RetryPolicy, StreamStalledError, call_with_key_pool, classify_error, get_retry_delay_hint
+)
+
+
+class FakeApiError(Exception):
+    def __init__(self, code, message='error', headers=None):
+        super().__init__(message)
+        self.code = code
+        self.response = types.SimpleNamespace(headers=headers) if headers is not None else None
+
+
+class FakeClock:
+    """sleepで進むだけの時計"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def make_policy(clock, **overrides):
+    settings = dict(max_attempts=4, base_delay=2.0, max_delay=60.0, quota_delay=30.0, jitter=0.0,
+                    sleep=clock.sleep, random_func=lambda: 0.5)
+    settings.update(overrides)
+    return RetryPolicy(**settings)
+
+
+def failing(errors, result='ok'):
+    """errorsを順に送出し、尽きたら(result, 0)を返すoperation"""
+    calls = []
+
+    def operation(api_key):
+        calls.append(api_key)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result, 0
+    operation.calls = calls
+    return operation
+
+
+@pytest.mark.parametrize('error, kind', [
+    (FakeApiError(429), ERROR_QUOTA),
+    (FakeApiError(None, 'Resource has been exhausted (e.g. check quota).'), ERROR_QUOTA),
+    (FakeApiError(401), ERROR_INVALID_KEY),
+    (FakeApiError(400, 'API key not valid. Please pass a valid API key.'), ERROR_INVALID_KEY),
+    (FakeApiError(400), ERROR_PERMANENT),
+    (FakeApiError('413'), ERROR_PERMANENT),
+    (FileNotFoundError('part.opus'), ERROR_PERMANENT),
+    (FakeApiError(503), ERROR_TRANSIENT),
+    (TimeoutError('timed out'), ERROR_TRANSIENT),
+    (StreamStalledError('stalled'), ERROR_STALLED),
+])
+def test_classify_error(error, kind):
+    assert classify_error(error) == kind
+
+
+def test_retry_delay_hint_sources():
+    assert get_retry_delay_hint(FakeApiError(429, headers={'Retry-After': '12'})) == 12.0
+    assert get_retry_delay_hint(FakeApiError(429, 'retry_delay { seconds: 27 }')) == 27.0
+    assert get_retry_delay_hint(FakeApiError(429, 'Please retry in 3.5s.')) == 3.5
+    assert get_retry_delay_hint(FakeApiError(503)) is None
+
+
+def test_backoff_grows_exponentially():
+    policy = make_policy(FakeClock())
+    assert [policy.backoff(ERROR_TRANSIENT, attempt) for attempt in range(1, 5)] == [2.0, 4.0, 8.0, 16.0]
+    assert [policy.backoff(ERROR_QUOTA, attempt) for attempt in range(1, 3)] == [30.0, 60.0]
+
+
+def test_backoff_is_capped():
+    policy = make_policy(FakeClock(), max_delay=10.0)
+    assert policy.backoff(ERROR_TRANSIENT, 3) == 8.0
+    assert policy.backoff(ERROR_TRANSIENT, 4) == 10.0
+    assert policy.backoff(ERROR_TRANSIENT, 20) == 10.0
+    assert policy.backoff(ERROR_QUOTA, 1) == 10.0
+
+
+def test_backoff_jitter_stays_within_range():
+    low = make_policy(FakeClock(), jitter=0.5, random_func=lambda: 0.0)
+    high = make_policy(FakeClock(), jitter=0.5, random_func=lambda: 1.0)
+    assert low.backoff(ERROR_TRANSIENT, 2) == 2.0
+    assert high.backoff(ERROR_TRANSIENT, 2) == 4.0
+
+
+def test_hint_takes_precedence_over_backoff():
+    policy = make_policy(FakeClock(), jitter=0.5, max_hint_delay=100.0)
+    assert policy.backoff(ERROR_TRANSIENT, 3, hint=7.0) == 7.0
+    assert policy.backoff(ERROR_QUOTA, 1, hint=1.0) == 1.0
+    assert policy.backoff(ERROR_TRANSIENT, 1, hint=1000.0) == 100.0
+    assert policy.backoff(ERROR_TRANSIENT, 1, hint=-5.0) == 0.0
+
+
+def test_should_retry_per_class():
+    policy = make_policy(FakeClock(), max_attempts=3)
+    assert not policy.should_retry(ERROR_PERMANENT, 1)
+    for kind in (ERROR_QUOTA, ERROR_TRANSIENT, ERROR_INVALID_KEY, ERROR_STALLED):
+        assert policy.should_retry(kind, 2)
+        assert not policy.should_retry(kind, 3)
+
+
+def test_transient_errors_back_off_on_the_fake_clock():
+    clock = FakeClock()
+    pool = ApiKeyPool(['k1', 'k2'], failure_threshold=100)
+    operation = failing([FakeApiError(503)] * 3)
+    assert call_with_key_pool(operation, pool, make_policy(clock), "テスト") == 'ok'
+    assert clock.sleeps == [2.0, 4.0, 8.0]
+    assert len(operation.calls) == 4
+
+
+def test_job_control_keeps_the_injected_clock():
+    clock = FakeClock()
+    pool = ApiKeyPool(['k1'], failure_threshold=100)
+    operation = failing([FakeApiError(503)] * 2)
+    assert call_with_key_pool(operation, pool, make_policy(clock), "テスト", control=JobControl()) == 'ok'
+    assert clock.sleeps == [2.0, 4.0]
+
+
+def test_cancel_during_backoff_stops_retrying():
+    control = JobControl()
+    clock = FakeClock()
+
+    def sleep(seconds):
+        clock.sleep(seconds)
+        control.cancel()
+
+    pool = ApiKeyPool(['k1'], failure_threshold=100)
+    operation = failing([FakeApiError(503)] * 3)
+    with pytest.raises(JobCancelled):
+        call_with_key_pool(operation, pool, make_policy(clock, sleep=sleep), "テスト", control=control)
+    assert len(operation.calls) == 1
+    assert clock.sleeps == [2.0]
+
+
+def test_transient_errors_give_up_after_max_attempts():
+    clock = FakeClock()
+    pool = ApiKeyPool(['k1'], failure_threshold=100)
+    operation = failing([FakeApiError(503)] * 10)
+    with pytest.raises(FakeApiError):
+        call_with_key_pool(operation, pool, make_policy(clock, max_attempts=3), "テスト")
+    assert len(operation.calls) == 3
+    assert clock.sleeps == [2.0, 4.0]
+
+
+def test_transient_error_waits_for_server_hint():
+    clock = FakeClock()
+    pool = ApiKeyPool(['k1'], failure_threshold=100)
+    operation = failing([FakeApiError(503, 'Please retry in 5s')])
+    assert call_with_key_pool(operation, pool, make_policy(clock), "テスト") == 'ok'
+    assert clock.sleeps == [5.0]
+
+
+def test_permanent_error_is_not_retried():
+    clock = FakeClock()
+    pool = ApiKeyPool(['k1', 'k2'])
+    operation = failing([FakeApiError(400)])
+    with pytest.raises(FakeApiError):
+        call_with_key_pool(operation, pool, make_policy(clock), "テスト")
+    assert len(operation.calls) == 1
+    assert clock.sleeps == []
+
+
+def test_quota_and_invalid_key_switch_keys_without_sleeping():
+    clock = FakeClock()
+    pool = ApiKeyPool(['k1', 'k2', 'k3'])
+    operation = failing([FakeApiError(429), FakeApiError(401)])
+    assert call_with_key_pool(operation, pool, make_policy(clock), "テスト") == 'ok'
+    assert clock.sleeps == []
+    assert len(set(operation.calls)) == 3
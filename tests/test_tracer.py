@@ -0,0 +1,31 @@
+"""トレースファイルの上限サイズでの切り替えを確認する"""
+import os
+
+from minutes_app import Tracer, get_rotated_trace_path, summarize_trace
+
+
+def test_trace_file_is_rotated_at_max_bytes(tmp_path):
+    trace_path = str(tmp_path / 'trace.jsonl')
+    tracer = Tracer(trace_path, max_bytes=2000)
+    for i in range(60):
+        with tracer.span('stage', index=i):
+            pass
+
+    assert os.path.getsize(get_rotated_trace_path(trace_path)) >= 2000
+    assert os.path.getsize(trace_path) < 2000
+    # 1世代前より古い記録は残さない
+    summary, _ = summarize_trace(trace_path)
+    assert 0 < summary[0]['count'] < 60
+    assert not os.path.exists(trace_path + '.2')
+
+
+def test_trace_file_grows_without_limit_when_max_bytes_is_zero(tmp_path):
+    trace_path = str(tmp_path / 'trace.jsonl')
+    tracer = Tracer(trace_path)
+    for i in range(60):
+        with tracer.span('stage', index=i):
+            pass
+
+    assert not os.path.exists(get_rotated_trace_path(trace_path))
+    summary, _ = summarize_trace(trace_path)
+    assert summary[0]['count'] == 60